@@ -0,0 +1,218 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from config import DATA_DIR
+from geo import GridIndex
+
+# 實價登錄 (transform_plvr 的輸出) 統計：
+#   rollup / precompute_rollups  依 縣市 / 行政區 / 社區名稱 / 交易年月 分組的筆數、建物單價分位數、解約率
+#   TransactionIndex             以網格索引查詢預售屋建案半徑 R 公尺內的所有交易，大量建案時分給多個行程
+
+# 除了中位數以外另外計算的分位數
+PERCENTILES = (0.25, 0.75, 0.9)
+
+# 預先計算的分組層級
+ROLLUP_LEVELS = {
+    'city': ['縣市'],
+    'district': ['縣市', '行政區'],
+    'community': ['縣市', '行政區', '社區名稱'],
+    'city_month': ['縣市', '交易年月'],
+    'district_month': ['縣市', '行政區', '交易年月'],
+    'community_month': ['縣市', '行政區', '社區名稱', '交易年月'],
+}
+
+
+def _percentile_name(q):
+    return f'建物單價_p{q * 100:g}'
+
+
+def stat_columns(percentiles=PERCENTILES):
+    """ rollup 與 score_projects 輸出的統計欄位 """
+    return (['筆數', '建物單價中位數'] + [_percentile_name(q) for q in percentiles]
+            + ['交易總價中位數', '解約筆數', '解約率'])
+
+
+def _prices(df):
+    """ 建物單價與交易總價的 float 陣列，缺值為 NaN """
+    return (df['建物單價'].to_numpy(dtype=float, na_value=np.nan),
+            df['交易總價'].to_numpy(dtype=float, na_value=np.nan))
+
+
+def cancelled(df):
+    """ 各筆交易是否已解約 (解約情形 有內容) """
+    status = df['解約情形']
+    return (status.notna() & (status.astype(str).str.strip() != '')).to_numpy()
+
+
+@metrics.timed()
+def rollup(df, by, percentiles=PERCENTILES):
+    """ 依 by 分組計算 筆數、建物單價中位數與分位數、交易總價中位數、解約筆數與解約率
+
+    :param df: transform_plvr 的輸出 (plvr_output)
+    :param by: 分組欄位，例如 ['縣市', '行政區']
+    :param percentiles: 中位數以外的分位數，例如 (0.25, 0.75, 0.9)
+    :return stats: 以 by 為 index 的 DataFrame，欄位為 stat_columns(percentiles)
+    """
+    unit_price, total_price = _prices(df)
+    frame = pd.DataFrame({
+        '建物單價': unit_price,
+        '交易總價': total_price,
+        '解約': cancelled(df).astype(np.int64),
+    }, index=df.index)
+    keys = [df[column] for column in by]
+    # category 欄位只保留實際出現的組合
+    grouped = frame.groupby(keys, observed=True, sort=True)
+
+    quantiles = grouped['建物單價'].quantile([0.5, *percentiles]).unstack()
+    stats = pd.DataFrame({
+        '筆數': grouped.size(),
+        '建物單價中位數': quantiles[0.5],
+        **{_percentile_name(q): quantiles[q] for q in percentiles},
+        '交易總價中位數': grouped['交易總價'].median(),
+        '解約筆數': grouped['解約'].sum(),
+    })
+    stats['解約率'] = stats['解約筆數'] / stats['筆數']
+    return stats[stat_columns(percentiles)]
+
+
+def precompute_rollups(df, levels=ROLLUP_LEVELS, percentiles=PERCENTILES):
+    """ 一次計算所有層級的 rollup
+
+    :return rollups: {層級名稱: rollup DataFrame}
+    """
+    return {name: rollup(df, by, percentiles) for name, by in levels.items()}
+
+
+def write_rollups(rollups, snapshot=None, base_dir=DATA_DIR):
+    """ 將 precompute_rollups 的結果寫成分區 Parquet，資料集名稱為 plvr_rollup_<層級>
+
+    :return paths: {層級名稱: 資料集目錄}
+    """
+    from storage import write_dataset
+    return {name: write_dataset(stats.reset_index(), f'plvr_rollup_{name}', snapshot=snapshot, base_dir=base_dir)
+            for name, stats in rollups.items()}
+
+
+# ---- 半徑查詢 ----
+
+def _summarize(indices, unit_price, total_price, is_cancelled, percentiles):
+    """ 一組交易索引的統計值，順序同 stat_columns """
+    count = len(indices)
+    if count == 0:
+        return [0, *[np.nan] * (len(percentiles) + 2), 0, np.nan]
+    prices = unit_price[indices]
+    prices = prices[~np.isnan(prices)]
+    if len(prices):
+        quantiles = list(np.quantile(prices, [0.5, *percentiles]))
+    else:
+        quantiles = [np.nan] * (len(percentiles) + 1)
+    totals = total_price[indices]
+    totals = totals[~np.isnan(totals)]
+    cancel_count = int(is_cancelled[indices].sum())
+    return [count, *quantiles, float(np.median(totals)) if len(totals) else np.nan, cancel_count, cancel_count / count]
+
+
+# 行程池中每個 worker 各自保有一份索引 (由 initializer 建立一次，之後的批次共用)
+_worker_index = None
+
+
+def _init_worker(lat, lon, unit_price, total_price, is_cancelled, cell_m):
+    global _worker_index
+    _worker_index = (GridIndex(lat, lon, cell_m=cell_m), unit_price, total_price, is_cancelled)
+
+
+def _query_batch(lat, lon, radius_m, percentiles, with_pairs, state=None):
+    """ 查詢一批建案：回傳 (統計值清單, 交易索引清單或 None, 距離清單或 None) """
+    grid, unit_price, total_price, is_cancelled = state or _worker_index
+    stats, pairs, distances = [], [], []
+    for project_lat, project_lon in zip(lat, lon):
+        indices, distance = grid.query_radius(project_lat, project_lon, radius_m)
+        stats.append(_summarize(indices, unit_price, total_price, is_cancelled, percentiles))
+        if with_pairs:
+            pairs.append(indices)
+            distances.append(distance)
+    return stats, (pairs if with_pairs else None), (distances if with_pairs else None)
+
+
+class TransactionIndex():
+    """ 實價登錄交易的經緯度網格索引，查詢建案半徑內的交易並計算統計值
+
+    用法：
+        index = TransactionIndex(plvr_df)
+        nearby = index.within(25.04, 121.56, 500)                 # 單一地點 500 公尺內的交易
+        scores = index.score_projects(presale_df, 500, workers=4)  # 每個建案 500 公尺內的統計
+    """
+    def __init__(self, transactions, lat_col='緯度', lon_col='經度', cell_m=500):
+        """
+        :param transactions: transform_plvr 的輸出 (plvr_output)
+        :param cell_m: 網格邊長 (公尺)，約為常用的查詢半徑即可
+        """
+        self.transactions = transactions
+        self.cell_m = cell_m
+        self.lat = pd.to_numeric(transactions[lat_col], errors='coerce').to_numpy(dtype=float)
+        self.lon = pd.to_numeric(transactions[lon_col], errors='coerce').to_numpy(dtype=float)
+        self.unit_price, self.total_price = _prices(transactions)
+        self.is_cancelled = cancelled(transactions)
+        self.grid = GridIndex(self.lat, self.lon, cell_m=cell_m)
+
+    def within(self, lat, lon, radius_m):
+        """ 半徑 radius_m 內的交易，依距離由近到遠排序，加上 distance_m 欄位 """
+        indices, distances = self.grid.query_radius(lat, lon, radius_m)
+        nearby = self.transactions.iloc[indices].copy()
+        nearby['distance_m'] = distances
+        return nearby
+
+    @metrics.timed()
+    def score_projects(self, projects, radius_m, lat_col='緯度', lon_col='經度', percentiles=PERCENTILES,
+                       workers=None, batch_size=500, with_pairs=False):
+        """ 計算每個建案半徑 radius_m 內交易的統計值
+
+        :param projects: 建案 DataFrame (例如 presale_output)
+        :param radius_m: 查詢半徑 (公尺)
+        :param percentiles: 中位數以外的建物單價分位數
+        :param workers: 行程數，預設為 CPU 數；1 表示在目前行程內計算
+        :param batch_size: 每個批次的建案數
+        :param with_pairs: 是否一併回傳每個建案半徑內的所有交易
+        :return stats: 與 projects 同 index 的 DataFrame，欄位為 stat_columns(percentiles)
+        :return pairs: with_pairs 時另外回傳 (project_index, transaction_index, distance_m) 的 DataFrame，
+                       transaction_index 為 transactions 的 index
+        """
+        lat = pd.to_numeric(projects[lat_col], errors='coerce').to_numpy(dtype=float)
+        lon = pd.to_numeric(projects[lon_col], errors='coerce').to_numpy(dtype=float)
+        percentiles = tuple(percentiles)
+        workers = workers or os.cpu_count() or 1
+        batches = [slice(start, start + batch_size) for start in range(0, len(lat), batch_size)]
+
+        if workers <= 1 or len(batches) <= 1:
+            state = (self.grid, self.unit_price, self.total_price, self.is_cancelled)
+            results = [_query_batch(lat[batch], lon[batch], radius_m, percentiles, with_pairs, state)
+                       for batch in batches]
+        else:
+            # 交易陣列只在建立 worker 時傳送一次，之後每個批次只傳建案坐標與統計結果
+            initargs = (self.lat, self.lon, self.unit_price, self.total_price, self.is_cancelled, self.cell_m)
+            with ProcessPoolExecutor(max_workers=min(workers, len(batches)), initializer=_init_worker,
+                                     initargs=initargs) as executor:
+                results = list(executor.map(_query_batch, [lat[batch] for batch in batches],
+                                            [lon[batch] for batch in batches], [radius_m] * len(batches),
+                                            [percentiles] * len(batches), [with_pairs] * len(batches)))
+
+        rows = [row for stats, _, _ in results for row in stats]
+        stats = pd.DataFrame(rows, columns=stat_columns(percentiles), index=projects.index)
+        stats = stats.astype({'筆數': np.int64, '解約筆數': np.int64})
+        if not with_pairs:
+            return stats
+
+        pair_indices = [indices for _, batch_pairs, _ in results for indices in batch_pairs]
+        pair_distances = [distances for _, _, batch_distances in results for distances in batch_distances]
+        counts = [len(indices) for indices in pair_indices]
+        flat = np.concatenate(pair_indices) if pair_indices else np.empty(0, dtype=np.int64)
+        pairs = pd.DataFrame({
+            'project_index': np.repeat(projects.index.to_numpy(), counts),
+            'transaction_index': self.transactions.index.to_numpy()[flat],
+            'distance_m': np.concatenate(pair_distances) if pair_distances else np.empty(0),
+        })
+        return stats, pairs
@@ -0,0 +1,582 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import resource
+import threading
+import multiprocessing
+from urllib.parse import urlparse, parse_qs, unquote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from config import DATA_DIR, column_names, urls_1140412
+
+# 離線效能測試：以固定亂數種子產生的 fixture (SaleData / list-search / detail-info) 由本機 HTTP stub 提供，
+# 量測 combined_df、591 搜尋與詳情、預售屋 / 實價登錄欄位轉換、分析比對與統計的耗時、吞吐量與最大記憶體 (peak RSS)，
+# 並與存下來的 baseline 比較
+#
+# baseline 只代表記錄當時的那台機器 (環境記錄在 baseline 的 machine 欄位)，不是可攜的參考值：
+# 耗時先依兩台機器各自量到的 calibration 時間換算後再比較；CPU 數、延遲、Python / pandas 等版本不同時
+# 只列出比較結果，不視為退步。要在新機器上把關退步，請先在該機器上 --save-baseline
+#
+# 例：
+#   python benchmark.py                              # 1k / 100k 兩種規模
+#   python benchmark.py --sizes 1000 100000 1000000  # 加上 1M
+#   python benchmark.py --save-baseline              # 將這次結果存為 baseline
+FIXTURE_DIR = f'{DATA_DIR}/benchmark/fixtures'
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+DETAIL_TEMPLATE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '_newhouse591_detail.json')
+
+CITIES = list(urls_1140412)[:10]
+DISTRICTS = ['中正區', '大安區', '信義區', '板橋區', '竹北市', '西屯區', '北屯區', '前鎮區', '員林市', '東區']
+NAME_CHARS = '華美新城國際公園天璽之森河岸學府富邑豐悅大安信義青山綠水雲頂君品'
+
+
+# ---- fixture ----
+
+def _community_names(n, seed=0):
+    """ n 個不重複的社區名稱 """
+    rng = random.Random(seed)
+    names = set()
+    while len(names) < n:
+        names.add(''.join(rng.sample(NAME_CHARS, rng.randint(3, 6))) + str(rng.randint(0, 99)))
+    return sorted(names)
+
+
+def _roc_date(rng):
+    return f'{rng.randint(108, 114)}{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}'
+
+
+def _sale_period(rng):
+    parts = []
+    if rng.random() < 0.7:
+        parts.append(f'自售: {_roc_date(rng)}~{_roc_date(rng)}')
+    if rng.random() < 0.6:
+        parts.append(f'代銷: {_roc_date(rng)}~')
+    return ';'.join(parts) if parts else rng.choice(['', '備查中'])
+
+
+def presale_rows(n, seed=1):
+    """ 模擬預售屋建案 SaleData (原始英文欄位)，社區名稱為 _community_names(n) """
+    rng = random.Random(seed)
+    names = _community_names(n)
+    rows = []
+    for i, name in enumerate(names):
+        district = rng.choice(DISTRICTS)
+        rows.append({
+            'AA11': rng.choice(['住宅區', '第三種商業區', '乙種工業區']),
+            'addr': f'{district}{rng.choice(["信義路", "文心路", "光明六路"])}{rng.randint(1, 500)}號',
+            'apply': f'{name}建設股份有限公司', 'applydate': _roc_date(rng),
+            'b': f'{district}{rng.randint(1, 999)}地號', 'chkdate': _roc_date(rng) if rng.random() < 0.7 else '',
+            'city': 'A', 'e': _sale_period(rng), 'house': str(rng.randint(10, 800)),
+            'id': f'P{i:07d}', 'idlist': f'P{i:07d}', 'lat': f'{24.5 + rng.random() * 0.8:.6f}',
+            'ldate': _roc_date(rng), 'license': f'{rng.randint(105, 113)}建字第{rng.randint(1, 99999):05d}號',
+            'lon': f'{120.5 + rng.random():.6f}', 'ma': '鋼筋混凝土造', 'mark': f'{name}建設',
+            'name': name, 'pimg': '', 'pu': '住家用', 'sn': str(i), 'subid': '', 'town': 'A01',
+        })
+    return rows
+
+
+def plvr_rows(n, projects, seed=2):
+    """ 模擬預售屋實價登錄 (原始英文欄位)，社區名稱取自 projects 的前 max(n // 20, 50) 個建案 """
+    rng = random.Random(seed)
+    pool = projects[:max(n // 20, 50)]
+    rows = []
+    for i in range(n):
+        project = rng.choice(pool)
+        district = project['addr'][:3]
+        area = rng.uniform(20, 200)
+        unit = rng.randint(300000, 1500000)
+        rows.append({
+            'AA11': project['AA11'], 'a': f'{district}{rng.choice(["信義路", "文心路"])}{rng.randint(1, 500)}號',
+            'b': rng.choice(['住宅大樓(11層含以上有電梯)', '華廈(10層含以下有電梯)']),
+            'bn': project['name'] if rng.random() < 0.95 else '', 'bs': '60.5', 'bu': f'{rng.choice("ABCD")}棟',
+            'cinfo': '' if rng.random() < 0.97 else '112/05/02 解約', 'city': 'A', 'cp': '0',
+            'e': f'{rng.randint(111, 114)}/{rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}', 'es': '55.1',
+            'f': f'{rng.randint(2, 30)}層/{rng.randint(15, 30)}層', 'j': '1', 'k': '1', 'l': '0',
+            'lat': project['lat'], 'lon': project['lon'], 'ma': '鋼筋混凝土造', 'msg': '',
+            'note': '', 'p': f'{unit:,}', 'pimg': '', 'pu': '住家用', 'reid': f'R{i:08d}', 's': f'{area:.2f}',
+            'sq': str(i), 't': '房地(土地+建物)', 'town': 'A01', 'tp': f'{int(unit * area / 3.3058):,}', 'v': '3房2廳2衛',
+        })
+    return rows
+
+
+def _split_by_city(rows):
+    """ 依序平均分給 CITIES """
+    size = -(-len(rows) // len(CITIES))
+    return {city: rows[i * size:(i + 1) * size] for i, city in enumerate(CITIES)}
+
+
+def build_fixtures(sizes, fixture_dir=FIXTURE_DIR):
+    """ 產生 (已存在則略過) 各規模的 SaleData fixture 檔：<fixture_dir>/<kind>/<size>/<城市>.json """
+    for size in sizes:
+        marker = os.path.join(fixture_dir, f'.done_{size}')
+        if os.path.exists(marker):
+            continue
+        print(f"產生 {size} 筆 fixture ...")
+        projects = presale_rows(size)
+        for kind, rows in (('presale', projects), ('plvr', plvr_rows(size, projects))):
+            directory = os.path.join(fixture_dir, kind, str(size))
+            os.makedirs(directory, exist_ok=True)
+            for city, city_rows in _split_by_city(rows).items():
+                with open(os.path.join(directory, f'{city}.json'), 'w', encoding='utf-8') as f:
+                    json.dump(city_rows, f, ensure_ascii=False)
+        open(marker, 'w').close()
+
+
+def fixture_urls(base_url, kind, size):
+    """ combined_df 使用的 {縣市: 網址}，指向 stub 上的 fixture """
+    return {city: f'{base_url}/saledata/{kind}/{size}/{city}.json' for city in CITIES}
+
+
+# ---- 本機 HTTP stub ----
+
+class StubServer():
+    """ 提供 fixture 的本機 HTTP server
+
+    /saledata/<kind>/<size>/<城市>.json   SaleData fixture 檔
+    /home/housing/list-search            list-search 頁面，每個關鍵字 total_page 頁、每頁 per_page 筆
+    /v1/housing/detail-info?id=<hid>     以 _newhouse591_detail.json 為範本的 detail-info
+    /v1/detail/surrounding?id=<hid>      周邊機能
+    /<hid>?roster_type=1                 建案頁面，含連到 community_id (hid + 1000) 的實價登錄連結
+    /v1/price/list?community_id=<id>     實價登錄，total_page 頁、每頁 per_page 筆
+    """
+    def __init__(self, fixture_dir=FIXTURE_DIR, latency=0.0, total_page=3, per_page=20, rate_limit=None,
+                 retry_after=None, fail=None):
+        """
+        :param latency: 每個請求延遲的秒數 (模擬網路與伺服器處理時間)
+        :param rate_limit: 伺服器端每秒最多接受的請求數，超過時回應 429 (模擬站方限流)，None 表示不限
+        :param retry_after: 429 回應的 Retry-After 秒數，None 表示不送此 header
+        :param fail: fail(path, query) 回傳 HTTP 狀態碼時以該狀態碼回應 (模擬特定頁面失敗)，None 表示不失敗
+
+        收到的請求依序記錄在 self.requests：[(time.monotonic(), path), ...]，被拒絕的請求數為 self.rejected
+        """
+        with open(DETAIL_TEMPLATE, encoding='utf-8') as f:
+            detail = json.load(f)
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with server._lock:
+                    now = time.monotonic()
+                    server.requests.append((now, self.path))
+                    accepted = server.rate_limit is None or now >= server._next_allowed
+                    if accepted and server.rate_limit is not None:
+                        server._next_allowed = now + 1 / server.rate_limit
+                    if not accepted:
+                        server.rejected += 1
+                if not accepted:
+                    self.send_response(429)
+                    if server.retry_after is not None:
+                        self.send_header('Retry-After', str(server.retry_after))
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if server.latency:
+                    time.sleep(server.latency)
+                parsed = urlparse(self.path)
+                query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+                status = fail(parsed.path, query) if fail is not None else None
+                if status is not None:
+                    self.send_error(status)
+                    return
+                if parsed.path.startswith('/saledata/'):
+                    path = os.path.join(fixture_dir, *unquote(parsed.path).split('/')[2:])
+                    if not os.path.isfile(path):
+                        self.send_error(404)
+                        return
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(os.path.getsize(path)))
+                    self.end_headers()
+                    with open(path, 'rb') as f:
+                        while True:
+                            chunk = f.read(1 << 16)
+                            if not chunk:
+                                break
+                            self.wfile.write(chunk)
+                    return
+                if parsed.path.endswith('/list-search'):
+                    page = int(query.get('page', 1))
+                    seed = sum(map(ord, query.get('keyword', ''))) * 1000
+                    items = [{'hid': seed + (page - 1) * per_page + i, 'build_name': query.get('keyword', '')}
+                             for i in range(per_page)]
+                    body = {'status': 1, 'data': {'total': total_page * per_page, 'total_page': total_page,
+                                                  'items': items}}
+                elif parsed.path.endswith('/detail-info'):
+                    data = dict(detail['data'], hid=int(query.get('id', 0)))
+                    body = dict(detail, data=data)
+                elif parsed.path.endswith('/surrounding'):
+                    body = {'status': 1, 'data': {'hid': int(query.get('id', 0))}}
+                elif parsed.path.endswith('/price/list'):
+                    page = int(query.get('page', 1))
+                    items = [{'id': f"{query.get('community_id')}-{page}-{i}"} for i in range(per_page)]
+                    body = {'status': 1, 'data': {'total_page': total_page, 'items': items}}
+                elif parsed.path[1:].isdigit():
+                    community_id = int(parsed.path[1:]) + 1000
+                    payload = (f'<section class="market"><a class="status-table" '
+                               f'href="https://market.591.com.tw/control/{community_id}?from=1">實價登錄</a>'
+                               f'</section>').encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/html; charset=utf-8')
+                    self.send_header('Content-Length', str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                    return
+                else:
+                    self.send_error(404)
+                    return
+                payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.requests = []
+        self.rejected = 0
+        self._next_allowed = 0.0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self.base_url = f'http://127.0.0.1:{self._server.server_port}'
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+# ---- 測試項目 (在獨立行程中執行，peak RSS 互不影響) ----
+
+def _offline():
+    """ 關閉快取與全域限速，只量測程式本身 """
+    import http_client
+    http_client.set_cache(False)
+    http_client.set_throttle(False)
+
+
+def _load_fixture(kind, size, fixture_dir=FIXTURE_DIR):
+    import pandas as pd
+    directory = os.path.join(fixture_dir, kind, str(size))
+    frames = []
+    for city in CITIES:
+        with open(os.path.join(directory, f'{city}.json'), encoding='utf-8') as f:
+            frame = pd.DataFrame(json.load(f))
+        frame['city_name'] = city
+        frame['input_time'] = '1140412'
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True)
+
+
+def case_combined_df(size, base_url, stream=False, **kwargs):
+    """ 由 stub 抓取 10 個縣市的 SaleData 並合併 """
+    _offline()
+    from utils import combined_df
+    df = combined_df(fixture_urls(base_url, 'presale', size), '1140412', max_workers=8, rate_per_host=1e6,
+                     columns=list(column_names), stream=stream)
+    return len(df)
+
+
+def case_combined_df_stream(size, base_url, **kwargs):
+    """ combined_df 串流解析版本 """
+    return case_combined_df(size, base_url, stream=True)
+
+
+def case_derive_presale(size, fixture_dir=FIXTURE_DIR, **kwargs):
+    """ 預售屋欄位轉換 (rename + derive_presale_columns) """
+    from utils import derive_presale_columns
+    df = _load_fixture('presale', size, fixture_dir).rename(columns=column_names)
+    start = time.perf_counter()
+    derive_presale_columns(df)
+    return len(df), time.perf_counter() - start
+
+
+def case_transform_plvr(size, fixture_dir=FIXTURE_DIR, **kwargs):
+    """ 實價登錄欄位轉換 (transform_plvr) """
+    from utils import transform_plvr
+    df = _load_fixture('plvr', size, fixture_dir)
+    start = time.perf_counter()
+    transform_plvr(df)
+    return len(df), time.perf_counter() - start
+
+
+def case_merge(size, fixture_dir=FIXTURE_DIR, **kwargs):
+    """ 分析比對：實價登錄 ↔ 預售屋建案 (ProjectMatcher.merge) """
+    from utils import derive_presale_columns, transform_plvr
+    from matcher import ProjectMatcher
+    presale = derive_presale_columns(_load_fixture('presale', size, fixture_dir).rename(columns=column_names))
+    plvr = transform_plvr(_load_fixture('plvr', size, fixture_dir))
+    start = time.perf_counter()
+    merged = ProjectMatcher(presale).merge(plvr, ['戶數', '銷售起始時間', '編號', '起造人', '建照執照'])
+    return len(merged), time.perf_counter() - start
+
+
+def case_rollup(size, fixture_dir=FIXTURE_DIR, **kwargs):
+    """ 實價登錄各層級 rollup (precompute_rollups) """
+    from utils import transform_plvr
+    from aggregate import precompute_rollups
+    plvr = transform_plvr(_load_fixture('plvr', size, fixture_dir))
+    start = time.perf_counter()
+    precompute_rollups(plvr)
+    return len(plvr), time.perf_counter() - start
+
+
+def case_radius(size, fixture_dir=FIXTURE_DIR, workers=1, **kwargs):
+    """ 建案 500 公尺內交易統計 (TransactionIndex.score_projects)，建案數最多 2000，workers 個行程 """
+    from utils import transform_plvr
+    from aggregate import TransactionIndex
+    plvr = transform_plvr(_load_fixture('plvr', size, fixture_dir))
+    projects = _load_fixture('presale', size, fixture_dir).iloc[:2000].rename(columns=column_names)
+    start = time.perf_counter()
+    TransactionIndex(plvr).score_projects(projects, 500, workers=workers)
+    return len(projects), time.perf_counter() - start
+
+
+def case_spider_async(size, base_url, concurrency=4, **kwargs):
+    """ AsyncNewhouse591Spider：搜尋 size 個關鍵字 (每個 3 頁) 再取得所有建案詳情 """
+    _offline()
+    import newhouse591_spider as spider_module
+    spider_module.SEARCH_URL = f'{base_url}/home/housing/list-search'
+    spider_module.DETAIL_URL = f'{base_url}/v1/housing/detail-info'
+
+    async def run():
+        spider = spider_module.AsyncNewhouse591Spider(max_concurrency=concurrency, request_delay=1e-4)
+        spider.limiter.max_rate = 1e6
+        try:
+            results = await spider.search_many([{'keyword': f'K{i}', 'regionid': '1'} for i in range(size)],
+                                               want_page=3)
+            hids = [house['hid'] for total_count, houses in results for house in houses[:1]]
+            details = await spider.get_newhouse_details(hids)
+        finally:
+            spider.close()
+        return len(results) * 3 + len(details)
+
+    return asyncio.run(run())
+
+
+def case_spider_sync(size, base_url, **kwargs):
+    """ resolve_communities：搜尋與詳情兩個執行緒串接 (逐一請求) """
+    _offline()
+    import newhouse591_spider as spider_module
+    from ratelimit import AdaptiveRateLimiter
+    spider_module.SEARCH_URL = f'{base_url}/home/housing/list-search'
+    spider_module.DETAIL_URL = f'{base_url}/v1/housing/detail-info'
+    throttle = AdaptiveRateLimiter(rate=1e4, max_rate=1e6)
+    records = [{'縣市': '1', '社區名稱': f'K{i}'} for i in range(size)]
+    df = spider_module.collect_communities(records, search_spider=spider_module.Newhouse591Spider(throttle),
+                                           detail_spider=spider_module.Newhouse591Spider(throttle))
+    return len(df) * 2
+
+
+# 名稱 -> (函式, 規模換算, 單位, 額外參數)；網路類測試的規模以請求數計，避免 1M 時跑太久
+CASES = {
+    'combined_df': (case_combined_df, lambda size: size, 'rows', {}),
+    'combined_df_stream': (case_combined_df_stream, lambda size: size, 'rows', {}),
+    'derive_presale': (case_derive_presale, lambda size: size, 'rows', {}),
+    'transform_plvr': (case_transform_plvr, lambda size: size, 'rows', {}),
+    'merge': (case_merge, lambda size: size, 'rows', {}),
+    'rollup': (case_rollup, lambda size: size, 'rows', {}),
+    'radius': (case_radius, lambda size: size, 'projects', {}),
+    'radius_w2': (case_radius, lambda size: size, 'projects', {'workers': 2}),
+    'spider_async_c1': (case_spider_async, lambda size: min(size // 10, 200), 'requests', {'concurrency': 1}),
+    'spider_async_c4': (case_spider_async, lambda size: min(size // 10, 200), 'requests', {'concurrency': 4}),
+    'spider_async_c16': (case_spider_async, lambda size: min(size // 10, 200), 'requests', {'concurrency': 16}),
+    'spider_sync': (case_spider_sync, lambda size: min(size // 10, 200), 'requests', {}),
+}
+
+
+def _peak_rss_mb():
+    """ 這個行程的最大記憶體用量 (MB)
+
+    Linux 的 ru_maxrss 會把 fork 時父行程的用量帶進子行程，優先讀 /proc/self/status 的 VmHWM
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024  # macOS 單位為 byte，Linux 為 KB
+
+
+def _run_case(name, size, base_url, fixture_dir, queue):
+    """ 子行程：執行單一測試，回傳耗時與 peak RSS """
+    import io
+    import contextlib
+    func, scale, unit, extra = CASES[name]
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = func(scale(size), base_url=base_url, fixture_dir=fixture_dir, **extra)
+    elapsed = time.perf_counter() - start
+    # 純計算的測試自行回傳 (筆數, 不含載入 fixture 的耗時)
+    count, elapsed = result if isinstance(result, tuple) else (result, elapsed)
+    queue.put({'count': count, 'unit': unit, 'seconds': elapsed, 'throughput': count / elapsed if elapsed else None,
+               'peak_rss_mb': _peak_rss_mb()})
+
+
+def run(sizes, cases=None, latency=0.0, fixture_dir=FIXTURE_DIR):
+    """ 執行效能測試
+
+    :param sizes: SaleData 規模，例如 [1000, 100000, 1000000]
+    :param cases: 要執行的項目名稱，None 表示全部
+    :param latency: stub 每個請求的延遲秒數
+    :return results: {'<項目>@<規模>': {'count', 'unit', 'seconds', 'throughput', 'peak_rss_mb'}}
+    """
+    build_fixtures(sizes, fixture_dir)
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    with StubServer(fixture_dir, latency=latency) as server:
+        for size in sizes:
+            for name in cases or CASES:
+                queue = context.Queue()
+                process = context.Process(target=_run_case, args=(name, size, server.base_url, fixture_dir, queue))
+                process.start()
+                process.join()
+                if process.exitcode != 0:
+                    print(f"{name}@{size}: 執行失敗 (exit code {process.exitcode})")
+                    continue
+                key = f'{name}@{size}'
+                results[key] = queue.get()
+                r = results[key]
+                print(f"{key:<28} {r['seconds']:>8.3f} 秒 {r['throughput']:>12,.0f} {r['unit']}/秒 "
+                      f"peak RSS {r['peak_rss_mb']:>7.1f} MB")
+    return results
+
+
+def _calibrate(rounds=5):
+    """ 固定的 Python 迴圈與 NumPy 排序耗時 (取 rounds 次中最快者)，用來換算不同機器的速度差異 """
+    import numpy as np
+    values = np.random.default_rng(0).random(1 << 20)
+    best = float('inf')
+    for _ in range(rounds):
+        start = time.perf_counter()
+        sum(i * i for i in range(1 << 20))
+        np.sort(values)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+# 影響耗時與記憶體、不同時 baseline 不具可比性的環境欄位
+ENVIRONMENT_KEYS = ('cpus', 'latency', 'python', 'platform', 'processor', 'numpy', 'pandas', 'pyarrow')
+
+
+def environment(latency):
+    """ 這次執行的環境，與結果一起存入 baseline 的 machine 欄位 """
+    import numpy
+    import pandas
+    try:
+        import pyarrow
+        pyarrow_version = pyarrow.__version__
+    except ImportError:
+        pyarrow_version = None
+    return {
+        'cpus': os.cpu_count(),
+        'latency': latency,
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'numpy': numpy.__version__,
+        'pandas': pandas.__version__,
+        'pyarrow': pyarrow_version,
+        'calibration_seconds': _calibrate(),
+        'recorded_at': time.strftime('%Y-%m-%d'),
+    }
+
+
+def environment_differences(machine, baseline_machine):
+    """ 兩個環境不同的欄位：{欄位: (baseline, 這次)} """
+    return {key: (baseline_machine.get(key), machine.get(key)) for key in ENVIRONMENT_KEYS
+            if baseline_machine.get(key) != machine.get(key)}
+
+
+def compare(results, baseline, tolerance=0.2, machine=None, baseline_machine=None):
+    """ 與 baseline 比較，耗時或 peak RSS 超過 baseline (1 + tolerance) 倍視為退步
+
+    耗時依兩次的 calibration_seconds 換算成同一台機器的速度後再比較 (任一方沒有記錄時不換算)
+
+    :param machine: 這次的 environment()
+    :param baseline_machine: baseline 記錄的 machine
+    :return regressions: 退步項目的說明清單
+    """
+    regressions = []
+    speed = 1.0
+    if (machine or {}).get('calibration_seconds') and (baseline_machine or {}).get('calibration_seconds'):
+        speed = machine['calibration_seconds'] / baseline_machine['calibration_seconds']
+        print(f"\n這台機器的 calibration 耗時為 baseline 的 {speed:.2f} 倍，耗時依此換算後比較")
+    print(f"\n{'項目':<28} {'耗時/baseline':>14} {'RSS/baseline':>13}")
+    for key, r in results.items():
+        base = baseline.get(key)
+        if base is None:
+            print(f"{key:<28} {'(無 baseline)':>14}")
+            continue
+        time_ratio = r['seconds'] / (base['seconds'] * speed) if base['seconds'] else float('inf')
+        rss_ratio = r['peak_rss_mb'] / base['peak_rss_mb'] if base['peak_rss_mb'] else float('inf')
+        flag = ''
+        if time_ratio > 1 + tolerance:
+            regressions.append(f'{key} 耗時 {time_ratio:.2f}x')
+            flag += ' 耗時退步'
+        if rss_ratio > 1 + tolerance:
+            regressions.append(f'{key} peak RSS {rss_ratio:.2f}x')
+            flag += ' 記憶體退步'
+        print(f"{key:<28} {time_ratio:>13.2f}x {rss_ratio:>12.2f}x{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='presale-scraper 離線效能測試')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000], help='SaleData 規模')
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), help='只執行這些項目')
+    parser.add_argument('--latency', type=float, default=0.01, help='stub 每個請求的延遲秒數')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='baseline JSON 檔')
+    parser.add_argument('--save-baseline', action='store_true', help='將這次結果寫入 baseline (與既有內容合併)')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='超過 baseline 多少比例視為退步')
+    parser.add_argument('--fixture-dir', default=FIXTURE_DIR, help='fixture 目錄')
+    args = parser.parse_args(argv)
+
+    machine = environment(args.latency)
+    results = run(args.sizes, args.cases, args.latency, args.fixture_dir)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    baseline_machine = baseline.get('machine', {})
+    regressions = compare(results, baseline.get('results', {}), args.tolerance, machine, baseline_machine)
+    differences = environment_differences(machine, baseline_machine) if baseline else {}
+
+    if args.save_baseline:
+        if differences:
+            # 不同環境的結果不混在同一份 baseline
+            baseline = {}
+            print("環境與既有 baseline 不同，改為只保留這次的結果")
+        baseline.setdefault('results', {}).update(results)
+        baseline['machine'] = machine
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=2, sort_keys=True)
+        print(f"已寫入 baseline: {args.baseline}")
+    elif differences:
+        print("\nbaseline 記錄於不同的環境，以上比較僅供參考，不視為退步：")
+        for key, (before, now) in differences.items():
+            print(f"  {key}: {before} → {now}")
+    elif regressions:
+        print("\n效能退步：\n" + '\n'.join(regressions))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
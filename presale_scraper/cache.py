@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+# 各 endpoint 的快取秒數，以網址中包含的字串比對 (越長的字串越優先)
+ENDPOINT_TTLS = {
+    'bff.591.com.tw/v1/housing/detail-info': 3 * 24 * 3600,      # 建案詳情：3 天
+    'newhouse.591.com.tw/home/housing/list-search': 6 * 3600,    # 建案搜尋：6 小時
+    'lvr.land.moi.gov.tw/SERVICE/QueryPrice': 12 * 3600,         # 實價登錄 / 預售屋建案：12 小時
+}
+
+# 回傳快取內容時保留的 header (內容已解壓縮，不保留 Content-Encoding)
+KEPT_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+
+
+def cache_key(url, params=None):
+    """ 以 url + params 計算快取 key (sha256)
+
+    網址本身的 query 與 params (dict 或字串) 合併後依參數名稱排序再編碼，
+    因此 detail-info?id=1&is_auth=0 與 params={'is_auth': 0, 'id': 1} 是同一個 key
+    """
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    if params:
+        if isinstance(params, str):
+            query += parse_qsl(params, keep_blank_values=True)
+        else:
+            query += [(str(key), str(value)) for key, value in dict(params).items()]
+    # 同名參數維持原本的先後順序
+    query.sort(key=lambda pair: pair[0])
+    url = urlunsplit(parts._replace(query=urlencode(query), fragment=''))
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+
+# 存放於硬碟的 HTTP 回應快取：內容以 zlib 壓縮存檔，索引存於 SQLite
+class ResponseCache():
+    def __init__(self, cache_dir, max_bytes=512 * 1024 * 1024, default_ttl=3600, ttls=None):
+        """ 建立回應快取
+
+        :param cache_dir: 快取目錄
+        :param max_bytes: 壓縮後內容的總大小上限，超過時依最近最少使用 (LRU) 刪除
+        :param default_ttl: 未列於 ttls 的網址的快取秒數
+        :param ttls: {網址片段: 秒數}，預設為 ENDPOINT_TTLS
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.ttls = sorted((ttls or ENDPOINT_TTLS).items(), key=lambda item: -len(item[0]))
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(cache_dir, 'index.sqlite'), check_same_thread=False)
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                url TEXT,
+                size INTEGER,
+                headers TEXT,
+                stored_at REAL,
+                expires_at REAL,
+                last_access REAL
+            )''')
+        self._db.commit()
+
+    def ttl_for(self, url):
+        """ 依網址取得快取秒數 """
+        for pattern, ttl in self.ttls:
+            if pattern in url:
+                return ttl
+        return self.default_ttl
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def lookup(self, url, params=None, load_body=True):
+        """ 查詢快取
+
+        :param load_body: 是否讀入內容；串流讀取時可設為 False，再以 iter_body 分段讀取
+        :return entry: None 表示沒有快取，否則為 dict (key, body, headers, fresh)
+        """
+        key = cache_key(url, params)
+        with self._lock:
+            row = self._db.execute(
+                'SELECT headers, expires_at FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            body = None
+            try:
+                if load_body:
+                    with open(self._path(key), 'rb') as f:
+                        body = zlib.decompress(f.read())
+                elif not os.path.exists(self._path(key)):
+                    raise OSError(key)
+            except (OSError, zlib.error):
+                self._db.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self._db.commit()
+                return None
+            self._db.execute('UPDATE responses SET last_access = ? WHERE key = ?', (time.time(), key))
+            self._db.commit()
+        return {'key': key, 'body': body, 'headers': json.loads(row[0]), 'fresh': row[1] > time.time()}
+
+    def iter_body(self, key, chunk_size=1 << 16):
+        """ 分段讀取並解壓縮快取內容 """
+        decompressor = zlib.decompressobj()
+        with open(self._path(key), 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                data = decompressor.decompress(chunk)
+                if data:
+                    yield data
+        data = decompressor.flush()
+        if data:
+            yield data
+
+    def store(self, url, params, response):
+        """ 將成功的回應存入快取，並在超過容量時刪除最久未使用的內容 """
+        headers = {name: response.headers[name] for name in KEPT_HEADERS if name in response.headers}
+        self.store_compressed(url, params, zlib.compress(response.content), headers)
+
+    def store_compressed(self, url, params, data, headers):
+        """ 存入已用 zlib 壓縮的內容 (串流下載時邊下載邊壓縮) """
+        key = cache_key(url, params)
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        now = time.time()
+        with self._lock:
+            with open(path, 'wb') as f:
+                f.write(data)
+            self._db.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (key, url, len(data), json.dumps(headers), now, now + self.ttl_for(url), now))
+            self._evict()
+            self._db.commit()
+
+    def touch(self, key, url):
+        """ 伺服器回應 304 (內容未變) 時延長快取期限 """
+        now = time.time()
+        with self._lock:
+            self._db.execute('UPDATE responses SET expires_at = ?, last_access = ? WHERE key = ?',
+                             (now + self.ttl_for(url), now, key))
+            self._db.commit()
+
+    def _evict(self):
+        total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._db.execute(
+                'SELECT key, size FROM responses ORDER BY last_access').fetchall():
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+            self._db.execute('DELETE FROM responses WHERE key = ?', (key,))
+            total -= size
+
+    def clear(self):
+        """ 清除所有快取 """
+        with self._lock:
+            for (key,) in self._db.execute('SELECT key FROM responses').fetchall():
+                try:
+                    os.remove(self._path(key))
+                except OSError:
+                    pass
+            self._db.execute('DELETE FROM responses')
+            self._db.commit()
+
+
+def cached_response(url, entry):
+    """ 將快取內容包裝成 requests.Response，呼叫端可照常使用 status_code / json() / text """
+    response = requests.Response()
+    response.status_code = 200
+    response._content = entry['body']
+    response.headers = CaseInsensitiveDict(entry['headers'])
+    response.url = url
+    response.from_cache = True
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers) or 'utf-8'
+    return response
+
+
+def conditional_headers(entry):
+    """ 依快取的 ETag / Last-Modified 產生重新驗證用的 header """
+    headers = {}
+    if 'ETag' in entry['headers']:
+        headers['If-None-Match'] = entry['headers']['ETag']
+    if 'Last-Modified' in entry['headers']:
+        headers['If-Modified-Since'] = entry['headers']['Last-Modified']
+    return headers
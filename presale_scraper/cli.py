@@ -0,0 +1,457 @@
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import config
+from config import DATA_DIR
+
+# presale-scraper 命令列：取代 presale_main / preplvr_main / analysis_main 三個 notebook 的手動執行
+#
+# 流程 (DAG)：
+#   fetch_presale ─ transform_presale ─┐
+#                                      ├─ merge ─ enrich
+#   fetch_plvr ──── transform_plvr ────┘
+#
+# 互不相依的階段 (兩個 fetch、兩個 transform) 同時執行；每個階段的輸出 (Parquet) 與其輸入指紋存在
+# <data-dir>/pipeline/，輸入 (上游輸出、參數、程式碼) 沒變時直接沿用，不重跑；
+# fetch 階段有任一縣市請求失敗時整個階段失敗，不存下缺少部分縣市的輸出
+#
+# 例：
+#   python cli.py run                         # 以 config 中最新的快照跑完整流程
+#   python cli.py run --until merge           # 只跑到 merge (不連 591)
+#   python cli.py run --force transform_plvr  # 強制重跑 transform_plvr (及受影響的下游)
+#   python cli.py status                      # 各階段快取狀態
+#   python cli.py snapshots                   # config 中可用的快照
+#
+# pandas、pyarrow、bs4 等只在實際執行階段時才 import，status / snapshots 不需載入
+
+PROG = 'presale-scraper'
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SNAPSHOT_PATTERN = re.compile(r'^(?P<kind>urls|plvrurls)_(?P<date>\d{7})$')
+
+# 預售屋建案輸出欄位 (同 presale_main 的 final_df)
+PRESALE_OUTPUT_COLUMNS = ["縣市", "行政區", "起造人", "社區名稱", "戶數", "銷售起始時間", "銷售期間", "編號",
+                          "自售起始時間", "代銷起始時間", "備查完成日期", "建照核發日", "坐落街道", "主要用途",
+                          "使用分區", "建照執照", "經度", "緯度"]
+# merge 時接到實價登錄的預售屋欄位 (同 analysis_main)
+MERGE_COLUMNS = ['戶數', '銷售起始時間', '編號', '使用分區', '起造人', '建照執照']
+
+
+def list_url_snapshots(kind):
+    """ config 中的快照網址清單名稱 (由舊到新)
+
+    :param kind: 'urls' (預售屋建案) 或 'plvrurls' (預售屋實價登錄)
+    :return names: 例如 ['urls_1140412']
+    """
+    names = []
+    for name in dir(config):
+        match = SNAPSHOT_PATTERN.match(name)
+        if match and match.group('kind') == kind:
+            names.append(name)
+    return sorted(names, key=lambda name: name.split('_')[1])
+
+
+def resolve_snapshot(kind, name=None):
+    """ 取得快照的 (名稱, 匯入時間, {縣市: 網址})，name 為 None 時取最新的快照 """
+    names = list_url_snapshots(kind)
+    if name is None:
+        if not names:
+            raise SystemExit(f"config 中沒有 {kind}_<民國日期> 快照")
+        name = names[-1]
+    elif name not in names:
+        raise SystemExit(f"未知的快照 {name}，可用的快照: {', '.join(names) or '無'}")
+    return name, name.split('_')[1], getattr(config, name)
+
+
+# ---- 各階段 ----
+
+def stage_fetch_presale(inputs, options):
+    """ 抓取各縣市預售屋建案，任一縣市請求失敗時 combined_df 引發 CityFetchError """
+    from config import column_names
+    from utils import combined_df
+    _, input_time, urls = resolve_snapshot('urls', options['presale_snapshot'])
+    return combined_df(urls, input_time, max_workers=options['workers'], columns=list(column_names),
+                       stream=options['stream'], strict=True)
+
+
+def stage_fetch_plvr(inputs, options):
+    """ 抓取各縣市預售屋實價登錄，任一縣市請求失敗時 combined_df 引發 CityFetchError """
+    from config import plvr_column_names
+    from utils import combined_df
+    _, input_time, urls = resolve_snapshot('plvrurls', options['plvr_snapshot'])
+    return combined_df(urls, input_time, max_workers=options['workers'], columns=list(plvr_column_names),
+                       stream=options['stream'], strict=True)
+
+
+def stage_transform_presale(inputs, options):
+    from config import column_names
+    from utils import derive_presale_columns
+    proc_df = derive_presale_columns(inputs['fetch_presale'].rename(columns=column_names))
+    return proc_df[PRESALE_OUTPUT_COLUMNS]
+
+
+def stage_transform_plvr(inputs, options):
+    from utils import transform_plvr
+    return transform_plvr(inputs['fetch_plvr'])
+
+
+def stage_merge(inputs, options):
+    """ 實價登錄接上預售屋建案欄位 (以 ProjectMatcher 比對名稱與坐標，取代字串完全相同的 pd.merge) """
+    from matcher import ProjectMatcher
+    return ProjectMatcher(inputs['transform_presale']).merge(inputs['transform_plvr'], MERGE_COLUMNS)
+
+
+def stage_enrich(inputs, options):
+    """ 比對不到建照的社區改由 591 搜尋，取得建案詳情 (以 CrawlJournal 紀錄，中斷後重跑可接續) """
+    from journal import CrawlJournal
+    from newhouse591_spider import collect_communities
+    merged = inputs['merge']
+    missing = merged.loc[merged['建照執照'].isna(), ['縣市', '行政區', '社區名稱']]
+    missing = missing.astype(str).drop_duplicates()
+    missing = missing[missing['社區名稱'].str.strip() != '']
+    records = [{'縣市': config.regionid.get(city, city), '社區名稱': name}
+               for city, name in zip(missing['縣市'], missing['社區名稱'])]
+    if options['enrich_limit'] is not None:
+        records = records[:options['enrich_limit']]
+    journal = CrawlJournal(os.path.join(options['pipeline_dir'], 'crawl_journal.sqlite'))
+    try:
+        return collect_communities(records, journal=journal, request_delay=options['request_delay'])
+    finally:
+        print(journal.summary())
+        journal.close()
+
+
+class Stage():
+    def __init__(self, name, func, deps=(), params=(), sources=()):
+        """
+        :param func: 執行函式 func(inputs, options)，inputs 為 {上游階段名稱: DataFrame}，回傳 DataFrame
+        :param deps: 上游階段名稱
+        :param params: 影響輸出的 options 名稱，列入快取指紋
+        :param sources: 影響輸出的程式檔，內容列入快取指紋 (改了程式碼就重跑)
+        """
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.params = tuple(params)
+        self.sources = tuple(sources)
+
+
+STAGES = {stage.name: stage for stage in (
+    Stage('fetch_presale', stage_fetch_presale, params=('presale_snapshot', 'stream'),
+          sources=('utils.py', 'config.py')),
+    Stage('fetch_plvr', stage_fetch_plvr, params=('plvr_snapshot', 'stream'),
+          sources=('utils.py', 'config.py')),
+    Stage('transform_presale', stage_transform_presale, deps=('fetch_presale',),
+          sources=('utils.py', 'config.py', 'cli.py')),
+    Stage('transform_plvr', stage_transform_plvr, deps=('fetch_plvr',),
+          sources=('utils.py', 'config.py')),
+    Stage('merge', stage_merge, deps=('transform_presale', 'transform_plvr'),
+          sources=('matcher.py', 'geo.py', 'cli.py')),
+    Stage('enrich', stage_enrich, deps=('merge',), params=('enrich_limit',),
+          sources=('newhouse591_spider.py', 'detail_extract.py', 'config.py', 'cli.py')),
+)}
+
+
+def upstream(names):
+    """ names 及其所有上游階段 (依 STAGES 順序) """
+    needed = set()
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        if name not in needed:
+            needed.add(name)
+            pending.extend(STAGES[name].deps)
+    return [name for name in STAGES if name in needed]
+
+
+# ---- 階段輸出快取 ----
+
+def _file_digest(path, digest=None):
+    digest = digest or hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _dataset_digest(path, dtypes):
+    """ Parquet 資料集內容的指紋 (只看檔案內容與欄位型態，不含快照日期等目錄名稱) """
+    digest = hashlib.sha256(json.dumps(dtypes, ensure_ascii=False).encode())
+    files = []
+    for root, _, names in os.walk(path):
+        files.extend(os.path.join(root, name) for name in names)
+    for file in sorted(files, key=os.path.basename):
+        _file_digest(file, digest)
+    return digest.hexdigest()
+
+
+def _uniform_objects(df):
+    """ object 欄位中混有不同型態 (例如數字與「未知」) 時轉為字串，Parquet 每欄只能有一種型態 """
+    mixed = [column for column in df.columns if df[column].dtype == object
+             and df[column].dropna().map(type).nunique() > 1]
+    if not mixed:
+        return df
+    df = df.copy(deep=False)
+    for column in mixed:
+        df[column] = df[column].where(df[column].isna(), df[column].astype(str))
+    return df
+
+
+class StageNotReady(RuntimeError):
+    """ 上游階段尚未成功執行，沒有可用的輸出 """
+    def __init__(self, stage, dep):
+        super().__init__(f'階段 {stage} 需要 {dep} 的輸出，但 {dep} 尚未成功執行，'
+                         f'請先執行 `python cli.py run {dep}`')
+
+
+class StageStore():
+    """ 階段輸出以 storage.write_dataset 存放於 <pipeline_dir>/<stage>/ (Parquet)，指紋與統計存於 <stage>.json """
+    def __init__(self, pipeline_dir):
+        self.pipeline_dir = pipeline_dir
+        os.makedirs(pipeline_dir, exist_ok=True)
+
+    def _paths(self, name):
+        base = os.path.join(self.pipeline_dir, name)
+        return base, f'{base}.json'
+
+    def manifest(self, name):
+        """ 上次成功執行的紀錄，沒有時回傳 None """
+        output, manifest = self._paths(name)
+        if not os.path.exists(manifest):
+            return None
+        with open(manifest, encoding='utf-8') as f:
+            record = json.load(f)
+        # 沒有資料列時不會寫出任何 Parquet 檔
+        if record['rows'] and not os.path.isdir(output):
+            return None
+        return record
+
+    def _require(self, stage_name, dep):
+        manifest = self.manifest(dep)
+        if manifest is None:
+            raise StageNotReady(stage_name, dep)
+        return manifest
+
+    def fingerprint(self, stage, options):
+        """ 階段輸入的指紋：參數、程式碼與上游輸出的內容
+
+        :raise StageNotReady: 上游階段尚未成功執行
+        """
+        digest = hashlib.sha256(stage.name.encode())
+        for param in stage.params:
+            digest.update(f'{param}={options[param]}'.encode())
+        for source in stage.sources:
+            digest.update(_file_digest(os.path.join(BASE_DIR, source)).encode())
+        for dep in stage.deps:
+            digest.update(self._require(stage.name, dep)['output_digest'].encode())
+        return digest.hexdigest()
+
+    def load(self, name, stage_name=None):
+        """ 讀回階段輸出，欄位順序與 dtype 同寫入時
+
+        :param stage_name: 需要這個輸出的下游階段 (只用於錯誤訊息)
+        :raise StageNotReady: 該階段尚未成功執行
+        """
+        import pandas as pd
+        from storage import SNAPSHOT_COLUMN, read_dataset
+        dtypes = self._require(stage_name or name, name)['dtypes']
+        if not os.path.isdir(self._paths(name)[0]):
+            return pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in dtypes.items()})
+        df = read_dataset(name, snapshot=None, partition_cols=[SNAPSHOT_COLUMN], base_dir=self.pipeline_dir)
+        # 字串欄位以 dictionary 編碼儲存，讀回時為 category，還原成寫入時的 dtype
+        for column, dtype in dtypes.items():
+            if isinstance(df[column].dtype, pd.CategoricalDtype) and dtype != 'category':
+                df[column] = df[column].astype(dtype)
+        return df[list(dtypes)]
+
+    def save(self, name, df, fingerprint, elapsed):
+        from storage import SNAPSHOT_COLUMN, write_dataset
+        output, manifest = self._paths(name)
+        # 先移除紀錄，寫入中斷時下次會重跑，不會沿用寫一半的輸出
+        if os.path.exists(manifest):
+            os.remove(manifest)
+        shutil.rmtree(f'{output}.tmp', ignore_errors=True)
+        if len(df):
+            write_dataset(_uniform_objects(df), f'{name}.tmp', partition_cols=[SNAPSHOT_COLUMN],
+                          base_dir=self.pipeline_dir)
+        shutil.rmtree(output, ignore_errors=True)
+        if os.path.isdir(f'{output}.tmp'):
+            os.replace(f'{output}.tmp', output)
+        dtypes = {str(column): str(dtype) for column, dtype in df.dtypes.items()}
+        record = {
+            'stage': name,
+            'fingerprint': fingerprint,
+            'output_digest': _dataset_digest(output, dtypes),  # 輸出內容沒變時，下游指紋不變、不需重跑
+            'dtypes': dtypes,
+            'rows': len(df),
+            'seconds': round(elapsed, 3),
+            'finished_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        }
+        with open(manifest, 'w', encoding='utf-8') as f:
+            json.dump(record, f, ensure_ascii=False, indent=2)
+        return record
+
+
+# ---- DAG 執行 ----
+
+def run_pipeline(targets, options, force=(), jobs=2):
+    """ 依相依關係執行 targets 及其上游階段，互不相依的階段同時執行
+
+    :param targets: 要產出的階段名稱
+    :param options: 各階段使用的設定 (見 build_options)
+    :param force: 不論快取都要重跑的階段
+    :param jobs: 同時執行的階段數上限
+    :return failed: 失敗的階段名稱 (成功時為空 list)
+    """
+    import metrics
+    store = StageStore(options['pipeline_dir'])
+    names = upstream(targets)
+    remaining = {name: set(STAGES[name].deps) for name in names}
+    failed = []
+    lock = threading.Lock()
+
+    def log(message):
+        with lock:  # 同時執行的階段輸出不要交錯
+            print(message)
+
+    def execute(name):
+        stage = STAGES[name]
+        fingerprint = store.fingerprint(stage, options)
+        previous = store.manifest(name)
+        if name not in force and previous is not None and previous['fingerprint'] == fingerprint:
+            log(f"[{name}] 輸入未變更，沿用上次輸出 ({previous['rows']} 筆，{previous['finished_at']})")
+            metrics.inc('pipeline_stages_total', stage=name, result='cached')
+            return
+        log(f"[{name}] 開始")
+        start = time.perf_counter()
+        inputs = {dep: store.load(dep, name) for dep in stage.deps}
+        with metrics.stage(f'pipeline_{name}'):
+            df = stage.func(inputs, options)
+        record = store.save(name, df, fingerprint, time.perf_counter() - start)
+        metrics.inc('pipeline_stages_total', stage=name, result='run')
+        log(f"[{name}] 完成，{record['rows']} 筆，{record['seconds']:.1f} 秒")
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        running = {}
+        while remaining or running:
+            for name in [name for name, deps in remaining.items() if not deps]:
+                del remaining[name]
+                running[executor.submit(execute, name)] = name
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                error = future.exception()
+                if error is None:
+                    for deps in remaining.values():
+                        deps.discard(name)
+                    continue
+                log(f"[{name}] 失敗: {error!r}")
+                metrics.inc('pipeline_stages_total', stage=name, result='failed')
+                failed.append(name)
+                # 下游階段無法執行
+                skipped = [other for other in remaining if name in upstream([other])]
+                for other in skipped:
+                    log(f"[{other}] 略過 (上游 {name} 失敗)")
+                    del remaining[other]
+    return failed
+
+
+def build_options(args):
+    data_dir = os.path.abspath(args.data_dir)
+    return {
+        'pipeline_dir': os.path.join(data_dir, 'pipeline'),
+        'presale_snapshot': resolve_snapshot('urls', args.presale_snapshot)[0],
+        'plvr_snapshot': resolve_snapshot('plvrurls', args.plvr_snapshot)[0],
+        'workers': args.workers,
+        'stream': args.stream,
+        'enrich_limit': args.enrich_limit,
+        'request_delay': args.request_delay,
+    }
+
+
+# ---- 子命令 ----
+
+def cmd_run(args):
+    import metrics
+    import http_client
+    if args.log:
+        metrics.enable_log(args.log)
+    if args.no_cache:
+        http_client.set_cache(False)
+    options = build_options(args)
+    targets = args.stages or ([args.until] if args.until else list(STAGES))
+    unknown = [name for name in targets + args.force if name not in STAGES]
+    if unknown:
+        raise SystemExit(f"未知的階段: {', '.join(unknown)}，可用的階段: {', '.join(STAGES)}")
+
+    print(f"快照: {options['presale_snapshot']}、{options['plvr_snapshot']}，輸出目錄: {options['pipeline_dir']}")
+    failed = run_pipeline(targets, options, force=set(args.force), jobs=args.jobs)
+    if args.metrics:
+        metrics.write_prometheus(args.metrics)
+    metrics.print_summary()
+    return 1 if failed else 0
+
+
+def cmd_status(args):
+    store = StageStore(os.path.join(os.path.abspath(args.data_dir), 'pipeline'))
+    for name, stage in STAGES.items():
+        manifest = store.manifest(name)
+        deps = f" <- {', '.join(stage.deps)}" if stage.deps else ''
+        if manifest is None:
+            print(f"{name:<18} 尚未執行{deps}")
+        else:
+            print(f"{name:<18} {manifest['rows']:>9} 筆 {manifest['seconds']:>8.1f} 秒  {manifest['finished_at']}{deps}")
+    return 0
+
+
+def cmd_snapshots(args):
+    for kind, label in (('urls', '預售屋建案'), ('plvrurls', '預售屋實價登錄')):
+        names = list_url_snapshots(kind)
+        print(f"{label}: {', '.join(names) or '無'}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog=PROG, description='內政部預售屋建案 / 實價登錄資料抓取與整理')
+    parser.add_argument('--data-dir', default=os.path.join(BASE_DIR, DATA_DIR), help='資料根目錄')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='執行流程 (預設全部階段)')
+    run_parser.add_argument('stages', nargs='*', help=f"要產出的階段 (含其上游): {', '.join(STAGES)}")
+    run_parser.add_argument('--until', choices=list(STAGES), help='執行到此階段為止')
+    run_parser.add_argument('--force', nargs='+', default=[], metavar='STAGE', help='不論快取都重跑這些階段')
+    run_parser.add_argument('--presale-snapshot', help='預售屋建案快照，例如 urls_1140412，預設最新')
+    run_parser.add_argument('--plvr-snapshot', help='實價登錄快照，例如 plvrurls_1140416，預設最新')
+    run_parser.add_argument('--jobs', type=int, default=2, help='同時執行的階段數')
+    run_parser.add_argument('--workers', type=int, default=8, help='每個 fetch 階段同時抓取的縣市數')
+    run_parser.add_argument('--stream', action='store_true', help='fetch 時邊下載邊解析 (降低記憶體用量)')
+    run_parser.add_argument('--no-cache', action='store_true', help='不使用 HTTP 回應快取')
+    run_parser.add_argument('--enrich-limit', type=int, help='enrich 最多搜尋的社區數')
+    run_parser.add_argument('--request-delay', type=float, default=config.REQUEST_DELAY,
+                            help='591 起始的請求間隔秒數')
+    run_parser.add_argument('--metrics', help='結束時寫出 Prometheus text 指標檔')
+    run_parser.add_argument('--log', help='將事件以 JSON lines 寫入此檔')
+    run_parser.set_defaults(func=cmd_run)
+
+    status_parser = subparsers.add_parser('status', help='各階段上次執行的結果')
+    status_parser.set_defaults(func=cmd_status)
+
+    snapshots_parser = subparsers.add_parser('snapshots', help='config 中可用的快照')
+    snapshots_parser.set_defaults(func=cmd_snapshots)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -148,3 +148,11 @@ regionid={
 # 其他常數設定
 REQUEST_DELAY = 5  # 請求間隔秒數
 MAX_RETRIES = 3    # 最大重試次數
+MAX_REQUEST_DELAY = 60   # 自適應限速：持續被限流時最長的請求間隔秒數 (回應正常時只會加速回 REQUEST_DELAY)
+
+# 資料輸出目錄
+DATA_DIR = '../data'
+
+# HTTP 回應快取
+HTTP_CACHE_DIR = f'{DATA_DIR}/http_cache'      # 快取目錄
+HTTP_CACHE_MAX_BYTES = 512 * 1024 * 1024       # 快取大小上限 (壓縮後)
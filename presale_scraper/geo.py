@@ -0,0 +1,94 @@
+import numpy as np
+
+EARTH_RADIUS_M = 6371000.0
+METERS_PER_DEGREE = 111320.0  # 緯度 1 度約 111.32 公里
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """ 兩點 (或兩組點) 間的球面距離 (公尺)，輸入為度，可為 numpy 陣列 """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(value, dtype=float)) for value in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+# 經緯度網格索引：依固定大小 (公尺) 的格子分桶，查詢時只比對附近格子內的點
+class GridIndex():
+    def __init__(self, lat, lon, cell_m=500):
+        """ 建立網格索引
+
+        :param lat: 緯度陣列 (NaN 的點不會被索引)
+        :param lon: 經度陣列
+        :param cell_m: 格子邊長 (公尺)，約為常用查詢半徑即可
+        """
+        self.lat = np.asarray(lat, dtype=float)
+        self.lon = np.asarray(lon, dtype=float)
+        self.cell_m = cell_m
+        valid = np.flatnonzero(~(np.isnan(self.lat) | np.isnan(self.lon)))
+        # 台灣範圍不大，以平均緯度決定經度方向的格子寬度
+        mean_lat = float(np.mean(self.lat[valid])) if len(valid) else 0.0
+        self.cell_lat = cell_m / METERS_PER_DEGREE
+        self.cell_lon = cell_m / (METERS_PER_DEGREE * max(np.cos(np.radians(mean_lat)), 0.01))
+
+        rows, cols = self._cell(self.lat[valid], self.lon[valid])
+        order = np.lexsort((cols, rows))
+        self._sorted = valid[order]
+        keys = np.stack([rows[order], cols[order]], axis=1)
+        self._cells = {}
+        if len(keys):
+            starts = np.flatnonzero(np.r_[True, np.any(keys[1:] != keys[:-1], axis=1)])
+            ends = np.r_[starts[1:], len(keys)]
+            for start, end in zip(starts, ends):
+                self._cells[(int(keys[start, 0]), int(keys[start, 1]))] = (start, end)
+
+    def __len__(self):
+        return len(self._sorted)
+
+    def _cell(self, lat, lon):
+        return (np.floor(np.asarray(lat) / self.cell_lat).astype(np.int64),
+                np.floor(np.asarray(lon) / self.cell_lon).astype(np.int64))
+
+    def _candidates(self, lat, lon, rings):
+        row, col = (int(value) for value in self._cell(lat, lon))
+        parts = []
+        for i in range(row - rings, row + rings + 1):
+            for j in range(col - rings, col + rings + 1):
+                span = self._cells.get((i, j))
+                if span is not None:
+                    parts.append(self._sorted[span[0]:span[1]])
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+    def query_radius(self, lat, lon, radius_m):
+        """ 找出半徑 radius_m 內的所有點
+
+        :return indices, distances: 依距離由近到遠排序的索引與距離 (公尺)
+        """
+        if np.isnan(lat) or np.isnan(lon):
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        candidates = self._candidates(lat, lon, int(np.ceil(radius_m / self.cell_m)))
+        distances = haversine(lat, lon, self.lat[candidates], self.lon[candidates])
+        inside = distances <= radius_m
+        order = np.argsort(distances[inside], kind='stable')
+        return candidates[inside][order], distances[inside][order]
+
+    def nearest(self, lat, lon, max_radius_m=None):
+        """ 找出最近的點，由內而外逐圈擴大搜尋
+
+        :return index, distance: 最近點的索引與距離，找不到時為 (-1, inf)
+        """
+        if len(self) == 0 or np.isnan(lat) or np.isnan(lon):
+            return -1, np.inf
+        max_rings = int(np.ceil(max_radius_m / self.cell_m)) if max_radius_m is not None else 1 << 12
+        rings = 1
+        while True:
+            candidates = self._candidates(lat, lon, rings)
+            if len(candidates):
+                distances = haversine(lat, lon, self.lat[candidates], self.lon[candidates])
+                best = int(np.argmin(distances))
+                # 第 rings 圈以內的點保證涵蓋 (rings - 1) 個格子寬的距離，再外擴一圈確認沒有更近的點
+                if distances[best] <= (rings - 1) * self.cell_m or rings >= max_rings:
+                    if max_radius_m is not None and distances[best] > max_radius_m:
+                        return -1, np.inf
+                    return int(candidates[best]), float(distances[best])
+            elif rings >= max_rings:
+                return -1, np.inf
+            rings = min(rings * 2, max_rings) if rings > 1 else 2
@@ -0,0 +1,226 @@
+import time
+import zlib
+import threading
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+from config import HTTP_CACHE_DIR, HTTP_CACHE_MAX_BYTES, MAX_RETRIES
+from cache import KEPT_HEADERS, ResponseCache, cached_response, conditional_headers
+from ratelimit import RETRY_STATUS, AdaptiveRateLimiter, backoff_delay, parse_retry_after
+
+# 全域共用的 requests.Session，讓同一個 host 的請求可以重複使用 keep-alive 連線
+_session = None
+_session_pool_maxsize = 0
+_session_lock = threading.Lock()
+
+# 全域共用的回應快取，None 表示尚未建立，False 表示關閉快取
+_cache = None
+_cache_lock = threading.Lock()
+
+# 全域共用的自適應限速器，None 表示尚未建立，False 表示不限速
+_throttle = None
+_throttle_lock = threading.Lock()
+
+
+def get_session(pool_maxsize=32):
+    """ 取得全域共用的 requests.Session (執行緒間共用連線池)
+
+    連線池大小取所有呼叫端要求的最大值：之後的呼叫端需要更多連線時改掛較大的連線池，
+    避免同時發出的請求數超過連線池而每次用完即丟棄連線
+
+    :param pool_maxsize: 每個 host 最多保留的連線數，需大於等於同時發出的請求數
+    :return session: requests.Session
+    """
+    global _session, _session_pool_maxsize
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+        if pool_maxsize > _session_pool_maxsize:
+            # 舊的 adapter 不關閉，進行中的請求照常完成
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=pool_maxsize)
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+            _session_pool_maxsize = pool_maxsize
+        return _session
+
+
+def get_cache():
+    """ 取得全域共用的 ResponseCache (第一次使用時依 config 建立)，關閉時回傳 False """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(HTTP_CACHE_DIR, max_bytes=HTTP_CACHE_MAX_BYTES)
+        return _cache
+
+
+def set_cache(cache):
+    """ 替換全域快取
+
+    :param cache: ResponseCache，或 False 關閉快取，或 None 恢復預設
+    """
+    global _cache
+    with _cache_lock:
+        _cache = cache
+
+
+def get_throttle():
+    """ 取得全域共用的 AdaptiveRateLimiter (第一次使用時依 config 建立)，關閉時回傳 False """
+    global _throttle
+    with _throttle_lock:
+        if _throttle is None:
+            _throttle = AdaptiveRateLimiter()
+        return _throttle
+
+
+def set_throttle(throttle):
+    """ 替換全域限速器
+
+    :param throttle: AdaptiveRateLimiter，或 False 不限速，或 None 恢復預設
+    """
+    global _throttle
+    with _throttle_lock:
+        _throttle = throttle
+
+
+def _send(session, url, params, headers, timeout, throttle, retries, stream=False):
+    """ 在限速內送出 GET，遇到 429 / 5xx / 逾時 / 連線錯誤時退避後重試 (GET 可安全重送)
+
+    :param throttle: AdaptiveRateLimiter，None 為 get_throttle()，False 為不限速
+    :param retries: 最多重試次數
+    :return response: 最後一次的 requests.Response；重試用盡仍逾時或連線錯誤時引發原本的例外
+    """
+    throttle = get_throttle() if throttle is None else throttle
+    attempt = 0
+    while True:
+        wait = throttle.acquire(url) if throttle else 0.0
+        start = time.monotonic()
+        try:
+            response = session.get(url, params=params, headers=headers, timeout=timeout, stream=stream)
+        except (requests.Timeout, requests.ConnectionError) as e:
+            error, response, retry_after = e, None, None
+            reason = type(e).__name__
+            metrics.record_request(url, reason, time.monotonic() - start, wait=wait)
+        else:
+            elapsed = time.monotonic() - start
+            # 串流時此處只有 header，內容的位元組數在 iter_content 下載完後另外記錄
+            metrics.record_request(url, response.status_code, elapsed, 0 if stream else len(response.content), wait)
+            if response.status_code not in RETRY_STATUS:
+                if throttle:
+                    throttle.on_success(url, elapsed)
+                    if hasattr(throttle, 'current_rate'):
+                        metrics.set_gauge('throttle_rate', throttle.current_rate(url), host=urlparse(url).netloc)
+                return response
+            error = None
+            retry_after = parse_retry_after(response.headers.get('Retry-After'))
+            reason = response.status_code
+
+        if throttle:
+            delay = throttle.on_failure(url, attempt, retry_after)
+        else:
+            delay = backoff_delay(attempt, retry_after)
+        if attempt >= retries:
+            print(f"請求 {url} 失敗 ({reason})，已重試 {retries} 次")
+            if error is not None:
+                raise error
+            return response
+
+        print(f"請求 {url} 失敗 ({reason})，{delay:.1f} 秒後第 {attempt + 1} 次重試")
+        metrics.inc('http_retries_total', endpoint=metrics.endpoint(url), reason=str(reason))
+        if response is not None:
+            response.close()
+        if not throttle:
+            time.sleep(delay)  # 有限速器時，由 on_failure 暫停該 host，下一次 acquire 會等待
+            metrics.inc('throttle_wait_seconds_total', delay, endpoint=metrics.endpoint(url))
+        attempt += 1
+
+
+def cached(url, params=None):
+    """ 只查詢快取，有未過期的內容時回傳 requests.Response，否則回傳 None (不連網) """
+    cache = get_cache()
+    if not cache:
+        return None
+    entry = cache.lookup(url, params)
+    if entry is None or not entry['fresh']:
+        return None
+    metrics.inc('cache_total', endpoint=metrics.endpoint(url), result='hit')
+    return cached_response(url, entry)
+
+
+def get(url, params=None, headers=None, timeout=60, session=None, use_cache=True, throttle=None,
+        retries=MAX_RETRIES):
+    """ 發出 GET 請求，命中未過期的快取時不連網
+
+    快取過期但有 ETag / Last-Modified 時，改送條件式請求，伺服器回應 304 即沿用快取內容；
+    實際連網時依 throttle 限速，遇到 429 / 5xx / 逾時自動退避重試
+
+    :param url: 網址
+    :param params: query string (dict 或字串)
+    :param headers: request headers
+    :param timeout: 逾時秒數
+    :param session: 使用的 requests.Session，預設為 get_session()
+    :param use_cache: 是否使用快取
+    :param throttle: AdaptiveRateLimiter，預設為 get_throttle()，False 為不限速
+    :param retries: 最多重試次數，預設為 config.MAX_RETRIES
+    :return response: requests.Response (由快取取得時 response.from_cache 為 True)
+    """
+    session = session or get_session()
+    cache = get_cache() if use_cache else False
+    if not cache:
+        return _send(session, url, params, headers, timeout, throttle, retries)
+
+    entry = cache.lookup(url, params)
+    if entry is not None and entry['fresh']:
+        metrics.inc('cache_total', endpoint=metrics.endpoint(url), result='hit')
+        return cached_response(url, entry)
+
+    request_headers = dict(headers or {})
+    if entry is not None:
+        request_headers.update(conditional_headers(entry))
+    response = _send(session, url, params, request_headers, timeout, throttle, retries)
+    if entry is not None and response.status_code == requests.codes.not_modified:
+        metrics.inc('cache_total', endpoint=metrics.endpoint(url), result='revalidated')
+        cache.touch(entry['key'], url)
+        return cached_response(url, entry)
+    metrics.inc('cache_total', endpoint=metrics.endpoint(url), result='miss')
+    if response.status_code == requests.codes.ok:
+        cache.store(url, params, response)
+    return response
+
+
+def iter_content(url, params=None, headers=None, timeout=60, session=None, chunk_size=1 << 16, use_cache=True,
+                 throttle=None, retries=MAX_RETRIES):
+    """ 以串流方式逐段取得回應內容，不將整個回應讀入記憶體
+
+    命中未過期的快取時由快取分段讀取；否則邊下載邊壓縮，完整下載後存入快取
+    (只有在開始下載內容前的失敗會重試)
+
+    :param chunk_size: 每段的位元組數
+    :return: generator，逐段 yield bytes；非 200 時引發 requests.HTTPError
+    """
+    session = session or get_session()
+    cache = get_cache() if use_cache else False
+    if cache:
+        entry = cache.lookup(url, params, load_body=False)
+        if entry is not None and entry['fresh']:
+            metrics.inc('cache_total', endpoint=metrics.endpoint(url), result='hit')
+            yield from cache.iter_body(entry['key'], chunk_size)
+            return
+        metrics.inc('cache_total', endpoint=metrics.endpoint(url), result='miss')
+
+    with _send(session, url, params, headers, timeout, throttle, retries, stream=True) as response:
+        response.raise_for_status()
+        compressor = zlib.compressobj() if cache else None
+        compressed = []
+        nbytes = 0
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            nbytes += len(chunk)
+            if compressor is not None:
+                compressed.append(compressor.compress(chunk))
+            yield chunk
+        metrics.inc('http_response_bytes_total', nbytes, endpoint=metrics.endpoint(url))
+        if compressor is not None:
+            compressed.append(compressor.flush())
+            kept = {name: response.headers[name] for name in KEPT_HEADERS if name in response.headers}
+            cache.store_compressed(url, params, b''.join(compressed), kept)
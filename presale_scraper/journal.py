@@ -0,0 +1,136 @@
+import json
+import time
+import sqlite3
+import threading
+
+from config import MAX_RETRIES
+
+
+# 591 爬取進度紀錄：每完成一個社區搜尋或一個 hid 的詳情就寫入 SQLite，
+# 中斷後重跑可略過已完成的項目，只重試失敗的項目
+class CrawlJournal():
+    def __init__(self, path, max_retries=MAX_RETRIES):
+        """ 開啟 (或建立) 爬取紀錄
+
+        :param path: SQLite 檔案路徑，例如 '../data/output_591/crawl_journal.sqlite'
+        :param max_retries: 失敗項目最多嘗試次數，預設為 config.MAX_RETRIES
+        """
+        self.path = path
+        self.max_retries = max_retries
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=60, check_same_thread=False)  # 多個 worker 行程可同時寫入
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS searches (
+                region TEXT,
+                keyword TEXT,
+                status TEXT,          -- done / failed
+                hid TEXT,             -- 搜尋結果第一筆建案 ID，找不到時為 NULL
+                result TEXT,          -- 搜尋結果第一筆建案 (JSON)
+                attempts INTEGER,
+                error TEXT,
+                updated_at REAL,
+                PRIMARY KEY (region, keyword)
+            );
+            CREATE TABLE IF NOT EXISTS details (
+                hid TEXT PRIMARY KEY,
+                status TEXT,          -- done / failed
+                payload TEXT,         -- detail-info 的 data (JSON)
+                attempts INTEGER,
+                error TEXT,
+                updated_at REAL
+            );
+        ''')
+        self._db.commit()
+
+    def search_state(self, region, keyword):
+        """ 查詢社區搜尋狀態
+
+        :return: None (尚未搜尋)、('done', hid) 或 ('failed', attempts)
+        """
+        with self._lock:
+            row = self._db.execute(
+                'SELECT status, hid, attempts FROM searches WHERE region = ? AND keyword = ?',
+                (str(region), keyword)).fetchone()
+        if row is None:
+            return None
+        status, hid, attempts = row
+        return (status, hid) if status == 'done' else (status, attempts)
+
+    def need_search(self, region, keyword):
+        """ 是否需要 (重新) 搜尋：尚未搜尋，或失敗且未超過重試次數 """
+        state = self.search_state(region, keyword)
+        return state is None or (state[0] == 'failed' and state[1] < self.max_retries)
+
+    def record_search(self, region, keyword, house=None, error=None):
+        """ 記錄搜尋結果
+
+        :param house: 搜尋結果第一筆建案 (dict)，找不到時為 None
+        :param error: 失敗原因，有值時記錄為失敗
+        """
+        status = 'failed' if error else 'done'
+        hid = str(house['hid']) if house else None
+        result = json.dumps(house, ensure_ascii=False) if house else None
+        with self._lock:
+            self._db.execute('''
+                INSERT INTO searches VALUES (?, ?, ?, ?, ?, 1, ?, ?)
+                ON CONFLICT (region, keyword) DO UPDATE SET
+                    status = excluded.status, hid = excluded.hid, result = excluded.result,
+                    attempts = attempts + 1, error = excluded.error, updated_at = excluded.updated_at
+            ''', (str(region), keyword, status, hid, result, error, time.time()))
+            self._db.commit()
+
+    def detail(self, hid):
+        """ 取得已完成的建案詳情 (dict)，尚未完成時回傳 None """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT payload FROM details WHERE hid = ? AND status = 'done'", (str(hid),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def need_detail(self, hid):
+        """ 是否需要 (重新) 取得詳情：尚未取得，或失敗且未超過重試次數 """
+        with self._lock:
+            row = self._db.execute(
+                'SELECT status, attempts FROM details WHERE hid = ?', (str(hid),)).fetchone()
+        return row is None or (row[0] == 'failed' and row[1] < self.max_retries)
+
+    def record_detail(self, hid, payload=None, error=None):
+        """ 記錄建案詳情
+
+        :param payload: detail-info 的 data
+        :param error: 失敗原因，有值時記錄為失敗
+        """
+        status = 'failed' if error else 'done'
+        payload = json.dumps(payload, ensure_ascii=False) if payload is not None else None
+        with self._lock:
+            self._db.execute('''
+                INSERT INTO details VALUES (?, ?, ?, 1, ?, ?)
+                ON CONFLICT (hid) DO UPDATE SET
+                    status = excluded.status, payload = excluded.payload,
+                    attempts = attempts + 1, error = excluded.error, updated_at = excluded.updated_at
+            ''', (str(hid), status, payload, error, time.time()))
+            self._db.commit()
+
+    def results(self):
+        """ 依搜尋順序逐筆回傳已完成的 (region, keyword, hid, detail payload)，不連網 """
+        with self._lock:
+            rows = self._db.execute('''
+                SELECT s.region, s.keyword, s.hid, d.payload
+                FROM searches s JOIN details d ON s.hid = d.hid
+                WHERE s.status = 'done' AND d.status = 'done'
+                ORDER BY s.updated_at
+            ''').fetchall()
+        for region, keyword, hid, payload in rows:
+            yield region, keyword, hid, json.loads(payload)
+
+    def summary(self):
+        """ 回傳各狀態筆數，例如 {'searches': {'done': 70, 'failed': 2}, 'details': {...}} """
+        summary = {}
+        with self._lock:
+            for table in ('searches', 'details'):
+                rows = self._db.execute(f'SELECT status, COUNT(*) FROM {table} GROUP BY status').fetchall()
+                summary[table] = dict(rows)
+        return summary
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,190 @@
+import re
+import unicodedata
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from geo import GridIndex, haversine
+
+# 名稱正規化時移除的字元：空白與常見標點 (全形標點經 NFKC 後會轉為半形)
+_STRIP_PATTERN = re.compile(r"[\s\-_.,;:'\"()\[\]{}<>·・‧/\\|!?~@#&+*=。、「」『』【】《》〈〉]")
+
+
+def normalize_name(name):
+    """ 社區 / 建案名稱正規化：全形轉半形、英文轉小寫、台→臺，並移除空白與標點 """
+    if not isinstance(name, str):
+        return ''
+    name = unicodedata.normalize('NFKC', name).casefold().replace('台', '臺')
+    return _STRIP_PATTERN.sub('', name)
+
+
+def name_grams(name, n=2):
+    """ 將正規化後的名稱切成 n-gram 集合 (中文名稱多為 2~6 字，預設使用 bigram)，不足 n 字時為整串 """
+    if len(name) <= n:
+        return {name} if name else set()
+    return {name[i:i + n] for i in range(len(name) - n + 1)}
+
+
+def _dice(grams_a, grams_b):
+    if not grams_a or not grams_b:
+        return 0.0
+    return 2 * len(grams_a & grams_b) / (len(grams_a) + len(grams_b))
+
+
+def _nullable_dtype(dtype):
+    """ numpy 整數 / 布林 dtype 對應的可含缺值 dtype (例如 int64 → Int64)，其餘不變 """
+    if isinstance(dtype, np.dtype) and dtype.kind == 'i':
+        return f'Int{dtype.itemsize * 8}'
+    if isinstance(dtype, np.dtype) and dtype.kind == 'u':
+        return f'UInt{dtype.itemsize * 8}'
+    if isinstance(dtype, np.dtype) and dtype.kind == 'b':
+        return 'boolean'
+    return dtype
+
+
+# 將實價登錄交易比對到預售屋建案：正規化名稱精確比對 → n-gram 模糊比對 → 經緯度最近建案
+class ProjectMatcher():
+    def __init__(self, projects, name_col='社區名稱', city_col='縣市', district_col='行政區',
+                 lat_col='緯度', lon_col='經度', ngram=2, cell_m=300):
+        """ 建立預售屋建案索引
+
+        :param projects: 預售屋建案 DataFrame (例如 presale_output)
+        :param ngram: 模糊比對使用的 n-gram 長度
+        :param cell_m: 經緯度網格大小 (公尺)
+        """
+        self.projects = projects.reset_index(drop=True)
+        self.ngram = ngram
+        self.cities = self.projects[city_col].map(normalize_name).to_numpy()
+        self.districts = self.projects[district_col].map(normalize_name).to_numpy()
+        self.names = self.projects[name_col].map(normalize_name).to_numpy()
+        self.grams = [name_grams(name, ngram) for name in self.names]
+
+        # (縣市, 名稱) → 建案列號
+        self._exact = defaultdict(list)
+        # (縣市, n-gram) → 含有該 n-gram 的建案列號
+        self._postings = defaultdict(list)
+        for i, (city, name, grams) in enumerate(zip(self.cities, self.names, self.grams)):
+            if not name:
+                continue
+            self._exact[(city, name)].append(i)
+            for gram in grams:
+                self._postings[(city, gram)].append(i)
+        self._postings = {key: np.asarray(value) for key, value in self._postings.items()}
+
+        self.lat = pd.to_numeric(self.projects[lat_col], errors='coerce').to_numpy(dtype=float)
+        self.lon = pd.to_numeric(self.projects[lon_col], errors='coerce').to_numpy(dtype=float)
+        # 縣市 → (該縣市建案的網格索引, 建案列號)，最近建案只在同縣市內搜尋
+        self._grids = {}
+        for city in pd.unique(self.cities):
+            ids = np.flatnonzero(self.cities == city)
+            self._grids[city] = (GridIndex(self.lat[ids], self.lon[ids], cell_m=cell_m), ids)
+
+    def _pick(self, candidates, district):
+        """ 多個候選時優先取同行政區者 """
+        for i in candidates:
+            if self.districts[i] == district:
+                return i
+        return candidates[0]
+
+    def _distance(self, i, lat, lon):
+        if np.isnan(lat) or np.isnan(self.lat[i]):
+            return np.nan
+        return float(haversine(lat, lon, self.lat[i], self.lon[i]))
+
+    def match_one(self, city, district, name, lat=np.nan, lon=np.nan, min_score=0.6, radius_m=300,
+                  nearest_min_score=0.5):
+        """ 比對單一社區
+
+        :param min_score: 模糊比對的最低分數
+        :param radius_m: 最近建案的搜尋半徑 (公尺)
+        :param nearest_min_score: 最近建案的最低分數 (距離與名稱相似度各半)，
+                                  預設 0.5 表示名稱完全不像時需幾乎在同一位置
+        :return (index, method, score, distance_m): index 為 projects 的列號，找不到時為 -1
+        """
+        city, district, name = normalize_name(city), normalize_name(district), normalize_name(name)
+
+        # 1. 正規化名稱完全相同
+        candidates = self._exact.get((city, name))
+        if candidates:
+            i = self._pick(candidates, district)
+            return i, 'exact', 1.0, self._distance(i, lat, lon)
+
+        # 2. n-gram 模糊比對：計算共同 n-gram 數，以 Dice 係數評分，距離夠近再加分
+        grams = name_grams(name, self.ngram)
+        postings = [self._postings[(city, gram)] for gram in grams if (city, gram) in self._postings]
+        if postings:
+            ids, shared = np.unique(np.concatenate(postings), return_counts=True)
+            sizes = np.fromiter((len(self.grams[i]) for i in ids), dtype=float, count=len(ids))
+            scores = 2 * shared / (len(grams) + sizes)
+            if not np.isnan(lat):
+                distances = haversine(lat, lon, self.lat[ids], self.lon[ids])
+                scores = np.where(distances <= radius_m, np.minimum(scores + 0.1, 0.99), scores)
+            best = int(np.argmax(scores))
+            if scores[best] >= min_score:
+                i = int(ids[best])
+                return i, 'fuzzy', float(scores[best]), self._distance(i, lat, lon)
+
+        # 3. 同縣市半徑內最近的建案，分數依距離與名稱相似度各半計算
+        grid, ids = self._grids.get(city, (None, None))
+        if grid is not None:
+            nearest, distance = grid.nearest(lat, lon, max_radius_m=radius_m)
+            if nearest >= 0:
+                i = int(ids[nearest])
+                score = 0.5 * (1 - distance / radius_m) + 0.5 * _dice(grams, self.grams[i])
+                if score >= nearest_min_score:
+                    return i, 'nearest', float(score), distance
+
+        return -1, None, 0.0, np.nan
+
+    def match(self, df, name_col='社區名稱', city_col='縣市', district_col='行政區',
+              lat_col='緯度', lon_col='經度', min_score=0.6, radius_m=300, nearest_min_score=0.5):
+        """ 批次比對，相同的 (縣市, 行政區, 社區名稱, 經緯度) 只比對一次
+
+        :param df: 要比對的 DataFrame (例如 plvr_output)
+        :param min_score: 模糊比對的最低分數
+        :param radius_m: 最近建案的搜尋半徑 (公尺)
+        :param nearest_min_score: 最近建案的最低分數
+        :return matches: 與 df 同 index 的 DataFrame，欄位為
+                         match_index (projects 列號，-1 表示找不到)、match_method、match_score、match_distance_m
+        """
+        keys = pd.DataFrame({
+            'city': df[city_col].astype(object).to_numpy(),
+            'district': df[district_col].astype(object).to_numpy(),
+            'name': df[name_col].astype(object).to_numpy(),
+            # 經緯度取到小數第 4 位 (約 10 公尺) 再去重
+            'lat': pd.to_numeric(df[lat_col], errors='coerce').round(4).to_numpy(dtype=float),
+            'lon': pd.to_numeric(df[lon_col], errors='coerce').round(4).to_numpy(dtype=float),
+        })
+        codes, uniques = pd.factorize(pd.MultiIndex.from_frame(keys), use_na_sentinel=False)
+
+        results = [self.match_one(city, district, name, lat, lon, min_score=min_score, radius_m=radius_m,
+                                  nearest_min_score=nearest_min_score)
+                   for city, district, name, lat, lon in uniques]
+        if not results:
+            results = [(-1, None, 0.0, np.nan)]
+        index, method, score, distance = (np.asarray(column, dtype=object) for column in zip(*results))
+        return pd.DataFrame({
+            'match_index': index[codes].astype(np.int64),
+            'match_method': method[codes],
+            'match_score': score[codes].astype(float),
+            'match_distance_m': distance[codes].astype(float),
+        }, index=df.index)
+
+    @metrics.timed('match_projects')
+    def merge(self, df, columns, **kwargs):
+        """ 依比對結果把 projects 的欄位接到 df 上 (取代以字串完全相同做的 pd.merge)
+
+        :param df: 要比對的 DataFrame
+        :param columns: 要接上的 projects 欄位，例如 ['戶數', '銷售起始時間', '編號', '起造人', '建照執照']
+        :return merged: df 加上 columns 與 match_* 欄位，找不到的列為空值
+                        (整數、布林欄位改用可含缺值的 Int64 / boolean 等 dtype，不會變成 float)
+        """
+        matches = self.match(df, **kwargs)
+        source = self.projects[columns]
+        source = source.astype({column: _nullable_dtype(source[column].dtype) for column in columns})
+        # projects 的 index 為 0..n-1，以 -1 reindex 即為空值；projects 為空時也適用
+        attached = source.reindex(matches['match_index'].to_numpy())
+        attached.index = df.index
+        return pd.concat([df, attached, matches], axis=1)
@@ -0,0 +1,289 @@
+import os
+import json
+import time
+import bisect
+import functools
+import threading
+import contextlib
+from urllib.parse import urlparse
+
+# 執行期指標：各 endpoint 的請求數、延遲分布、位元組數、狀態碼、重試、快取命中，
+# 限速等待與連網時間，以及各轉換步驟的耗時
+#
+# 匯出方式：
+#   write_prometheus(path)  Prometheus text 格式 (可交給 node_exporter textfile collector)
+#   enable_log(path)        每個事件寫一行 JSON (structured log)
+#   print_summary()         執行結束時的摘要
+
+# 延遲分布的上界 (秒)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def endpoint(url):
+    """ 指標使用的 endpoint 名稱：host + path，不含 query string 與 id """
+    parsed = urlparse(url)
+    path = '/'.join('{id}' if part.isdigit() else part for part in parsed.path.split('/'))
+    return f'{parsed.netloc}{path}'
+
+
+class Histogram():
+    """ 固定 bucket 的分布，另外記錄總和與筆數 """
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最後一格為 +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """ 由 bucket 估計分位數 (取所在 bucket 的上界) """
+        if not self.count:
+            return float('nan')
+        target = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return float('inf')
+
+
+class Metrics():
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}    # (name, labels) -> float
+        self._gauges = {}      # (name, labels) -> float
+        self._histograms = {}  # (name, labels) -> Histogram
+        self._log = None
+        self.started_at = time.time()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        """ 累加計數器 """
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """ 設定量測值 (gauge) """
+        with self._lock:
+            self._gauges[self._key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        """ 記錄一筆分布資料 """
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def counter(self, name, **labels):
+        with self._lock:
+            return self._counters.get(self._key(name, labels), 0)
+
+    def event(self, event, **fields):
+        """ 寫入一行 structured log (有呼叫 enable_log 時) """
+        if self._log is None:
+            return
+        line = json.dumps({'ts': round(time.time(), 3), 'event': event, **fields}, ensure_ascii=False, default=str)
+        with self._lock:
+            if self._log is not None:
+                self._log.write(line + '\n')
+                self._log.flush()
+
+    def enable_log(self, path):
+        """ 將事件以 JSON lines 附加寫入 path """
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+            self._log = open(path, 'a', encoding='utf-8')
+
+    def disable_log(self):
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+            self._log = None
+
+    def reset(self):
+        """ 清除所有指標 (例如每次執行開始時) """
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+            self.started_at = time.time()
+
+    # ---- 常用的記錄方式 ----
+
+    def record_request(self, url, status, elapsed, nbytes=0, wait=0.0):
+        """ 記錄一次實際連網的請求
+
+        :param status: HTTP 狀態碼，逾時或連線錯誤時為例外名稱
+        :param elapsed: 連網時間 (秒)
+        :param nbytes: 回應內容位元組數
+        :param wait: 送出前等待限速的秒數
+        """
+        name = endpoint(url)
+        self.inc('http_requests_total', endpoint=name, status=str(status))
+        self.observe('http_request_duration_seconds', elapsed, endpoint=name)
+        self.inc('http_network_seconds_total', elapsed, endpoint=name)
+        if nbytes:
+            self.inc('http_response_bytes_total', nbytes, endpoint=name)
+        if wait:
+            self.inc('throttle_wait_seconds_total', wait, endpoint=name)
+        self.event('http_request', endpoint=name, status=status, elapsed=round(elapsed, 4), bytes=nbytes,
+                   wait=round(wait, 4))
+
+    @contextlib.contextmanager
+    def stage(self, name, **fields):
+        """ 計時一個處理步驟 (例如 transform_plvr)，結束時記錄耗時
+
+        用法：
+            with metrics.stage('merge'):
+                ...
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.inc('stage_seconds_total', elapsed, stage=name)
+            self.inc('stage_runs_total', stage=name)
+            self.event('stage', stage=name, elapsed=round(elapsed, 4), **fields)
+
+    def timed(self, name=None):
+        """ stage 的 decorator 版本 """
+        def decorator(func):
+            stage_name = name or func.__name__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(stage_name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    # ---- 匯出 ----
+
+    def to_prometheus(self, prefix='presale_scraper_'):
+        """ 以 Prometheus text exposition 格式輸出所有指標 """
+        def labels_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ''
+            escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for _, value in pairs)
+            return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            histograms = sorted(self._histograms.items(), key=lambda item: item[0])
+            histograms = [(key, list(h.counts), h.buckets, h.sum, h.count) for key, h in histograms]
+
+        lines = []
+        typed = set()
+        for kind, items in (('counter', counters), ('gauge', gauges)):
+            for (name, labels), value in items:
+                if name not in typed:
+                    lines.append(f'# TYPE {prefix}{name} {kind}')
+                    typed.add(name)
+                lines.append(f'{prefix}{name}{labels_text(labels)} {value}')
+        for (name, labels), counts, buckets, total, count in histograms:
+            if name not in typed:
+                lines.append(f'# TYPE {prefix}{name} histogram')
+                typed.add(name)
+            cumulative = 0
+            for bound, bucket_count in zip(buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                lines.append(f'{prefix}{name}_bucket{labels_text(labels, [("le", le)])} {cumulative}')
+            lines.append(f'{prefix}{name}_sum{labels_text(labels)} {total}')
+            lines.append(f'{prefix}{name}_count{labels_text(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """ 寫出 Prometheus text 檔 (先寫暫存檔再改名，避免讀到寫一半的檔案) """
+        temp = f'{path}.tmp'
+        with open(temp, 'w', encoding='utf-8') as f:
+            f.write(self.to_prometheus())
+        os.replace(temp, path)
+        return path
+
+    def summary(self):
+        """ 執行摘要文字：各 endpoint 請求數、狀態碼、延遲、位元組、重試、快取命中，時間分配與各步驟耗時 """
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: h for key, h in self._histograms.items()}
+
+        def by_label(name, label):
+            totals = {}
+            for (counter_name, labels), value in counters.items():
+                if counter_name == name:
+                    labels = dict(labels)
+                    totals[labels.get(label)] = totals.get(labels.get(label), 0) + value
+            return totals
+
+        lines = [f"執行時間 {time.time() - self.started_at:.1f} 秒"]
+        endpoints = sorted(set(by_label('http_requests_total', 'endpoint')) | set(by_label('cache_total', 'endpoint')))
+        if endpoints:
+            lines.append(f"{'endpoint':<55} {'請求':>6} {'狀態碼':<16} {'p50':>6} {'p95':>6} {'MB':>8} "
+                         f"{'重試':>5} {'快取命中':>8}")
+        network = by_label('http_network_seconds_total', 'endpoint')
+        waits = by_label('throttle_wait_seconds_total', 'endpoint')
+        nbytes = by_label('http_response_bytes_total', 'endpoint')
+        retries = by_label('http_retries_total', 'endpoint')
+        for name in endpoints:
+            statuses = {}
+            cache = {}
+            for (counter_name, labels), value in counters.items():
+                labels = dict(labels)
+                if labels.get('endpoint') != name:
+                    continue
+                if counter_name == 'http_requests_total':
+                    statuses[labels['status']] = statuses.get(labels['status'], 0) + value
+                elif counter_name == 'cache_total':
+                    cache[labels['result']] = cache.get(labels['result'], 0) + value
+            histogram = histograms.get(('http_request_duration_seconds', (('endpoint', name),)))
+            p50 = histogram.quantile(0.5) if histogram else float('nan')
+            p95 = histogram.quantile(0.95) if histogram else float('nan')
+            status_text = ' '.join(f'{status}:{int(count)}' for status, count in sorted(statuses.items()))
+            lookups = sum(cache.values())
+            hit_text = f"{cache.get('hit', 0) + cache.get('revalidated', 0):.0f}/{lookups:.0f}" if lookups else '-'
+            lines.append(f"{name:<55} {sum(statuses.values()):>6.0f} {status_text:<16} {p50:>6g} {p95:>6g} "
+                         f"{nbytes.get(name, 0) / 1e6:>8.2f} {retries.get(name, 0):>5.0f} {hit_text:>8}")
+        if network or waits:
+            lines.append(f"連網時間合計 {sum(network.values()):.1f} 秒，限速 / 退避等待合計 {sum(waits.values()):.1f} 秒")
+        stages = by_label('stage_seconds_total', 'stage')
+        runs = by_label('stage_runs_total', 'stage')
+        for name, seconds in sorted(stages.items(), key=lambda item: -item[1]):
+            lines.append(f"步驟 {name}: {seconds:.2f} 秒 ({runs.get(name, 0):.0f} 次)")
+        return '\n'.join(lines)
+
+    def print_summary(self):
+        print(self.summary())
+
+
+# 全域共用的指標
+METRICS = Metrics()
+
+inc = METRICS.inc
+set_gauge = METRICS.set
+observe = METRICS.observe
+event = METRICS.event
+stage = METRICS.stage
+timed = METRICS.timed
+record_request = METRICS.record_request
+enable_log = METRICS.enable_log
+write_prometheus = METRICS.write_prometheus
+summary = METRICS.summary
+print_summary = METRICS.print_summary
+reset = METRICS.reset
@@ -1,19 +1,111 @@
-import time
-import json
-import random
 import urllib
+import asyncio
+import queue
+import functools
+import collections
+import threading
 import requests
-from bs4 import BeautifulSoup
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+
+from config import REQUEST_DELAY
+import http_client
+import metrics
+from http_client import get_session
+from ratelimit import AdaptiveRateLimiter
+from detail_extract import DEFAULT_SCHEMA, MAIN_SCHEMA, DetailColumnBuilder
+
+HEADERS = {
+    'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/88.0.4324.150 Safari/537.36 Edg/88.0.705.68',
+    'device': 'pc',
+    'deviceid': '1234567890',  # 好像可以隨意值，但不給取不到 "建案詳情 > 周邊機能"
+}
+SEARCH_URL = 'https://newhouse.591.com.tw/home/housing/list-search'
+DETAIL_URL = 'https://bff.591.com.tw/v1/housing/detail-info'
+SURROUNDING_URL = 'https://bff-newhouse.591.com.tw/v1/detail/surrounding'
+COMMUNITY_PAGE_URL = 'https://newhouse.591.com.tw/{house_id}'
+PRICE_LIST_URL = 'https://bff-market.591.com.tw/v1/price/list'
+
+
+def _search_params(filter_params=None, sort_param=None):
+    """ 組合搜尋用的 query string (不含 page) """
+    params = 'device=pc&device_id=1234567890'
+    # 篩選參數
+    if filter_params:
+        params += ''.join([f'&{key}={value}' for key, value, in filter_params.items()])
+    # 排序參數
+    if sort_param:
+        params += ''.join([f'&{key}={value}' for key, value, in sort_param.items()])
+    return params
+
+
+def _detail_main_df(building_data):
+    """ 由 detail-info 的 data 取出主要欄位，回傳一列的 DataFrame """
+    return pd.DataFrame([MAIN_SCHEMA.extract(building_data)], columns=MAIN_SCHEMA.columns)
+
+
+class SeenHids():
+    """ 已出現過的建案 hid：數字 hid 以 bitmap 記錄 (每個 hid 1 bit，20 萬個 hid 約 25 KB)，其他值放在 set """
+    __slots__ = ('_bits', '_other', '_size', '_lock')
+
+    # bitmap 上限 (bit 數)，超過的 hid 放在 set
+    MAX_BITS = 1 << 27
+
+    def __init__(self, hids=()):
+        self._bits = bytearray()
+        self._other = set()
+        self._size = 0
+        self._lock = threading.Lock()
+        for hid in hids:
+            self.add(hid)
+
+    @staticmethod
+    def _number(hid):
+        if isinstance(hid, int):
+            return hid
+        if isinstance(hid, str) and hid.isdigit():
+            return int(hid)
+        return None
+
+    def add(self, hid):
+        """ 加入 hid，回傳是否為第一次出現 """
+        number = self._number(hid)
+        with self._lock:
+            if number is None or number >= self.MAX_BITS:
+                key = str(hid)
+                if key in self._other:
+                    return False
+                self._other.add(key)
+            else:
+                byte, bit = divmod(number, 8)
+                if byte >= len(self._bits):
+                    self._bits.extend(bytes(max(byte + 1 - len(self._bits), len(self._bits))))
+                if self._bits[byte] >> bit & 1:
+                    return False
+                self._bits[byte] |= 1 << bit
+            self._size += 1
+            return True
+
+    def __contains__(self, hid):
+        number = self._number(hid)
+        if number is None or number >= self.MAX_BITS:
+            return str(hid) in self._other
+        byte, bit = divmod(number, 8)
+        return byte < len(self._bits) and bool(self._bits[byte] >> bit & 1)
+
+    def __len__(self):
+        return self._size
 
 
 class Newhouse591Spider():
-    def __init__(self):
-        self.headers = {
-            'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/88.0.4324.150 Safari/537.36 Edg/88.0.705.68',
-            'device': 'pc',
-            'deviceid': '1234567890',  # 好像可以隨意值，但不給取不到 "建案詳情 > 周邊機能"
-        }
+    def __init__(self, throttle=None, session=None):
+        """
+        :param throttle: AdaptiveRateLimiter (或 workqueue.SharedRateLimiter)，預設為 http_client 全域共用的限速器
+        :param session: requests.Session (例如設定了 proxy)，預設為 http_client.get_session()
+        """
+        self.headers = dict(HEADERS)
+        self.throttle = throttle
+        self.session = session
 
     def search(self, filter_params=None, sort_param=None, want_page=1):
         """ 搜尋新建案
@@ -26,137 +118,454 @@ class Newhouse591Spider():
         """
         total_count = 0
         house_list = []
-        page = 0
-        
-        # 搜尋建案
-        url = 'https://newhouse.591.com.tw/home/housing/list-search'
-        params = 'device=pc&device_id=1234567890'
-        
-        # 篩選參數
-        if filter_params:
-            params += ''.join([f'&{key}={value}' for key, value, in filter_params.items()])
-        # 排序參數
-        if sort_param:
-            params += ''.join([f'&{key}={value}' for key, value, in sort_param.items()])
-
-        self.headers['referer'] = urllib.parse.quote(f'https://newhouse.591.com.tw/list?{params}')
+        for data in self.iter_search_pages(filter_params, sort_param, max_pages=want_page):
+            total_count = data['total']
+            house_list.extend(data['items'])
+        return total_count, house_list
+
+    def _search_page(self, params, headers, page):
+        """ 取得一頁搜尋結果的 data，重試後仍失敗時引發例外，避免少了後面的頁面卻當作搜尋完成 """
+        print(f"Get 建案資料: {SEARCH_URL} (page={page})")
+        r = http_client.get(SEARCH_URL, params=f'page={page}&{params}', headers=headers, throttle=self.throttle,
+                            session=self.session)
+        r.raise_for_status()
+        return r.json()['data']
+
+    def iter_search_pages(self, filter_params=None, sort_param=None, max_pages=None, workers=4):
+        """ 依頁碼順序逐頁 yield 搜尋結果的 data ({'total', 'total_page', 'items'})
+
+        第一頁取得 total_page 後，呼叫端讀完第一頁才開始抓後面的頁面，最多 workers 頁同時進行，
+        記憶體中最多保留 workers 頁；呼叫端中途停止時取消尚未送出的頁面，並等進行中的頁面結束後才返回
+
+        :param filter_params: 篩選參數
+        :param sort_param: 排序參數
+        :param max_pages: 最多抓幾頁，None 表示全部
+        :param workers: 同時抓取的頁數
+        """
+        params = _search_params(filter_params, sort_param)
+        headers = dict(self.headers)
+        headers['referer'] = urllib.parse.quote(f'https://newhouse.591.com.tw/list?{params}')
+
+        first = self._search_page(params, headers, 1)
+        yield first
+        last_page = first['total_page'] if max_pages is None else min(max_pages, first['total_page'])
+        if last_page < 2:
+            return
+
+        executor = ThreadPoolExecutor(max_workers=workers)
+        pending = collections.deque()
+        next_page = 2
+        try:
+            while next_page <= last_page or pending:
+                while next_page <= last_page and len(pending) < workers:
+                    pending.append(executor.submit(self._search_page, params, headers, next_page))
+                    next_page += 1
+                yield pending.popleft().result()
+        finally:
+            # 呼叫端中途停止時取消尚未送出的頁面，並等進行中的請求結束，停止後不再送出請求
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def iter_search(self, filter_params=None, sort_param=None, max_pages=None, seen=None, stop=None, workers=4):
+        """ 逐筆 yield 搜尋結果的建案，頁面抓到就開始回傳，不需等全部頁面完成
+
+        :param filter_params: 篩選參數
+        :param sort_param: 排序參數
+        :param max_pages: 最多抓幾頁，None 表示全部
+        :param seen: SeenHids，已在其中的 hid 略過，新的 hid 加入 (多次搜尋共用即可去除重複)
+        :param stop: stop(house) 為 True 時回傳該筆後停止，不再抓後面的頁面，
+                     例如關鍵字查詢只要第一筆：stop=lambda house: True
+        :param workers: 同時抓取的頁數
+        """
+        pages = self.iter_search_pages(filter_params, sort_param, max_pages, workers)
+        try:
+            for data in pages:
+                for house in data['items']:
+                    if seen is not None and not seen.add(house['hid']):
+                        continue
+                    yield house
+                    if stop is not None and stop(house):
+                        return
+        finally:
+            pages.close()
+
+    def iter_sweep(self, filter_params_list, sort_param=None, seen=None, **kwargs):
+        """ 依序執行多組搜尋 (例如逐一縣市、行政區掃過)，去除重複 hid 後逐筆 yield
+
+        :param filter_params_list: 篩選參數清單
+        :param seen: SeenHids，預設新建一個
+        :param kwargs: 其餘參數同 iter_search
+        """
+        seen = SeenHids() if seen is None else seen
+        for filter_params in filter_params_list:
+            yield from self.iter_search(filter_params, sort_param, seen=seen, **kwargs)
+
+    def get_newhouse_detail(self, house_id):
+        """ 取得建案詳情 (建案資料)，周邊機能與實價登錄見 AsyncNewhouse591Spider.get_newhouse_full_detail
+
+        :param house_id: 建案 ID
+        :return house_detail: requests 建案詳細資料 ({'detail': ...}，請求失敗時為空 dict)
+        :return main_df: 建案主要欄位 DataFrame (請求失敗時為空)
+        """
+        house_detail = {}
+        main_df = pd.DataFrame()
         
-        while page < want_page:
-            page += 1
-            params = f'page={page}&{params}'
-            print(f"Get 建案資料: {url}")
-            r = requests.get(url, params=params, headers=self.headers)
-            if r.status_code != requests.codes.ok:
-                print('請求失敗', r.status_code)
-                break
-            
+        # 建案資料 (與 AsyncNewhouse591Spider 相同的 params，共用快取)
+        self.headers['referer'] = 'https://newhouse.591.com.tw/'
+        print(f"Get 建案資料: {DETAIL_URL}?id={house_id}")
+        r = http_client.get(DETAIL_URL, params={'id': house_id, 'is_auth': 0}, headers=self.headers,
+                            throttle=self.throttle, session=self.session)
+        if r.status_code != requests.codes.ok:
+            print('請求失敗', r.status_code)
+        else:
             data = r.json()
-            total_count = data['data']['total']
-            house_list.extend(data['data']['items'])
-            
-            # 判斷是否為最後一頁
-            if page >= data['data']['total_page']:
-                break
-            time.sleep(random.uniform(2, 6))  # 隨機 delay 一段時間
+            house_detail['detail'] = data['data']
+            main_df = _detail_main_df(data['data'])
+        return house_detail, main_df
+
+
+class AsyncNewhouse591Spider():
+    """ Newhouse591Spider 的 asyncio 版本
+
+    所有請求共用同一個 keep-alive 連線池，並以自適應 token bucket 對每個 host
+    (newhouse.591.com.tw / bff.591.com.tw) 分別限速，在速率限制內同時進行多個搜尋與詳情請求
+    """
+    def __init__(self, max_concurrency=4, request_delay=REQUEST_DELAY, session=None):
+        """
+        :param max_concurrency: 同時進行中的請求數上限
+        :param request_delay: 每個 host 起始的請求間隔秒數，預設為 config.REQUEST_DELAY，之後依回應狀況調整
+        :param session: 共用的 requests.Session，預設為 http_client.get_session()
+        """
+        self.headers = dict(HEADERS)
+        self.session = session or get_session(pool_maxsize=max_concurrency)
+        self.limiter = AdaptiveRateLimiter(rate=1 / request_delay, capacity=1)
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+
+    async def _get(self, url, params=None, referer=None):
+        """ 在限速與並行上限內送出 GET，回傳 requests.Response (命中快取時 http_client.get 不連網也不限速) """
+        headers = dict(self.headers)
+        if referer:
+            headers['referer'] = referer
+        async with self._semaphore:
+            # 查詢快取、限速等待與失敗重試都在 executor 的執行緒內進行
+            loop = asyncio.get_running_loop()
+            request = functools.partial(http_client.get, url, params=params, headers=headers,
+                                        timeout=30, session=self.session, throttle=self.limiter)
+            return await loop.run_in_executor(self._executor, request)
+
+    async def _search_page(self, params, referer, page):
+        """ 取得一頁搜尋結果的 data，重試後仍失敗時引發例外 (同 Newhouse591Spider._search_page) """
+        print(f"Get 建案資料: {SEARCH_URL} (page={page})")
+        r = await self._get(SEARCH_URL, params=f'page={page}&{params}', referer=referer)
+        r.raise_for_status()
+        return r.json()['data']
+
+    async def search(self, filter_params=None, sort_param=None, want_page=1):
+        """ 搜尋新建案，第一頁取得 total_page 後其餘頁面同時抓取
 
+        :param filter_params: 篩選參數
+        :param sort_params: 排序參數
+        :param want_page: 想要抓幾頁
+        :return total_count: requests 建案總數
+        :return house_list: requests 搜尋結果建案資料清單
+        :raise requests.HTTPError: 任一頁重試後仍失敗
+        """
+        params = _search_params(filter_params, sort_param)
+        referer = urllib.parse.quote(f'https://newhouse.591.com.tw/list?{params}')
+
+        first = await self._search_page(params, referer, 1)
+        total_count = first['total']
+        house_list = list(first['items'])
+
+        last_page = min(want_page, first['total_page'])
+        pages = await asyncio.gather(*[self._search_page(params, referer, page)
+                                       for page in range(2, last_page + 1)])
+        for data in pages:
+            house_list.extend(data['items'])
         return total_count, house_list
 
-    def get_newhouse_detail(self, house_id):
-        """ 取得建案詳情 (建案資料+周邊機能+實價登錄)
+    async def iter_search(self, filter_params=None, sort_param=None, max_pages=None, seen=None, stop=None):
+        """ search 的 async generator 版本：逐筆 yield 建案，讀完第一頁後其餘頁面依序同時抓取
+        (最多 max_concurrency 頁)，參數同 Newhouse591Spider.iter_search；任一頁重試後仍失敗時引發例外
+
+        用法：
+            async for house in spider.iter_search({'regionid': '1'}, seen=seen):
+                ...
+        """
+        params = _search_params(filter_params, sort_param)
+        referer = urllib.parse.quote(f'https://newhouse.591.com.tw/list?{params}')
+
+        data = await self._search_page(params, referer, 1)
+        last_page = data['total_page'] if max_pages is None else min(max_pages, data['total_page'])
+        pending = collections.deque()
+        next_page = 2
+        try:
+            while True:
+                for house in data['items']:
+                    if seen is not None and not seen.add(house['hid']):
+                        continue
+                    yield house
+                    if stop is not None and stop(house):
+                        return
+                while next_page <= last_page and len(pending) < self.max_concurrency:
+                    pending.append(asyncio.ensure_future(self._search_page(params, referer, next_page)))
+                    next_page += 1
+                if not pending:
+                    return
+                data = await pending.popleft()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def get_newhouse_detail(self, house_id):
+        """ 取得建案詳情 (建案資料)
 
         :param house_id: 建案 ID
         :return house_detail: requests 建案詳細資料
+        :return main_df: 建案主要欄位 DataFrame (請求失敗時為空)
         """
         house_detail = {}
-        
-        # 建案資料
-        url = f'https://bff.591.com.tw/v1/housing/detail-info?id={house_id}&is_auth=0'
-        self.headers['referer'] = 'https://newhouse.591.com.tw/'
-        print(f"Get 建案資料: {url}")
-        r = requests.get(url, headers=self.headers)
+        main_df = pd.DataFrame()
+
+        url = DETAIL_URL
+        print(f"Get 建案資料: {url}?id={house_id}")
+        r = await self._get(url, params={'id': house_id, 'is_auth': 0}, referer='https://newhouse.591.com.tw/')
         if r.status_code != requests.codes.ok:
             print('請求失敗', r.status_code)
         else:
             data = r.json()
             house_detail['detail'] = data['data']
-            # 正確訪問建案資料結構
-            building_data = data['data']
-            
-            # 對於building_design需要特殊處理，因為它是一個數組
-            builder_info = ""
-            if 'building_design' in building_data:
-                for item in building_data['building_design']:
-                    if item['title'] == '投資建設':
-                        builder_info = item['content']
-                        break
-            
-            main_df = pd.DataFrame({
-                '縣市':[building_data.get("region", '未知')],
-                '行政區': [building_data.get("section", '未知')],
-                '建案名稱': [building_data.get('build_name', '未知')],
-                '戶數': [building_data.get('households', '未知')],
-                '使用分區': [building_data.get('land_division', '未知')],
-                '起造人': [builder_info],
-                '建照執照': [building_data.get('license', '未知')]
-            })
-                    
-            # with open('./_newhouse591_detail.json', 'w', encoding='utf-8') as f:
-            #     f.write(json.dumps(data, ensure_ascii=False, indent=4))
-        time.sleep(random.uniform(8, 15))  # 隨機 delay 一段時間
-        
-        # # 周邊機能
-        # url = f'https://bff-newhouse.591.com.tw/v1/detail/surrounding?id={house_id}&is_auth=0'
-        # # https://bff-newhouse.591.com.tw/v1/detail/surrounding?id=120137&is_auth=0
-        # self.headers['referer'] = 'https://newhouse.591.com.tw/'
-        # print(f"Get 周邊機能: {url}")
-        # r = requests.get(url, headers=self.headers)
-        # if r.status_code != requests.codes.ok:
-        #     print('請求失敗', r.status_code)
-        # else:
-        #     data = r.json()
-        #     house_detail['surrounding'] = data['data']
-        #     with open('./_newhouse591_surrounding.json', 'w', encoding='utf-8') as f:
-        #         f.write(json.dumps(data, ensure_ascii=False, indent=4))
-        # time.sleep(random.uniform(1, 3))  # 隨機 delay 一段時間
-
-        # # 實價登錄
-        # # 要先取得 community_id
-        # url = f'https://newhouse.591.com.tw/{house_id}?roster_type=1'
-        # r = requests.get(url, headers=self.headers)
-        # if r.status_code != requests.codes.ok:
-        #     print('請求失敗', r.status_code)
-        # else:
-        #     soup = BeautifulSoup(r.text, 'html.parser')
-        #     canonical_href = soup.select_one('section.market a.status-table')['href']
-        #     community_id = canonical_href.split("/control/")[-1].split("?")[0]
-            
-        #     # 抓取實價登錄清單
-        #     price_list = []
-        #     page = 0
-        #     while page < 99:
-        #         page += 1
-        #         url = f'https://bff-market.591.com.tw/v1/price/list?community_id={community_id}&split_park=1&page={page}&page_size=20&_source=0'
-        #         # https://bff-market.591.com.tw/v1/price/list?community_id=5935592&split_park=1&page=2&page_size=20&_source=0
-        #         self.headers['referer'] = 'https://market.591.com.tw/'
-        #         print(f"Get 實價登錄: {url}")
-        #         r = requests.get(url, headers=self.headers)
-        #         if r.status_code != requests.codes.ok:
-        #             print('請求失敗', r.status_code)
-        #             break
-            
-        #         data = r.json()
-        #         price_list.extend(data['data']['items'])
-        #         with open('./_newhouse591_price.json', 'w', encoding='utf-8') as f:
-        #             f.write(json.dumps(data, ensure_ascii=False, indent=4))
-                
-        #         # 判斷是否為最後一頁
-        #         if page >= data['data']['total_page']:
-        #             break
-        #         time.sleep(random.uniform(2, 5))  # 隨機 delay 一段時間
-            
-        #     house_detail['price'] = price_list
-        
-        return house_detail, main_df 
+            main_df = _detail_main_df(data['data'])
+        return house_detail, main_df
+
+    async def get_surrounding(self, house_id):
+        """ 取得建案周邊機能，請求失敗時回傳 None """
+        print(f"Get 周邊機能: {SURROUNDING_URL}?id={house_id}")
+        r = await self._get(SURROUNDING_URL, params={'id': house_id, 'is_auth': 0},
+                            referer='https://newhouse.591.com.tw/')
+        if r.status_code != requests.codes.ok:
+            print('請求失敗', r.status_code)
+            return None
+        return r.json()['data']
+
+    async def get_community_id(self, house_id):
+        """ 由建案頁面取得實價登錄使用的 community_id，找不到時回傳 None """
+        url = COMMUNITY_PAGE_URL.format(house_id=house_id)
+        r = await self._get(url, params={'roster_type': 1})
+        if r.status_code != requests.codes.ok:
+            print('請求失敗', r.status_code)
+            return None
+        from bs4 import BeautifulSoup  # 只有這裡需要解析 HTML，延後載入
+        soup = BeautifulSoup(r.text, 'html.parser')
+        link = soup.select_one('section.market a.status-table')
+        if link is None or not link.get('href'):
+            return None
+        return link['href'].split("/control/")[-1].split("?")[0]
+
+    async def _price_page(self, community_id, page):
+        """ 取得一頁實價登錄的 data，重試後仍失敗時引發例外，避免少了部分頁面卻當作完整的清單 """
+        print(f"Get 實價登錄: {PRICE_LIST_URL}?community_id={community_id}&page={page}")
+        params = {'community_id': community_id, 'split_park': 1, 'page': page, 'page_size': 20, '_source': 0}
+        r = await self._get(PRICE_LIST_URL, params=params, referer='https://market.591.com.tw/')
+        r.raise_for_status()
+        return r.json()['data']
+
+    async def get_price_list(self, house_id, max_page=99):
+        """ 取得建案實價登錄：先取得 community_id，第一頁取得 total_page 後其餘頁面同時抓取
+
+        :return price_list: 實價登錄清單 (建案沒有實價登錄連結時為空)
+        :raise requests.HTTPError: 任一頁重試後仍失敗
+        """
+        community_id = await self.get_community_id(house_id)
+        if community_id is None:
+            return []
+        first = await self._price_page(community_id, 1)
+        price_list = list(first['items'])
+        last_page = min(max_page, first['total_page'])
+        pages = await asyncio.gather(*[self._price_page(community_id, page) for page in range(2, last_page + 1)])
+        for data in pages:
+            price_list.extend(data['items'])
+        return price_list
+
+    async def get_newhouse_full_detail(self, house_id):
+        """ 同時取得建案詳情 (建案資料+周邊機能+實價登錄)，總耗時約為最慢的一條請求鏈
+
+        :param house_id: 建案 ID
+        :return house_detail: {'detail': ..., 'surrounding': ..., 'price': [...]}
+        :return main_df: 建案主要欄位 DataFrame (建案資料請求失敗時為空)
+        :raise requests.HTTPError: 實價登錄任一頁重試後仍失敗
+        """
+        (house_detail, main_df), surrounding, price_list = await asyncio.gather(
+            self.get_newhouse_detail(house_id),
+            self.get_surrounding(house_id),
+            self.get_price_list(house_id),
+        )
+        house_detail['surrounding'] = surrounding
+        house_detail['price'] = price_list
+        return house_detail, main_df
+
+    async def search_many(self, filter_params_list, sort_param=None, want_page=1):
+        """ 同時執行多組搜尋，回傳與 filter_params_list 順序相同的 (total_count, house_list) 清單 """
+        return await asyncio.gather(*[self.search(filter_params, sort_param, want_page)
+                                      for filter_params in filter_params_list])
+
+    async def get_newhouse_details(self, house_ids):
+        """ 同時取得多個建案詳情，回傳與 house_ids 順序相同的 (house_detail, main_df) 清單 """
+        return await asyncio.gather(*[self.get_newhouse_detail(house_id) for house_id in house_ids])
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+def resolve_communities(records, search_spider=None, detail_spider=None, fetched_hids=None,
+                        queue_size=16, request_delay=REQUEST_DELAY, journal=None):
+    """ 將缺少建照資料的社區，以 591 搜尋後取得建案詳情，逐筆回傳
+
+    搜尋與詳情分在兩個執行緒，中間以 queue 串接，搜尋到的 hid 會立即交給詳情階段，
+    兩個階段的等待時間可以重疊
+
+    :param records: 社區清單，例如 [{'縣市': '1', '社區名稱': '世界明珠'}, ...] (縣市為 591 regionid)
+    :param search_spider: 執行搜尋的 Newhouse591Spider，預設新建一個
+    :param detail_spider: 取得詳情的 Newhouse591Spider，預設新建一個
+    :param fetched_hids: 先前已取得詳情、這次要略過的 hid
+    :param queue_size: 搜尋結果等待取得詳情的最大數量
+    :param request_delay: 預設 spider 起始的請求間隔秒數，之後依回應狀況自動調整
+    :param journal: CrawlJournal，有給時每完成一筆即寫入，重跑時略過已完成項目、只重試失敗項目
+    :return: generator，每次 yield 一筆建案詳情 dict (DEFAULT_SCHEMA 欄位加上 搜尋關鍵字、縣市代碼)，
+             可交給 DetailColumnBuilder.append_record 累積，或直接使用 collect_communities
+    """
+    throttle = AdaptiveRateLimiter(rate=1 / request_delay, capacity=1)
+    search_spider = search_spider or Newhouse591Spider(throttle)
+    detail_spider = detail_spider or Newhouse591Spider(throttle)
+
+    # 相同 (縣市, 社區名稱) 只搜尋一次
+    communities = list(dict.fromkeys(
+        (str(community['縣市']), str(community['社區名稱']).strip()) for community in records
+    ))
+    print(f"共 {len(records)} 筆社區，去除重複後需搜尋 {len(communities)} 筆")
+
+    work = queue.Queue(maxsize=queue_size)
+    done = object()
+    # 呼叫端提前停止 (break、例外、close()) 時通知搜尋執行緒結束，避免卡在已滿的 queue
+    stopped = threading.Event()
+
+    def put(item):
+        """ 放入 queue，呼叫端已停止時回傳 False """
+        while not stopped.is_set():
+            try:
+                work.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def search_stage():
+        try:
+            for region, keyword in communities:
+                if stopped.is_set():
+                    return
+                # 已完成 (或已超過重試次數) 的搜尋直接沿用紀錄
+                if journal is not None and not journal.need_search(region, keyword):
+                    state = journal.search_state(region, keyword)
+                    if state[0] == 'done' and state[1] is not None:
+                        if not put((region, keyword, state[1])):
+                            return
+                    continue
+
+                try:
+                    filter_params = {
+                        'keyword': keyword,  # 社區名稱
+                        'regionid': region,  # 縣市代碼
+                    }
+                    # 只需要第一筆，取得後即停止，不抓後面的頁面
+                    house = next(search_spider.iter_search(filter_params, {}, max_pages=1), None)
+                except Exception as e:
+                    print(f"搜尋 {keyword} 時發生錯誤: {e}")
+                    if journal is not None:
+                        journal.record_search(region, keyword, error=str(e))
+                    continue
+                if journal is not None:
+                    journal.record_search(region, keyword, house)
+                if house is not None:
+                    if not put((region, keyword, str(house['hid']))):
+                        return
+                else:
+                    print(f"未找到與 {keyword} 相關的建案")
+        finally:
+            put(done)
+
+    search_thread = threading.Thread(target=search_stage, daemon=True)
+    search_thread.start()
+
+    skip_hids = {str(hid) for hid in fetched_hids or ()}
+    details = {}  # 這次已取得的 hid -> 建案詳情 tuple，不同關鍵字搜到同一建案時不再重抓
+    try:
+        while True:
+            item = work.get()
+            if item is done:
+                break
+            region, keyword, hid = item
+            if hid in details:
+                values = details[hid]
+            elif hid in skip_hids:
+                continue
+            else:
+                payload = journal.detail(hid) if journal is not None else None
+                if payload is not None:
+                    values = DEFAULT_SCHEMA.extract(payload)
+                elif journal is not None and not journal.need_detail(hid):
+                    continue  # 已超過重試次數
+                else:
+                    try:
+                        house_detail, main_df = detail_spider.get_newhouse_detail(hid)
+                    except Exception as e:
+                        print(f"獲取 {hid} 詳細資料時發生錯誤: {e}")
+                        if journal is not None:
+                            journal.record_detail(hid, error=str(e))
+                        continue
+                    if 'detail' not in house_detail:
+                        if journal is not None:
+                            journal.record_detail(hid, error='請求失敗')
+                        continue
+                    if journal is not None:
+                        journal.record_detail(hid, house_detail['detail'])
+                    values = DEFAULT_SCHEMA.extract(house_detail['detail'])
+                details[hid] = values
+
+            record = dict(zip(DEFAULT_SCHEMA.columns, values))
+            record['搜尋關鍵字'] = keyword
+            record['縣市代碼'] = region
+            yield record
+    finally:
+        stopped.set()
+        search_thread.join()
+
+
+@metrics.timed()
+def collect_communities(records, **kwargs):
+    """ 執行 resolve_communities 並將結果累積成一個 DataFrame
+
+    :param records: 社區清單，參數同 resolve_communities
+    :return combined_df: 合併後的 DataFrame
+    """
+    builder = DetailColumnBuilder(DEFAULT_SCHEMA)
+    for record in resolve_communities(records, **kwargs):
+        builder.append_record(record)
+    return builder.to_frame()
+
+
+@metrics.timed()
+def materialize_journal(journal):
+    """ 由 CrawlJournal 的紀錄組出與 resolve_communities 相同欄位的 DataFrame，不連網
+
+    :param journal: CrawlJournal
+    :return combined_df: 合併後的 DataFrame
+    """
+    builder = DetailColumnBuilder(DEFAULT_SCHEMA)
+    for region, keyword, hid, payload in journal.results():
+        builder.append(payload, 搜尋關鍵字=keyword, 縣市代碼=region)
+    return builder.to_frame()
 
 
 # if __name__ == "__main__":
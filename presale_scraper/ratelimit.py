@@ -0,0 +1,217 @@
+import time
+import random
+import asyncio
+import datetime
+import threading
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+from config import REQUEST_DELAY, MAX_REQUEST_DELAY
+
+# 需要退避後重試的狀態碼：限流與暫時性的伺服器錯誤
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+# Token bucket 限速器：每秒補充 rate 個 token，最多累積 capacity 個
+class TokenBucket():
+    def __init__(self, rate, capacity=1):
+        """ 建立 token bucket
+
+        :param rate: 每秒補充的 token 數 (即每秒最多可發出的請求數)
+        :param capacity: 最多可累積的 token 數 (允許的瞬間爆量)
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """ 預約一個 token，回傳需要等待的秒數 (0 表示可以立即送出)
+
+        token 允許被預支成負數，讓同時等待的呼叫者依序排隊，不會同時醒來
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def set_rate(self, rate):
+        """ 調整每秒補充的 token 數，已累積的 token 依舊速率結算 """
+        with self._lock:
+            self._set_rate(rate)
+
+    def scale_rate(self, factor, min_rate=0.0, max_rate=float('inf')):
+        """ 將速率乘上 factor 並限制在 [min_rate, max_rate] 之間，讀取與更新在同一個 lock 內，回傳新速率 """
+        with self._lock:
+            self._set_rate(min(max_rate, max(min_rate, self.rate * factor)))
+            return self.rate
+
+    def _set_rate(self, rate):
+        self._refill(time.monotonic())
+        # 已預支 (負數) 的 token 換算成相同的等待時間，避免降速時排隊時間被放大
+        if self._tokens < 0:
+            self._tokens *= float(rate) / self.rate
+        self.rate = float(rate)
+
+    def pause(self, seconds):
+        """ 暫停發放 token，之後的呼叫者至少等待 seconds 秒 (例如伺服器回應 Retry-After) """
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self._tokens, 1 - seconds * self.rate)
+
+    def acquire(self):
+        """ 取得一個 token，必要時阻塞等待，回傳實際等待秒數 """
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self):
+        """ acquire 的 asyncio 版本，等待期間不阻塞 event loop """
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+
+# 依 host 分別限速，不同網站互不影響
+class HostRateLimiter():
+    def __init__(self, rate=1.0, capacity=1, host_rates=None):
+        """ 建立依 host 分流的限速器
+
+        :param rate: 每個 host 預設每秒請求數
+        :param capacity: 每個 host 預設允許的瞬間爆量
+        :param host_rates: 個別 host 的 (rate, capacity) 設定，例如 {'bff.591.com.tw': (0.2, 1)}
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.host_rates = host_rates or {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, url):
+        """ 取得 url 所屬 host 的 TokenBucket (第一次使用時建立) """
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._buckets:
+                rate, capacity = self.host_rates.get(host, (self.rate, self.capacity))
+                self._buckets[host] = TokenBucket(rate, capacity)
+            return self._buckets[host]
+
+    def acquire(self, url):
+        """ 對 url 所屬 host 取得一個 token，必要時阻塞等待 """
+        return self.bucket(url).acquire()
+
+    async def acquire_async(self, url):
+        """ acquire 的 asyncio 版本 """
+        return await self.bucket(url).acquire_async()
+
+
+def parse_retry_after(value):
+    """ 解析 Retry-After header (秒數或 HTTP 日期)，回傳秒數，無法解析時回傳 None """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+def backoff_delay(attempt, retry_after=None, base=1.0, cap=2 * MAX_REQUEST_DELAY):
+    """ 第 attempt 次 (由 0 起算) 失敗後應等待的秒數
+
+    有 Retry-After 時依伺服器指定；否則為 base * 2^attempt 的指數退避，
+    取一半固定、一半隨機 (jitter)，避免多個執行緒同時重試
+
+    :param cap: 等待秒數上限
+    """
+    if retry_after is not None:
+        return min(retry_after, cap)
+    delay = min(cap, base * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+# 自適應限速：遇到 429 / 5xx / 逾時則減速並退避，之後回應正常且夠快時逐步加速回設定的速率
+class AdaptiveRateLimiter(HostRateLimiter):
+    def __init__(self, rate=1 / REQUEST_DELAY, capacity=1, host_rates=None,
+                 min_rate=1 / MAX_REQUEST_DELAY, max_rate=None,
+                 speedup=1.1, slowdown=0.5, slow_latency=5.0, backoff_base=1.0, max_backoff=2 * MAX_REQUEST_DELAY):
+        """ 建立自適應限速器
+
+        :param rate: 每個 host 起始的每秒請求數，預設為 1 / config.REQUEST_DELAY
+        :param capacity: 每個 host 允許的瞬間爆量
+        :param host_rates: 個別 host 起始的 (rate, capacity) 設定
+        :param min_rate: 減速的下限，預設為 1 / config.MAX_REQUEST_DELAY
+        :param max_rate: 加速的上限，預設為各 host 起始的速率 (即不會快於 config.REQUEST_DELAY 等設定)；
+                         只有在確定對方允許時才指定更高的值
+        :param speedup: 每次正常回應時速率乘上的倍數
+        :param slowdown: 每次失敗時速率乘上的倍數
+        :param slow_latency: 回應時間超過此秒數時視為伺服器吃緊，改為減速
+        :param backoff_base: 指數退避的基準秒數
+        :param max_backoff: 單次退避的最長秒數
+        """
+        super().__init__(rate=rate, capacity=capacity, host_rates=host_rates)
+        self.min_rate = min(min_rate, rate)
+        self.max_rate = None if max_rate is None else max(max_rate, rate)
+        self.speedup = speedup
+        self.slowdown = slowdown
+        self.slow_latency = slow_latency
+        self.backoff_base = backoff_base
+        self.max_backoff = max_backoff
+        self._slowed_at = {}  # host -> 上次減速的時間
+
+    def current_rate(self, url):
+        """ url 所屬 host 目前的每秒請求數 """
+        return self.bucket(url).rate
+
+    def ceiling(self, url):
+        """ url 所屬 host 加速的上限：max_rate，未指定時為該 host 起始的速率 """
+        if self.max_rate is not None:
+            return self.max_rate
+        return self.host_rates.get(urlparse(url).netloc, (self.rate, self.capacity))[0]
+
+    def on_success(self, url, elapsed):
+        """ 回報一次正常回應
+
+        :param elapsed: 回應時間 (秒)
+        """
+        bucket = self.bucket(url)
+        if elapsed <= self.slow_latency:
+            bucket.scale_rate(self.speedup, max_rate=self.ceiling(url))
+        else:
+            bucket.scale_rate(1 / self.speedup, min_rate=self.min_rate)
+
+    def on_failure(self, url, attempt=0, retry_after=None):
+        """ 回報一次失敗 (429 / 5xx / 逾時)：降低速率，並暫停該 host 直到退避結束
+
+        :param attempt: 這是同一個請求第幾次失敗 (由 0 起算)
+        :param retry_after: 伺服器指定的等待秒數
+        :return delay: 退避秒數
+        """
+        bucket = self.bucket(url)
+        host = urlparse(url).netloc
+        now = time.monotonic()
+        with self._lock:
+            # 同時進行中的請求常一起失敗，每個請求間隔內只減速一次，避免速率瞬間掉到下限
+            slow_down = now - self._slowed_at.get(host, float('-inf')) >= 1 / bucket.rate
+            if slow_down:
+                self._slowed_at[host] = now
+        if slow_down:
+            bucket.scale_rate(self.slowdown, min_rate=self.min_rate)
+        delay = backoff_delay(attempt, retry_after, self.backoff_base, self.max_backoff)
+        bucket.pause(delay)
+        return delay
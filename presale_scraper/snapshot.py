@@ -0,0 +1,189 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
+import metrics
+import storage
+from config import DATA_DIR
+from storage import SNAPSHOT_COLUMN
+
+# 增量匯入：每次只寫入與上一個狀態相比新增、變更、刪除的資料列
+# <name>          新增 / 變更的完整資料列 (含 _key、_hash、_op)
+# <name>_deleted  被刪除的 _key
+KEY_COLUMN = '_key'
+HASH_COLUMN = '_hash'
+OP_COLUMN = '_op'
+CITY_COLUMN = '縣市'
+
+# 不列入內容比對的欄位 (每次匯入都會不同)
+IGNORED_COLUMNS = ('input_time', '匯入時間', SNAPSHOT_COLUMN, KEY_COLUMN, HASH_COLUMN, OP_COLUMN)
+
+
+def row_hashes(df, key_cols=None, ignore_cols=IGNORED_COLUMNS):
+    """ 計算每列的 key 與內容 hash (uint64)
+
+    :param df: DataFrame
+    :param key_cols: 識別資料列的欄位，例如 ['編號'] 或 ['id']；None 表示以整列內容當 key
+                     (此時變更會被視為刪除舊列 + 新增新列)
+    :param ignore_cols: 不列入內容比對的欄位
+    :return keys, hashes: 兩個 numpy uint64 陣列
+    """
+    value_cols = sorted(column for column in df.columns if column not in ignore_cols)
+    hashes = pd.util.hash_pandas_object(df[value_cols], index=False).to_numpy()
+    if not key_cols:
+        return hashes, hashes
+    keys = pd.util.hash_pandas_object(df[list(key_cols)], index=False).to_numpy()
+    return keys, hashes
+
+
+def _deleted_name(name):
+    return f'{name}_deleted'
+
+
+def latest_snapshot(name, base_dir=DATA_DIR):
+    """ 最新的快照日期 (含只有刪除的快照)，沒有任何快照時回傳 None """
+    snapshots = storage.list_snapshots(name, base_dir) + storage.list_snapshots(_deleted_name(name), base_dir)
+    return max(snapshots) if snapshots else None
+
+
+def _latest_rows(upserts, deletes):
+    """ 由新增/變更紀錄與刪除紀錄，求出每個 key 最新且未被刪除的那一列 """
+    upserts = upserts.sort_values(SNAPSHOT_COLUMN, kind='stable').drop_duplicates(KEY_COLUMN, keep='last')
+    if len(deletes):
+        last_delete = deletes.groupby(KEY_COLUMN)[SNAPSHOT_COLUMN].max()
+        deleted_at = upserts[KEY_COLUMN].map(last_delete)
+        upserts = upserts[~(deleted_at.notna() & (deleted_at >= upserts[SNAPSHOT_COLUMN]))]
+    return upserts
+
+
+def _read_history(name, columns, until, inclusive=True, cities=None, base_dir=DATA_DIR):
+    """ 讀取 until (含或不含) 以前的新增/變更與刪除紀錄 """
+    filters = [(SNAPSHOT_COLUMN, '<=' if inclusive else '<', until)]
+    if cities is not None:
+        filters.append((CITY_COLUMN, 'in', list(cities)))
+    upserts = storage.read_dataset(name, columns=columns, filters=filters, snapshot=None, base_dir=base_dir)
+    deletes = storage.read_dataset(_deleted_name(name), columns=[KEY_COLUMN, SNAPSHOT_COLUMN],
+                                   filters=filters, snapshot=None, base_dir=base_dir)
+    return upserts, deletes
+
+
+@metrics.timed('snapshot_ingest')
+def ingest(df, name, snapshot=None, key_cols=None, cities=None, base_dir=DATA_DIR):
+    """ 將新取得的完整資料與已存的最新狀態比對，只寫入差異
+
+    只有這次匯入範圍內的縣市會判斷刪除，範圍外的縣市維持原狀，
+    因此只抓部分縣市時不會把其他縣市的資料全部標記為刪除
+
+    :param df: 這次取得的完整資料 (需含 縣市 欄位)
+    :param name: 資料集名稱，例如 'presale_delta'
+    :param snapshot: 快照日期字串，預設為今天 (YYYYMMDD)，需不早於已存的最新快照
+    :param key_cols: 識別資料列的欄位，例如預售屋 ['編號']
+    :param cities: 這次匯入的縣市範圍，例如 combined_df 所用 url 的縣市；None 表示 df 中出現的縣市。
+                   範圍內任一縣市沒有資料時視為抓取失敗，拒絕匯入
+    :param base_dir: 資料根目錄
+    :return changes: {'insert': DataFrame, 'update': DataFrame, 'delete': DataFrame (_key, 縣市)}
+    """
+    snapshot = snapshot or datetime.datetime.now().strftime('%Y%m%d')
+    if cities is None:
+        cities = list(df[CITY_COLUMN].dropna().unique())
+        if not cities:
+            raise ValueError(f'這次取得的資料沒有任何縣市，可能抓取失敗，拒絕匯入快照 {snapshot}')
+    else:
+        cities = list(cities)
+        counts = df[CITY_COLUMN].value_counts()
+        empty = [city for city in cities if counts.get(city, 0) == 0]
+        if empty:
+            raise ValueError(f'{"、".join(map(str, empty))} 沒有任何資料，可能抓取失敗，拒絕匯入快照 {snapshot}')
+        outside = ~df[CITY_COLUMN].isin(cities)
+        if outside.any():
+            raise ValueError(f'有 {outside.sum()} 筆資料的縣市不在匯入範圍 {cities} 內')
+    latest = latest_snapshot(name, base_dir)
+    if latest is not None and snapshot < latest:
+        raise ValueError(f'快照 {snapshot} 早於已存的最新快照 {latest}')
+
+    new = df.copy(deep=False)
+    new[KEY_COLUMN], new[HASH_COLUMN] = row_hashes(df, key_cols)
+    duplicated = new[KEY_COLUMN].duplicated(keep='last')
+    if duplicated.any():
+        print(f"發現 {duplicated.sum()} 筆重複的 key，保留最後一筆")
+        new = new[~duplicated]
+
+    # 上一個快照為止、匯入範圍內各縣市的狀態，只讀 key、hash、縣市 三個欄位
+    upserts, deletes = _read_history(name, [KEY_COLUMN, HASH_COLUMN, CITY_COLUMN, SNAPSHOT_COLUMN],
+                                     snapshot, inclusive=False, cities=cities, base_dir=base_dir)
+    state = _latest_rows(upserts, deletes) if len(upserts) else upserts
+
+    if len(state):
+        state_keys = state[KEY_COLUMN].to_numpy(dtype=np.uint64)
+        in_state = new[KEY_COLUMN].isin(state_keys).to_numpy()
+        unchanged = pd.MultiIndex.from_arrays([new[KEY_COLUMN], new[HASH_COLUMN]]).isin(
+            pd.MultiIndex.from_arrays([state_keys, state[HASH_COLUMN].to_numpy(dtype=np.uint64)]))
+        removed = state[~state[KEY_COLUMN].isin(new[KEY_COLUMN].to_numpy())]
+    else:
+        in_state = np.zeros(len(new), dtype=bool)
+        unchanged = in_state
+        removed = pd.DataFrame(columns=[KEY_COLUMN, CITY_COLUMN])
+
+    inserted = new[~in_state].assign(**{OP_COLUMN: 'insert'})
+    updated = new[in_state & ~unchanged].assign(**{OP_COLUMN: 'update'})
+    removed = removed[[KEY_COLUMN, CITY_COLUMN]].reset_index(drop=True)
+
+    # 沒有差異時也寫入 (空的 DataFrame)，重新匯入同一個快照時會清除該快照先前的差異
+    changed = pd.concat([inserted, updated], ignore_index=True)
+    storage.write_dataset(changed, name, snapshot=snapshot, base_dir=base_dir)
+    storage.write_dataset(removed, _deleted_name(name), snapshot=snapshot, base_dir=base_dir)
+
+    print(f"快照 {snapshot}: 新增 {len(inserted)} 筆、變更 {len(updated)} 筆、刪除 {len(removed)} 筆、"
+          f"未變 {len(new) - len(inserted) - len(updated)} 筆")
+    return {'insert': inserted, 'update': updated, 'delete': removed}
+
+
+@metrics.timed('snapshot_reconstruct')
+def reconstruct(name, snapshot='latest', columns=None, cities=None, base_dir=DATA_DIR):
+    """ 重建某個快照當下的完整資料
+
+    :param name: 資料集名稱
+    :param snapshot: 'latest' 或快照日期字串
+    :param columns: 要讀取的欄位，None 表示全部
+    :param cities: 只重建這些縣市
+    :param base_dir: 資料根目錄
+    :return df: 該快照的完整資料
+    """
+    if snapshot == 'latest':
+        snapshot = latest_snapshot(name, base_dir)
+        if snapshot is None:
+            return pd.DataFrame(columns=columns or [])
+
+    read_columns = None
+    if columns is not None:
+        read_columns = list(dict.fromkeys(list(columns) + [KEY_COLUMN, SNAPSHOT_COLUMN]))
+    upserts, deletes = _read_history(name, read_columns, snapshot, cities=cities, base_dir=base_dir)
+    if not len(upserts):
+        return pd.DataFrame(columns=columns or [])
+    df = _latest_rows(upserts, deletes)
+
+    meta_columns = [KEY_COLUMN, HASH_COLUMN, OP_COLUMN, SNAPSHOT_COLUMN]
+    keep = columns if columns is not None else [column for column in df.columns if column not in meta_columns]
+    return df[keep].reset_index(drop=True)
+
+
+def read_changes(name, snapshot='latest', base_dir=DATA_DIR):
+    """ 讀取某個快照的異動 (change feed)
+
+    :return changes: {'insert': DataFrame, 'update': DataFrame, 'delete': DataFrame}
+    """
+    if snapshot == 'latest':
+        snapshot = latest_snapshot(name, base_dir)
+    changed = pd.DataFrame(columns=[OP_COLUMN])
+    removed = pd.DataFrame(columns=[KEY_COLUMN, CITY_COLUMN])
+    if snapshot is not None:
+        changed = storage.read_dataset(name, snapshot=snapshot, base_dir=base_dir)
+        removed = storage.read_dataset(_deleted_name(name), snapshot=snapshot, base_dir=base_dir)
+        if not len(changed):
+            changed = pd.DataFrame(columns=[OP_COLUMN])
+    return {
+        'insert': changed[changed[OP_COLUMN] == 'insert'],
+        'update': changed[changed[OP_COLUMN] == 'update'],
+        'delete': removed,
+    }
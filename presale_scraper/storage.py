@@ -0,0 +1,114 @@
+import os
+import shutil
+import datetime
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+import metrics
+from config import DATA_DIR
+
+# 分區欄位：先依快照日期、再依縣市，目錄為 <name>/snapshot=20250417/縣市=臺北市/
+SNAPSHOT_COLUMN = 'snapshot'
+PARTITION_COLUMNS = [SNAPSHOT_COLUMN, '縣市']
+
+
+def _partitioning(partition_cols):
+    return ds.partitioning(pa.schema([(column, pa.string()) for column in partition_cols]), flavor='hive')
+
+
+def dataset_path(name, base_dir=DATA_DIR):
+    """ 資料集目錄，例如 ../data/plvr_output """
+    return os.path.join(base_dir, name)
+
+
+def list_snapshots(name, base_dir=DATA_DIR):
+    """ 列出資料集已有的快照日期 (由舊到新) """
+    path = dataset_path(name, base_dir)
+    if not os.path.isdir(path):
+        return []
+    prefix = f'{SNAPSHOT_COLUMN}='
+    return sorted(entry[len(prefix):] for entry in os.listdir(path) if entry.startswith(prefix))
+
+
+@metrics.timed()
+def write_dataset(df, name, snapshot=None, partition_cols=PARTITION_COLUMNS, base_dir=DATA_DIR):
+    """ 將 DataFrame 以分區 Parquet 寫入，取代 to_csv + to_pickle 兩次寫出
+
+    字串欄位以 dictionary 編碼儲存，讀回時為 category；重寫同一個快照時會取代整個快照
+(包含這次沒有寫入的縣市分區)，df 為空時即清除該快照
+
+    :param df: 要寫入的 DataFrame，需包含 partition_cols 中除 snapshot 以外的欄位
+    :param name: 資料集名稱，例如 'presale_output'、'plvr_output'
+    :param snapshot: 快照日期字串，預設為今天 (YYYYMMDD)
+    :param partition_cols: 分區欄位
+    :param base_dir: 資料根目錄
+    :return path: 資料集目錄
+    """
+    snapshot = snapshot or datetime.datetime.now().strftime('%Y%m%d')
+    df = df.copy(deep=False)
+    df[SNAPSHOT_COLUMN] = snapshot
+    for column in partition_cols:
+        df[column] = df[column].astype(str)
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    # 字串欄位改用 dictionary 編碼 (重複值多的縣市、行政區、社區名稱等可大幅縮小)
+    for i, field in enumerate(table.schema):
+        is_string = pa.types.is_string(field.type) or pa.types.is_large_string(field.type)
+        if is_string and field.name not in partition_cols:
+            table = table.set_column(i, field.name, pc.dictionary_encode(table.column(i)))
+
+    path = dataset_path(name, base_dir)
+    # delete_matching 只會刪除這次有寫入的分區，先移除整個快照目錄
+    shutil.rmtree(os.path.join(path, f'{SNAPSHOT_COLUMN}={snapshot}'), ignore_errors=True)
+    ds.write_dataset(
+        table, path, format='parquet',
+        partitioning=_partitioning(partition_cols),
+        existing_data_behavior='delete_matching',
+        basename_template='part-{i}.parquet',
+    )
+    return path
+
+
+@metrics.timed()
+def read_dataset(name, columns=None, filters=None, snapshot='latest', partition_cols=PARTITION_COLUMNS,
+                 base_dir=DATA_DIR):
+    """ 讀取分區 Parquet 資料集，只讀需要的欄位與分區
+
+    :param name: 資料集名稱
+    :param columns: 要讀取的欄位，None 表示全部
+    :param filters: 篩選條件，例如 [('縣市', 'in', ['臺北市', '新北市']), ('交易總價', '>', 1000)]，
+                    分區欄位的條件只會讀取符合的目錄，其餘欄位的條件在讀檔時套用
+    :param snapshot: 'latest' 為最新快照，None 為全部快照，或指定快照日期字串
+    :param partition_cols: 分區欄位
+    :param base_dir: 資料根目錄
+    :return df: DataFrame (dictionary 編碼欄位為 category)
+    """
+    path = dataset_path(name, base_dir)
+    partitioning = _partitioning(partition_cols)
+    if not os.path.isdir(path):
+        return pd.DataFrame(columns=columns or [])
+    dataset = ds.dataset(path, format='parquet', partitioning=partitioning)
+
+    expression = pq.filters_to_expression(filters) if filters else None
+    if snapshot == 'latest':
+        snapshots = list_snapshots(name, base_dir)
+        snapshot = snapshots[-1] if snapshots else None
+    if snapshot is not None:
+        snapshot_filter = ds.field(SNAPSHOT_COLUMN) == snapshot
+        expression = snapshot_filter if expression is None else expression & snapshot_filter
+
+    # 只開啟符合分區條件的檔案；各快照的欄位型態可能不同 (例如某次整欄皆為空值)，合併 schema 後再讀取
+    fragments = list(dataset.get_fragments(filter=expression))
+    if not fragments:
+        return pd.DataFrame(columns=columns or [])
+    schema = pa.unify_schemas([fragment.physical_schema for fragment in fragments] + [partitioning.schema],
+                              promote_options='permissive')
+    dataset = ds.dataset([fragment.path for fragment in fragments], schema=schema, format='parquet',
+                         partitioning=partitioning, partition_base_dir=path)
+
+    table = dataset.to_table(columns=columns, filter=expression)
+    return table.to_pandas()
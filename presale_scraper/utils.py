@@ -1,56 +1,222 @@
-import os
 import re
-import time
-import datetime
-from tqdm import tqdm 
+import json
+import codecs
+import numpy as np
 import pandas as pd
-import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import http_client
+import metrics
+from config import plvr_column_names
+from http_client import get_session
+from ratelimit import AdaptiveRateLimiter
 
 # 以手動更新取得的urls，再利用 requests 取得於實價登錄網站取回 JSON 資料並回傳 DataFrame
 
 
-def fetch_data(url):
+def fetch_data(url, session=None, timeout=60, throttle=None, raise_errors=False):
+    """ 取得單一網址的 JSON 資料並轉為 DataFrame
+
+    :param raise_errors: 請求或解析失敗時是否引發原本的例外，預設印出原因並回傳空的 DataFrame
+    """
     try:
-        response = requests.get(url)
+        response = http_client.get(url, timeout=timeout, session=session, throttle=throttle)
         response.raise_for_status()  # 若有錯誤狀況，會引發例外
-        data = response.json()
-        return pd.DataFrame(data)
+        with metrics.stage('parse_json'):
+            data = response.json()
+            return pd.DataFrame(data)
     except Exception as e:
         print(f"取得資料時發生錯誤：{e}")
+        if raise_errors:
+            raise
         return pd.DataFrame()  # 回傳空的 DataFrame
-    
+
+
+# combined_df(strict=True) 有縣市請求失敗時引發
+class CityFetchError(RuntimeError):
+    def __init__(self, failed, partial):
+        """
+        :param failed: {縣市名稱: 失敗原因}
+        :param partial: 其餘縣市合併後的 DataFrame
+        """
+        self.failed = failed
+        self.partial = partial
+        reasons = '、'.join(f'{city} ({reason})' for city, reason in failed.items())
+        super().__init__(f'{len(failed)} 個縣市抓取失敗: {reasons}')
+
+
+# 逐段解析 JSON 陣列，每解析完一個元素就回傳，不需等整個回應下載完
+def iter_json_array(chunks):
+    """ 由 bytes 片段逐一解析 JSON 陣列中的元素
+
+    :param chunks: bytes 片段的 iterable (例如 http_client.iter_content)
+    :return: generator，逐一 yield 陣列中的元素
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    buffer = ''
+    started = False
+    finished = False
+    chunks = iter(chunks)
+    while not finished:
+        chunk = next(chunks, None)
+        if chunk is None:
+            buffer += text_decoder.decode(b'', final=True)
+        else:
+            buffer += text_decoder.decode(chunk)
+        pos = 0
+        while True:
+            # 略過空白與元素間的逗號
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos >= len(buffer):
+                break
+            if not started:
+                if buffer[pos] != '[':
+                    raise ValueError('回應內容不是 JSON 陣列')
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == ']':
+                finished = True
+                break
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if chunk is None:
+                    raise
+                break  # 元素尚未下載完整，等下一段
+            # 數字在片段結尾可能被切斷 (例如 45|6 或 7.|5)，確認後面接的是 , 或 ] 才算完整
+            after = end
+            while after < len(buffer) and buffer[after] in ' \t\r\n':
+                after += 1
+            if after == len(buffer) or buffer[after] not in ',]':
+                if chunk is None:
+                    raise ValueError('JSON 陣列不完整' if after == len(buffer) else 'JSON 陣列元素之間缺少逗號')
+                break  # 等下一段
+            pos = end
+            yield item
+        buffer = buffer[pos:]
+        if chunk is None and not finished:
+            raise ValueError('JSON 陣列不完整')
+
+
+def iter_data_batches(url, columns=None, batch_size=5000, session=None, timeout=60, throttle=None):
+    """ 串流下載並解析實價登錄網站的 JSON 陣列，每 batch_size 筆組成一個 DataFrame 回傳
+
+    記憶體用量與 batch_size 成正比，而非與整個縣市的資料量成正比
+
+    :param url: 資料網址
+    :param columns: 只保留的原始欄位，例如 list(config.column_names)，None 表示保留全部；
+                    同 fetch_data，資料中完全沒有的欄位不會出現
+    :param batch_size: 每批筆數
+    :return: generator，逐批 yield DataFrame (各批的欄位可能不同，合併後再依 columns 排序)
+    """
+    items = iter_json_array(http_client.iter_content(url, timeout=timeout, session=session, throttle=throttle))
+    keep = [column for column in columns if column not in ('city_name', 'input_time')] if columns else None
+    while True:
+        batch = [item for _, item in zip(range(batch_size), items)]
+        if not batch:
+            break
+        if keep is None:
+            yield pd.DataFrame(batch)
+        else:
+            # 依欄位組成 list 再建立 DataFrame，不保留多餘欄位，也不建立這批資料中沒有的欄位
+            present = {key for item in batch for key in item}
+            yield pd.DataFrame({column: [item.get(column) for item in batch] for column in keep if column in present})
+        if len(batch) < batch_size:
+            break
+
+
+def fetch_data_stream(url, columns=None, batch_size=5000, session=None, timeout=60, throttle=None,
+                      raise_errors=False):
+    """ fetch_data 的串流版本：邊下載邊解析，只保留需要的欄位，失敗時的處理同 fetch_data """
+    try:
+        batches = list(iter_data_batches(url, columns, batch_size, session, timeout, throttle))
+    except Exception as e:
+        print(f"取得資料時發生錯誤：{e}")
+        if raise_errors:
+            raise
+        return pd.DataFrame()
+    if not batches:
+        return pd.DataFrame()
+    df = pd.concat(batches, ignore_index=True)
+    if columns is not None:
+        # 欄位與 fetch_data 後依 columns 篩選的結果相同
+        df = df[[column for column in columns if column in df.columns]]
+    return df
+
 
 # 合併dataframe
-def combined_df(url, input_time):
-    # 建立一個空的列表存放各區的 DataFrame
-    df_list = []
+@metrics.timed()
+def combined_df(url, input_time, max_workers=8, rate_per_host=1.0, columns=None, stream=False, strict=False):
+    """ 同時抓取各縣市資料並合併
+
+    沒有資料的縣市 (0 筆) 不視為失敗；請求失敗的縣市預設印出原因後略過，
+    strict=True 時等所有縣市結束後引發 CityFetchError (列出這些縣市)，不回傳缺少部分縣市的結果
+
+    :param url: {縣市名稱: 網址} 字典，例如 config.urls_1140412
+    :param input_time: 匯入時間，例如 "1140412"
+    :param max_workers: 同時進行中的請求數上限，設為 1 即逐一抓取
+    :param rate_per_host: 每個 host 每秒請求數的上限，遇到 429 / 5xx 時減速並退避，之後回應正常時逐步恢復
+    :param columns: 只保留的原始欄位，例如 list(config.column_names)，None 表示保留全部
+    :param stream: 是否以串流方式邊下載邊解析 (大縣市可降低記憶體用量)
+    :param strict: 有縣市請求失敗時是否引發 CityFetchError
+    :return combined_df: 合併後的 DataFrame，含 city_name 與 input_time 欄位
+    :raise CityFetchError: strict 時有縣市請求失敗，failed 為 {縣市名稱: 原因}，partial 為其餘縣市的結果
+    """
+    session = get_session(pool_maxsize=max_workers)
+    # 允許第一波 max_workers 個請求同時送出，之後依 rate_per_host 補充並依回應狀況調整
+    throttle = AdaptiveRateLimiter(rate=rate_per_host, capacity=max_workers)
     city_counts = {}  # 用於記錄每個縣市的資料筆數
     
     print("開始處理各縣市資料：")
-    
-    # 迴圈走訪所有 URL，並新增表示地區和輸入時間的欄位
-    for city_name, uni_url in url.items():
-        print(f"處理 {city_name} 中...", end="", flush=True)
-        
-        df_temp = fetch_data(uni_url)
-        if not df_temp.empty:
-            df_temp["city_name"] = city_name      # 加入來源區域欄位，便於後續分析
-            df_temp["input_time"] = input_time    # 加入從變數名稱提取的時間
-            
-            # 記錄此縣市的資料筆數
-            row_count = len(df_temp)
-            city_counts[city_name] = row_count
-            
-            # 直接打印當前縣市的資料筆數
-            print(f" 完成! 找到 {row_count} 筆資料")
-        else:
-            print(" 完成! 找到 0 筆資料")
-            
-        df_list.append(df_temp)
-        time.sleep(1)  # 每次發出請求後暫停 1 秒
 
-    # 利用 pd.concat 合併所有 DataFrame（重置索引）
-    combined_df = pd.concat(df_list, ignore_index=True)
+    def fetch_city(city_name, uni_url):
+        # 命中快取時不會等待限速
+        if stream:
+            return fetch_data_stream(uni_url, columns=columns, session=session, throttle=throttle, raise_errors=True)
+        df_temp = fetch_data(uni_url, session=session, throttle=throttle, raise_errors=True)
+        if columns is not None and not df_temp.empty:
+            df_temp = df_temp[[column for column in columns if column in df_temp.columns]]
+        return df_temp
+
+    # 以執行緒池同時抓取，總耗時約等於最慢的縣市而非所有縣市加總
+    results = {}
+    failed = {}  # 縣市名稱 -> 失敗原因
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(fetch_city, city_name, uni_url): city_name
+                   for city_name, uni_url in url.items()}
+        for future in as_completed(futures):
+            city_name = futures[future]
+            try:
+                df_temp = future.result()
+            except Exception as e:
+                print(f"處理 {city_name} 失敗: {e}")
+                failed[city_name] = str(e) or type(e).__name__
+                metrics.inc('fetch_failures_total', city=city_name)
+                continue
+            if not df_temp.empty:
+                df_temp["city_name"] = city_name      # 加入來源區域欄位，便於後續分析
+                df_temp["input_time"] = input_time    # 加入從變數名稱提取的時間
+                
+                # 記錄此縣市的資料筆數
+                row_count = len(df_temp)
+                city_counts[city_name] = row_count
+                metrics.inc('rows_fetched_total', row_count, city=city_name)
+                print(f"處理 {city_name} 完成! 找到 {row_count} 筆資料")
+            else:
+                print(f"處理 {city_name} 完成! 找到 0 筆資料")
+            results[city_name] = df_temp
+
+    # 依原本 url 的縣市順序合併，結果與逐一抓取相同（重置索引）
+    df_list = [results[city_name] for city_name in url if city_name in results]
+    combined_df = pd.concat(df_list, ignore_index=True) if df_list else pd.DataFrame()
+    if failed:
+        failed = {city_name: failed[city_name] for city_name in url if city_name in failed}
+        if strict:
+            raise CityFetchError(failed, combined_df)
+        print(f"\n{len(failed)} 個縣市抓取失敗，已略過: {'、'.join(failed)}")
     
     # # 顯示各縣市資料筆數統計
     # print("\n各縣市資料筆數統計:")
@@ -144,3 +310,126 @@ def sales_start_time(row):
         return ""
     
 
+
+# parse_admin_region 的向量化版本
+def admin_region(address):
+    """ 由整欄坐落地址折分出行政區，結果與逐列套用 parse_admin_region 相同
+
+    第二個字是「區」取前兩字，其餘取前三字 (不足三字取整串)，非字串或空字串為空值
+    """
+    region = address.str.slice(0, 3).where(address.str.get(1) != "區", address.str.slice(0, 2))
+    return region.where(address.str.len() > 0, None)
+
+
+# 以向量化方式產生預售屋建案的衍生欄位，取代逐列 apply
+@metrics.timed()
+def derive_presale_columns(df):
+    """ 一次產生 行政區、自售期間、代銷期間、自售起始時間、代銷起始時間、銷售起始時間 欄位
+
+    結果與 parse_admin_region、parse_sale_period、find_first_sale_time、sales_start_time
+    逐列套用相同，但改用 str.extract / NumPy 整欄運算
+
+    :param df: 已依 config.column_names 改名的預售屋建案 DataFrame
+    :return proc_df: 加上衍生欄位的新 DataFrame
+    """
+    proc_df = df.copy()
+
+    proc_df["行政區"] = admin_region(proc_df["坐落街道"])
+
+    # 銷售期間拆出自售期間、代銷期間
+    sales_period = proc_df["銷售期間"]
+    self_period = sales_period.str.extract(r"自售:(.*?)(?=;|代銷:|$)", expand=False).str.strip()
+    agent_period = sales_period.str.extract(r"代銷:(.*?)(?=;|$)", expand=False).str.strip()
+    # 與逐列函式一致，object 欄位的空值為 None
+    proc_df["自售期間"] = self_period.where(self_period.notna(), None)
+    proc_df["代銷期間"] = agent_period.where(agent_period.notna(), None)
+
+    # 自售期間、代銷期間的第一個 7 位數字
+    self_time = proc_df["自售期間"].str.extract(r"(\d{7})", expand=False)
+    agent_time = proc_df["代銷期間"].str.extract(r"(\d{7})", expand=False)
+    proc_df["自售起始時間"] = self_time.where(self_time.notna(), None)
+    proc_df["代銷起始時間"] = agent_time.where(agent_time.notna(), None)
+
+    # 銷售起始時間：規則同 sales_start_time
+    self_na = self_time.isna().to_numpy()
+    agent_na = agent_time.isna().to_numpy()
+    earliest = np.fmin(pd.to_numeric(self_time, errors="coerce").to_numpy(dtype=float),
+                       pd.to_numeric(agent_time, errors="coerce").to_numpy(dtype=float))
+    earliest = np.where(np.isnan(earliest), "",
+                        np.nan_to_num(earliest).astype(np.int64).astype(str)).astype(object)
+    has_check = sales_period.str.contains("備查", regex=False).fillna(False).to_numpy(dtype=bool)
+    proc_df["銷售起始時間"] = np.select(
+        [
+            self_na & ~agent_na,                  # Rule 1: 只有代銷有值
+            agent_na & ~self_na,                  # Rule 1: 只有自售有值
+            ~self_na & ~agent_na,                 # Rule 2: 皆有值取較小者
+            has_check,                            # Rule 3: 皆無值且銷售期間含「備查」
+        ],
+        [
+            agent_time.to_numpy(dtype=object),
+            self_time.to_numpy(dtype=object),
+            earliest,
+            proc_df["備查完成日期"].to_numpy(dtype=object),
+        ],
+        default=proc_df["建照核發日"].to_numpy(dtype=object),
+    )
+
+    # dtype 與逐列 apply 的推斷結果相同 (pandas 3 為 str，較舊版本為 object)
+    for column in ["行政區", "自售期間", "代銷期間", "自售起始時間", "代銷起始時間", "銷售起始時間"]:
+        proc_df[column] = proc_df[column].infer_objects()
+
+    return proc_df
+
+
+# 實價登錄整理後輸出的欄位
+PLVR_OUTPUT_COLUMNS = ["縣市", "行政區", "坐落街道", "建物型態", "社區名稱", "棟號", "交易日期", "交易年月",
+                       "總面積", "交易總價", "建物單價", "樓層", "解約情形", "備查編號", "備註", "主要用途",
+                       "車位總價", "車位筆數", "經度", "緯度"]
+
+
+# 實價登錄 (plvr) 原始資料整理：只取需要的欄位，向量化轉換並使用精簡的 dtype
+@metrics.timed()
+def transform_plvr(df):
+    """ 將 combined_df 取得的實價登錄原始資料整理為輸出格式
+
+    - 只挑出需要的原始欄位後再改名，不複製整個 DataFrame
+    - 交易總價 (萬元) 轉為可含缺值的 Int32、建物單價 (萬元/坪，一位小數) 與總面積轉為 float32，
+      無法解析時保留缺值 (不以 0 代替，避免拉低下游的中位數等統計)
+    - 交易日期 (民國 yyy/mm/dd) 轉為 datetime64，交易年月為 "yyymm" 字串
+    - 縣市、行政區、建物型態、社區名稱、交易年月 轉為 category
+
+    :param df: combined_df 回傳的原始 DataFrame (欄位為 API 原始代號)
+    :return proc_df: 整理後的 DataFrame，欄位依 PLVR_OUTPUT_COLUMNS 排列
+    """
+    # 只挑出輸出需要的原始欄位 (行政區、交易年月 為衍生欄位)
+    needed = {key: name for key, name in plvr_column_names.items()
+              if name in PLVR_OUTPUT_COLUMNS and key in df.columns}
+    proc_df = df[list(needed)].rename(columns=needed)
+
+    # 行政區
+    proc_df["行政區"] = admin_region(proc_df["坐落街道"])
+
+    # 交易日期 (民國年) 拆成年、月、日後轉為西元日期
+    date_parts = proc_df["交易日期"].str.extract(r"^(\d+)/(\d+)/(\d+)$")
+    year = pd.to_numeric(date_parts[0], errors="coerce")
+    month = pd.to_numeric(date_parts[1], errors="coerce")
+    day = pd.to_numeric(date_parts[2], errors="coerce")
+    proc_df["交易年月"] = (date_parts[0] + date_parts[1]).astype("category")
+    proc_df["交易日期"] = pd.to_datetime(
+        pd.DataFrame({"year": year + 1911, "month": month, "day": day}), errors="coerce")
+
+    # 「交易總價」及「建物單價」由字串轉為數值 (萬元)
+    total_price = pd.to_numeric(proc_df["交易總價"].str.replace(",", "", regex=False), errors="coerce")
+    proc_df["交易總價"] = (total_price / 10000).round(0).astype("Int32")
+    unit_price = pd.to_numeric(proc_df["建物單價"].str.replace(",", "", regex=False), errors="coerce")
+    proc_df["建物單價"] = (unit_price / 10000).round(1).astype(np.float32)
+    proc_df["總面積"] = pd.to_numeric(proc_df["總面積"], errors="coerce").astype(np.float32)
+
+    # 經緯度保留 float64 精度
+    proc_df["經度"] = pd.to_numeric(proc_df["經度"], errors="coerce")
+    proc_df["緯度"] = pd.to_numeric(proc_df["緯度"], errors="coerce")
+
+    for column in ["縣市", "行政區", "建物型態", "社區名稱"]:
+        proc_df[column] = proc_df[column].astype("category")
+
+    return proc_df[[column for column in PLVR_OUTPUT_COLUMNS if column in proc_df.columns]]
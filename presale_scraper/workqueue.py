@@ -0,0 +1,483 @@
+import os
+import json
+import time
+import socket
+import sqlite3
+import argparse
+import threading
+import multiprocessing
+from urllib.parse import urlparse
+
+from config import REQUEST_DELAY, MAX_REQUEST_DELAY, MAX_RETRIES
+from ratelimit import backoff_delay
+from journal import CrawlJournal
+
+# 591 爬取工作佇列：搜尋 / 詳情任務存在 SQLite，多個 worker 行程以 lease / ack 領取任務，
+# 共用同一個速率預算，結果寫入共用的 CrawlJournal
+#
+# 任務狀態：pending (待領取) → leased (已領取) → done / failed (可重試) / dead (超過重試次數)
+# lease 逾期未 ack 的任務 (worker 當掉) 算一次失敗，未超過重試次數時會被其他 worker 重新領取；
+# 執行中的 worker 在背景定期延長 lease，並在寫入結果前確認 lease 仍屬於自己
+SEARCH = 'search'
+DETAIL = 'detail'
+
+
+def _connect(path):
+    db = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('PRAGMA busy_timeout=60000')
+    return db
+
+
+class WorkQueue():
+    def __init__(self, path, lease_seconds=300, max_retries=MAX_RETRIES):
+        """ 開啟 (或建立) 工作佇列
+
+        :param path: SQLite 檔案路徑，例如 '../data/output_591/work_queue.sqlite'
+        :param lease_seconds: 領取後多久未 ack 視為 worker 失效，任務可被重新領取
+        :param max_retries: 任務最多嘗試次數，預設為 config.MAX_RETRIES
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_retries = max_retries
+        self._db = _connect(path)
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT,            -- search / detail
+                key TEXT,             -- 去重用，例如 '1|世界明珠' 或 hid
+                payload TEXT,         -- 任務參數 (JSON)
+                status TEXT,          -- pending / leased / done / failed / dead
+                attempts INTEGER DEFAULT 0,
+                owner TEXT,           -- 領取的 worker
+                lease_expires REAL,
+                not_before REAL DEFAULT 0,  -- 失敗後退避，此時間前不可領取
+                error TEXT,
+                updated_at REAL,
+                UNIQUE (kind, key)
+            );
+            CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, not_before);
+        ''')
+
+    def put(self, kind, key, payload=None):
+        """ 加入任務，相同 (kind, key) 已存在時略過
+
+        :return: 是否為新加入的任務
+        """
+        cursor = self._db.execute(
+            "INSERT OR IGNORE INTO tasks (kind, key, payload, status, updated_at) VALUES (?, ?, ?, 'pending', ?)",
+            (kind, str(key), json.dumps(payload, ensure_ascii=False), time.time()))
+        return cursor.rowcount > 0
+
+    def put_many(self, tasks):
+        """ 批次加入任務
+
+        :param tasks: (kind, key, payload) 的 iterable
+        :return: 新加入的任務數
+        """
+        now = time.time()
+        rows = [(kind, str(key), json.dumps(payload, ensure_ascii=False), now) for kind, key, payload in tasks]
+        before = self._db.total_changes
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO tasks (kind, key, payload, status, updated_at) VALUES (?, ?, ?, 'pending', ?)",
+                rows)
+            self._db.execute('COMMIT')
+        except Exception:
+            self._db.execute('ROLLBACK')
+            raise
+        return self._db.total_changes - before
+
+    def lease(self, owner, kinds=None):
+        """ 領取一個任務 (原子操作，多個行程同時領取不會拿到同一個)
+
+        :param owner: worker 名稱
+        :param kinds: 只領取這些種類，None 表示全部 (詳情優先於搜尋，先消化已搜到的 hid)
+        :return task: {'id', 'kind', 'key', 'payload', 'attempts'}，目前沒有可領取的任務時為 None
+        """
+        kinds = list(kinds or (DETAIL, SEARCH))
+        now = time.time()
+        placeholders = ','.join('?' * len(kinds))
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            # lease 逾期的任務 (worker 當掉) 算一次失敗，每次都讓 worker 當掉的任務最後會成為 dead
+            self._db.execute('''
+                UPDATE tasks SET status = CASE WHEN attempts + 1 >= ? THEN 'dead' ELSE 'failed' END,
+                                 attempts = attempts + 1, owner = NULL, error = ?, updated_at = ?
+                WHERE status = 'leased' AND lease_expires < ?
+            ''', (self.max_retries, 'lease 逾期未回報 (worker 失效)', now, now))
+            row = self._db.execute(f'''
+                SELECT id, kind, key, payload, attempts FROM tasks
+                WHERE kind IN ({placeholders}) AND status IN ('pending', 'failed') AND not_before <= ?
+                ORDER BY kind = ? DESC, id
+                LIMIT 1
+            ''', (*kinds, now, DETAIL)).fetchone()
+            if row is not None:
+                self._db.execute(
+                    "UPDATE tasks SET status = 'leased', owner = ?, lease_expires = ?, updated_at = ? WHERE id = ?",
+                    (owner, now + self.lease_seconds, now, row[0]))
+            self._db.execute('COMMIT')
+        except Exception:
+            self._db.execute('ROLLBACK')
+            raise
+        if row is None:
+            return None
+        task_id, kind, key, payload, attempts = row
+        return {'id': task_id, 'kind': kind, 'key': key, 'payload': json.loads(payload), 'attempts': attempts}
+
+    def extend(self, task, owner):
+        """ 延長 lease (處理時間較長時呼叫)，lease 已逾期被回收或被他人領走時回傳 False """
+        cursor = self._db.execute(
+            "UPDATE tasks SET lease_expires = ? WHERE id = ? AND owner = ? AND status = 'leased'",
+            (time.time() + self.lease_seconds, task['id'], owner))
+        return cursor.rowcount > 0
+
+    def ack(self, task, owner):
+        """ 回報任務完成，lease 已逾期且被他人領走時回傳 False """
+        cursor = self._db.execute(
+            "UPDATE tasks SET status = 'done', attempts = attempts + 1, error = NULL, updated_at = ? "
+            "WHERE id = ? AND owner = ? AND status = 'leased'",
+            (time.time(), task['id'], owner))
+        return cursor.rowcount > 0
+
+    def nack(self, task, owner, error, retry_delay=None):
+        """ 回報任務失敗，未超過重試次數時於退避後可再被領取
+
+        :param error: 失敗原因
+        :param retry_delay: 幾秒後可重試，預設依嘗試次數指數退避
+        """
+        attempts = task['attempts'] + 1
+        status = 'failed' if attempts < self.max_retries else 'dead'
+        if retry_delay is None:
+            retry_delay = backoff_delay(task['attempts'], base=REQUEST_DELAY)
+        cursor = self._db.execute(
+            "UPDATE tasks SET status = ?, attempts = ?, error = ?, not_before = ?, updated_at = ? "
+            "WHERE id = ? AND owner = ? AND status = 'leased'",
+            (status, attempts, str(error), time.time() + retry_delay, time.time(), task['id'], owner))
+        return cursor.rowcount > 0
+
+    def counts(self):
+        """ 各種類、各狀態的任務數，例如 {'search': {'done': 70, 'pending': 3}, 'detail': {...}} """
+        counts = {}
+        for kind, status, count in self._db.execute('SELECT kind, status, COUNT(*) FROM tasks GROUP BY kind, status'):
+            counts.setdefault(kind, {})[status] = count
+        return counts
+
+    def unfinished(self):
+        """ 尚未結束 (pending / leased / failed) 的任務數 """
+        return self._db.execute(
+            "SELECT COUNT(*) FROM tasks WHERE status IN ('pending', 'leased', 'failed')").fetchone()[0]
+
+    def close(self):
+        self._db.close()
+
+
+# 跨行程共用的自適應限速：每個 host 的下次可送出時間與請求間隔存在 SQLite，
+# 所有 worker 合計不超過同一個速率；介面與 ratelimit.AdaptiveRateLimiter 相同，可直接交給 http_client
+class SharedRateLimiter():
+    def __init__(self, path, delay=REQUEST_DELAY, min_delay=None, max_delay=MAX_REQUEST_DELAY,
+                 speedup=1.1, slowdown=2.0, slow_latency=5.0, backoff_base=1.0):
+        """
+        :param path: SQLite 檔案路徑 (可與 WorkQueue 共用同一個檔案)
+        :param delay: 每個 host 起始的請求間隔秒數 (所有 worker 合計)
+        :param min_delay: 加速的下限，預設為 delay (減速後只會加速回起始的間隔，不會更快)
+        :param max_delay: 減速的上限
+        :param speedup: 正常回應時請求間隔除以的倍數
+        :param slowdown: 失敗時請求間隔乘上的倍數
+        :param slow_latency: 回應時間超過此秒數時改為減速
+        :param backoff_base: 指數退避的基準秒數
+        """
+        self.delay = delay
+        self.min_delay = delay if min_delay is None else min(min_delay, delay)
+        self.max_delay = max_delay
+        self.speedup = speedup
+        self.slowdown = slowdown
+        self.slow_latency = slow_latency
+        self.backoff_base = backoff_base
+        self._db = _connect(path)
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS rate_budget (
+                host TEXT PRIMARY KEY,
+                next_allowed REAL,    -- 下一個請求最早可送出的時間 (time.time())
+                delay REAL,           -- 目前的請求間隔秒數
+                slowed_at REAL        -- 上次減速的時間
+            )
+        ''')
+
+    def _update(self, url, change):
+        """ 在同一個交易內讀取並更新 host 的狀態
+
+        :param change: 函式 (now, next_allowed, delay, slowed_at) -> (next_allowed, delay, slowed_at, 回傳值)
+        """
+        host = urlparse(url).netloc
+        now = time.time()
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            row = self._db.execute(
+                'SELECT next_allowed, delay, slowed_at FROM rate_budget WHERE host = ?', (host,)).fetchone()
+            next_allowed, delay, slowed_at = row if row is not None else (now, self.delay, 0.0)
+            next_allowed, delay, slowed_at, result = change(now, next_allowed, delay, slowed_at)
+            self._db.execute('INSERT OR REPLACE INTO rate_budget VALUES (?, ?, ?, ?)',
+                             (host, next_allowed, delay, slowed_at))
+            self._db.execute('COMMIT')
+        except Exception:
+            self._db.execute('ROLLBACK')
+            raise
+        return result
+
+    def current_delay(self, url):
+        """ url 所屬 host 目前的請求間隔秒數 """
+        row = self._db.execute(
+            'SELECT delay FROM rate_budget WHERE host = ?', (urlparse(url).netloc,)).fetchone()
+        return row[0] if row is not None else self.delay
+
+    def acquire(self, url):
+        """ 預約 url 所屬 host 的下一個時段並等待，回傳等待秒數 """
+        def reserve(now, next_allowed, delay, slowed_at):
+            start = max(now, next_allowed)
+            return start + delay, delay, slowed_at, start - now
+
+        wait = self._update(url, reserve)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def on_success(self, url, elapsed):
+        """ 回報一次正常回應，回應夠快時縮短請求間隔 """
+        def speed_up(now, next_allowed, delay, slowed_at):
+            if elapsed <= self.slow_latency:
+                delay = max(self.min_delay, delay / self.speedup)
+            else:
+                delay = min(self.max_delay, delay * self.speedup)
+            return next_allowed, delay, slowed_at, None
+
+        self._update(url, speed_up)
+
+    def on_failure(self, url, attempt=0, retry_after=None):
+        """ 回報一次失敗：拉長請求間隔，並讓所有 worker 暫停該 host 直到退避結束
+
+        :return delay: 退避秒數
+        """
+        backoff = backoff_delay(attempt, retry_after, self.backoff_base, 2 * self.max_delay)
+
+        def slow_down(now, next_allowed, delay, slowed_at):
+            # 每個請求間隔內只減速一次，多個 worker 同時失敗不會讓間隔瞬間拉到上限
+            if now - slowed_at >= delay:
+                delay, slowed_at = min(self.max_delay, delay * self.slowdown), now
+            return max(next_allowed, now + backoff), delay, slowed_at, backoff
+
+        return self._update(url, slow_down)
+
+    def close(self):
+        self._db.close()
+
+
+def enqueue_communities(queue, records):
+    """ 將社區清單加入搜尋任務 (相同 縣市 + 社區名稱 只加入一次)
+
+    :param queue: WorkQueue
+    :param records: 社區清單，例如 [{'縣市': '1', '社區名稱': '世界明珠'}, ...] (縣市為 591 regionid)
+    :return: 新加入的任務數
+    """
+    tasks = []
+    for community in records:
+        region, keyword = str(community['縣市']), str(community['社區名稱']).strip()
+        tasks.append((SEARCH, f'{region}|{keyword}', {'region': region, 'keyword': keyword}))
+    added = queue.put_many(tasks)
+    print(f"共 {len(records)} 筆社區，新加入 {added} 個搜尋任務")
+    return added
+
+
+class _LeaseKeeper():
+    """ 任務執行期間在背景執行緒每 lease_seconds / 3 秒延長一次 lease，
+    重試與限速等待較久的任務不會在執行中被其他 worker 重新領取
+
+    用法：
+        with _LeaseKeeper(queue, task, owner):
+            _run_task(...)
+    """
+    def __init__(self, queue, task, owner):
+        self.queue = queue
+        self.task = task
+        self.owner = owner
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'lease-{task["id"]}', daemon=True)
+
+    def _run(self):
+        # sqlite 連線不跨執行緒共用，另外開一個連線
+        queue = WorkQueue(self.queue.path, lease_seconds=self.queue.lease_seconds)
+        try:
+            while not self._stop.wait(self.queue.lease_seconds / 3):
+                if not queue.extend(self.task, self.owner):
+                    break
+        finally:
+            queue.close()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def _run_task(task, queue, journal, spider, owner):
+    """ 執行單一任務，結果寫入 journal，搜尋到的建案再加入詳情任務
+
+    寫入結果前先確認 (並延長) lease；lease 已被其他 worker 領走時捨棄這次的結果，
+    避免兩個 worker 寫入同一個任務
+    """
+    def still_owned():
+        if queue.extend(task, owner):
+            return True
+        print(f"[{owner}] 任務 {task['kind']} {task['key']} 的 lease 已被收回，捨棄這次的結果")
+        return False
+
+    def finish(ok, error=None):
+        acked = queue.ack(task, owner) if ok else queue.nack(task, owner, error)
+        if not acked:
+            print(f"[{owner}] 任務 {task['kind']} {task['key']} 回報{'完成' if ok else '失敗'}時 lease 已被收回")
+        return acked
+
+    payload = task['payload']
+    if task['kind'] == SEARCH:
+        region, keyword = payload['region'], payload['keyword']
+        filter_params = {
+            'keyword': keyword,  # 社區名稱
+            'regionid': region,  # 縣市代碼
+        }
+        try:
+            house = next(spider.iter_search(filter_params, {}, max_pages=1), None)
+        except Exception as e:
+            print(f"[{owner}] 搜尋 {keyword} 時發生錯誤: {e}")
+            if still_owned():
+                journal.record_search(region, keyword, error=str(e))
+                finish(False, e)
+            return
+        if not still_owned():
+            return
+        journal.record_search(region, keyword, house)
+        if house is not None:
+            hid = str(house['hid'])
+            if journal.need_detail(hid):
+                queue.put(DETAIL, hid, {'hid': hid})
+        else:
+            print(f"[{owner}] 未找到與 {keyword} 相關的建案")
+        finish(True)
+
+    elif task['kind'] == DETAIL:
+        hid = payload['hid']
+        try:
+            house_detail, main_df = spider.get_newhouse_detail(hid)
+            if 'detail' not in house_detail:
+                raise RuntimeError('請求失敗')
+        except Exception as e:
+            print(f"[{owner}] 獲取 {hid} 詳細資料時發生錯誤: {e}")
+            if still_owned():
+                journal.record_detail(hid, error=str(e))
+                finish(False, e)
+            return
+        if not still_owned():
+            return
+        journal.record_detail(hid, house_detail['detail'])
+        finish(True)
+
+    else:
+        queue.nack(task, owner, f'未知的任務種類: {task["kind"]}', retry_delay=0)
+
+
+def run_worker(queue_path, journal_path, owner=None, kinds=None, proxy=None, request_delay=REQUEST_DELAY,
+               min_delay=None, poll_interval=5.0, exit_when_idle=True, max_tasks=None):
+    """ worker 主迴圈：領取任務 → 執行 → ack / nack，直到佇列清空
+
+    :param queue_path: WorkQueue 的 SQLite 檔案 (速率預算也存在同一個檔案)
+    :param journal_path: 結果寫入的 CrawlJournal SQLite 檔案
+    :param owner: worker 名稱，預設為 主機名稱:pid
+    :param kinds: 只處理這些任務種類，例如 ['detail']
+    :param proxy: 這個 worker 使用的 proxy (不同出口 IP)，例如 'http://10.0.0.2:3128'
+    :param request_delay: 每個 host 起始的請求間隔秒數 (所有 worker 合計)
+    :param min_delay: 回應正常時最短的請求間隔秒數 (所有 worker 合計)，預設為 request_delay
+    :param poll_interval: 暫時沒有任務 (其他任務在退避或被領取中) 時的輪詢秒數
+    :param exit_when_idle: 所有任務結束時離開
+    :param max_tasks: 最多處理幾個任務，None 表示不限
+    :return: 處理的任務數
+    """
+    # 延後 import，避免只需要佇列的行程載入 pandas / bs4
+    import requests
+    from requests.adapters import HTTPAdapter
+    from newhouse591_spider import Newhouse591Spider
+
+    owner = owner or f'{socket.gethostname()}:{os.getpid()}'
+    queue = WorkQueue(queue_path)
+    journal = CrawlJournal(journal_path)
+    throttle = SharedRateLimiter(queue_path, delay=request_delay, min_delay=min_delay)
+    session = requests.Session()
+    session.mount('https://', HTTPAdapter(pool_maxsize=4))
+    if proxy:
+        session.proxies = {'http': proxy, 'https': proxy}
+    spider = Newhouse591Spider(throttle=throttle, session=session)
+
+    done = 0
+    try:
+        while max_tasks is None or done < max_tasks:
+            task = queue.lease(owner, kinds)
+            if task is None:
+                if exit_when_idle and queue.unfinished() == 0:
+                    break
+                time.sleep(poll_interval)
+                continue
+            with _LeaseKeeper(queue, task, owner):
+                _run_task(task, queue, journal, spider, owner)
+            done += 1
+    finally:
+        throttle.close()
+        journal.close()
+        queue.close()
+    print(f"[{owner}] 結束，共處理 {done} 個任務")
+    return done
+
+
+def run_workers(queue_path, journal_path, workers=4, proxies=None, **kwargs):
+    """ 在本機啟動多個 worker 行程並等待結束
+
+    :param workers: worker 行程數
+    :param proxies: 各 worker 輪流使用的 proxy 清單
+    :param kwargs: 其他 run_worker 參數
+    """
+    processes = []
+    for i in range(workers):
+        proxy = proxies[i % len(proxies)] if proxies else None
+        process = multiprocessing.Process(target=run_worker, args=(queue_path, journal_path),
+                                          kwargs=dict(kwargs, proxy=proxy), name=f'worker-{i}')
+        process.start()
+        processes.append(process)
+    for process in processes:
+        process.join()
+    queue = WorkQueue(queue_path)
+    print(f"任務狀態: {queue.counts()}")
+    queue.close()
+
+
+if __name__ == "__main__":
+    # 例：
+    #   python workqueue.py ../data/output_591/work_queue.sqlite ../data/output_591/crawl_journal.sqlite \
+    #       --enqueue ../data/output_591/communities.json --workers 4
+    parser = argparse.ArgumentParser(description='591 爬取工作佇列 worker')
+    parser.add_argument('queue', help='WorkQueue SQLite 檔案')
+    parser.add_argument('journal', help='結果寫入的 CrawlJournal SQLite 檔案')
+    parser.add_argument('--enqueue', help='要加入搜尋任務的社區清單 JSON ([{"縣市": "1", "社區名稱": "..."}])')
+    parser.add_argument('--workers', type=int, default=1, help='本機啟動的 worker 行程數')
+    parser.add_argument('--proxy', action='append', help='worker 使用的 proxy，可指定多次')
+    parser.add_argument('--kind', action='append', choices=[SEARCH, DETAIL], help='只處理這些任務種類')
+    parser.add_argument('--wait', action='store_true', help='佇列清空後繼續等待新任務')
+    args = parser.parse_args()
+
+    if args.enqueue:
+        with open(args.enqueue, encoding='utf-8') as f:
+            queue = WorkQueue(args.queue)
+            enqueue_communities(queue, json.load(f))
+            queue.close()
+    run_workers(args.queue, args.journal, workers=args.workers, proxies=args.proxy,
+                kinds=args.kind, exit_when_idle=not args.wait)
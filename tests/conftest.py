@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+# presale_scraper 內的模組彼此以平坦方式 import (例如 `import http_client`)，測試時同樣加入其目錄
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'presale_scraper')
+sys.path.insert(0, PACKAGE_DIR)
+
+
+@pytest.fixture(autouse=True)
+def offline_http():
+    """ 測試中不使用磁碟快取與全域限速器，結束後恢復預設 """
+    import http_client
+    http_client.set_cache(False)
+    http_client.set_throttle(False)
+    yield
+    http_client.set_cache(None)
+    http_client.set_throttle(None)
+
+
+@pytest.fixture
+def stub_server():
+    """ benchmark.StubServer 的工廠，測試結束時關閉所有 stub """
+    from benchmark import StubServer
+    servers = []
+
+    def start(**kwargs):
+        server = StubServer(**kwargs).__enter__()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.__exit__(None, None, None)
@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from aggregate import PERCENTILES, TransactionIndex, rollup, stat_columns
+from geo import haversine
+
+
+def _transactions(n=400, seed=0):
+    rng = np.random.default_rng(seed)
+    unit_price = rng.uniform(30, 120, n).round(1)
+    unit_price[rng.random(n) < 0.1] = np.nan
+    return pd.DataFrame({
+        '縣市': rng.choice(['臺北市', '新北市'], n),
+        '行政區': rng.choice(['大安區', '信義區', '板橋區'], n),
+        '社區名稱': rng.choice(['甲', '乙', '丙', '丁'], n),
+        '交易年月': rng.choice(['11401', '11402'], n),
+        '建物單價': unit_price,
+        '交易總價': pd.array(rng.integers(800, 5000, n), dtype='Int32'),
+        '解約情形': rng.choice(['', None, '114/02/01 解約'], n, p=[0.5, 0.3, 0.2]),
+        # 約 3 公里見方的範圍，500 公尺內有數筆到數十筆
+        '緯度': 25.03 + rng.uniform(0, 0.03, n),
+        '經度': 121.53 + rng.uniform(0, 0.03, n),
+    })
+
+
+def _projects(n=60, seed=1):
+    rng = np.random.default_rng(seed)
+    lat = 25.03 + rng.uniform(-0.005, 0.035, n)
+    lat[::17] = np.nan  # 沒有坐標的建案
+    return pd.DataFrame({'緯度': lat, '經度': 121.53 + rng.uniform(-0.005, 0.035, n)},
+                        index=pd.RangeIndex(100, 100 + n))
+
+
+def _brute_stats(rows):
+    """ 不經索引，直接由交易列計算 stat_columns 的值 """
+    count = len(rows)
+    prices = rows['建物單價'].dropna().to_numpy()
+    totals = rows['交易總價'].dropna().to_numpy(dtype=float)
+    cancel = int((rows['解約情形'].notna() & (rows['解約情形'].astype(str).str.strip() != '')).sum())
+    quantiles = list(np.quantile(prices, [0.5, *PERCENTILES])) if len(prices) else [np.nan] * 4
+    return [count, *quantiles, np.median(totals) if len(totals) else np.nan, cancel,
+            cancel / count if count else np.nan]
+
+
+def test_rollup_matches_brute_force():
+    df = _transactions()
+    by = ['縣市', '行政區']
+    stats = rollup(df, by)
+    expected = pd.DataFrame([_brute_stats(rows) for _, rows in df.groupby(by)],
+                            index=stats.index, columns=stat_columns())
+    assert list(stats.index) == sorted(df.groupby(by).groups)
+    pd.testing.assert_frame_equal(stats, expected, check_dtype=False)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_score_projects_matches_brute_force(workers):
+    transactions = _transactions()
+    projects = _projects()
+    radius = 500
+    stats, pairs = TransactionIndex(transactions).score_projects(projects, radius, workers=workers, batch_size=16,
+                                                                 with_pairs=True)
+
+    expected_rows, expected_pairs = [], []
+    for index, lat, lon in zip(projects.index, projects['緯度'], projects['經度']):
+        distances = haversine(lat, lon, transactions['緯度'], transactions['經度'])
+        within = np.flatnonzero(distances <= radius)
+        expected_rows.append(_brute_stats(transactions.iloc[within]))
+        expected_pairs.extend((index, transactions.index[i], distances[i]) for i in within)
+    expected = pd.DataFrame(expected_rows, index=projects.index, columns=stat_columns())
+    pd.testing.assert_frame_equal(stats, expected, check_dtype=False)
+    assert stats['筆數'].sum() > len(projects)  # 範圍夠大，確實有查到交易
+
+    got = sorted(zip(pairs['project_index'], pairs['transaction_index'], pairs['distance_m']))
+    assert [pair[:2] for pair in got] == [pair[:2] for pair in sorted(expected_pairs)]
+    np.testing.assert_allclose([pair[2] for pair in got], [pair[2] for pair in sorted(expected_pairs)])
@@ -0,0 +1,151 @@
+import time
+import asyncio
+
+import pytest
+import requests
+
+import http_client
+import newhouse591_spider
+
+
+def _crawl(server, concurrency, request_delay, keywords=8):
+    """ 以 AsyncNewhouse591Spider 搜尋 keywords 個關鍵字 (每個 3 頁) 再取得詳情，回傳 (請求數, 秒數) """
+    async def run():
+        spider = newhouse591_spider.AsyncNewhouse591Spider(max_concurrency=concurrency, request_delay=request_delay)
+        try:
+            results = await spider.search_many([{'keyword': f'K{i}', 'regionid': '1'} for i in range(keywords)],
+                                               want_page=3)
+            details = await spider.get_newhouse_details([houses[0]['hid'] for total_count, houses in results])
+        finally:
+            spider.close()
+        assert all(len(houses) == 60 for total_count, houses in results)
+        assert all('detail' in house_detail for house_detail, main_df in details)
+
+    start = time.perf_counter()
+    asyncio.run(run())
+    return len(server.requests), time.perf_counter() - start
+
+
+def _max_rate(timestamps, window=0.5):
+    """ 任一 window 秒內的最大請求數換算成每秒請求數 """
+    timestamps = sorted(timestamps)
+    most = 0
+    end = 0
+    for start, t in enumerate(timestamps):
+        while end < len(timestamps) and timestamps[end] < t + window:
+            end += 1
+        most = max(most, end - start)
+    return most / window
+
+
+@pytest.fixture
+def spider_urls(monkeypatch, stub_server):
+    server = stub_server(latency=0.05)
+    monkeypatch.setattr(newhouse591_spider, 'SEARCH_URL', f'{server.base_url}/home/housing/list-search')
+    monkeypatch.setattr(newhouse591_spider, 'DETAIL_URL', f'{server.base_url}/v1/housing/detail-info')
+    return server
+
+
+def test_throughput_rises_with_concurrency(spider_urls):
+    server = spider_urls
+    # 限速 40 req/s，遠高於單一連線 (延遲 0.05 秒) 可達到的 20 req/s
+    count_1, seconds_1 = _crawl(server, concurrency=1, request_delay=1 / 40)
+    server.requests.clear()
+    count_8, seconds_8 = _crawl(server, concurrency=8, request_delay=1 / 40)
+    assert count_1 == count_8 == 8 * 3 + 8
+    assert count_8 / seconds_8 > 1.5 * count_1 / seconds_1
+
+
+def test_rate_stays_under_limit(spider_urls):
+    server = spider_urls
+    # 限速 10 req/s 時，同時 16 個請求也不會超過
+    _crawl(server, concurrency=16, request_delay=1 / 10)
+    timestamps = sorted(t for t, path in server.requests)
+    # 所有請求都在同一個 stub host：平均速率不超過限制 (容許 5% 的到達時間誤差)；
+    # 任一秒內容許 token bucket 的 1 個爆量與 1 個到達時間誤差
+    assert (len(timestamps) - 1) / (timestamps[-1] - timestamps[0]) <= 10 * 1.05
+    assert _max_rate(timestamps, window=1.0) <= 10 + 2
+
+
+def test_adapts_to_server_rate_limit(monkeypatch, stub_server):
+    # 伺服器每秒只接受 15 個請求，超過時回應 429 與 Retry-After；爬蟲起始速率 40 req/s
+    server = stub_server(latency=0.01, rate_limit=15, retry_after=0.2)
+    monkeypatch.setattr(newhouse591_spider, 'SEARCH_URL', f'{server.base_url}/home/housing/list-search')
+    monkeypatch.setattr(newhouse591_spider, 'DETAIL_URL', f'{server.base_url}/v1/housing/detail-info')
+    # _crawl 內確認每個關鍵字 3 頁 60 筆與每個詳情都有取得，429 沒有造成資料遺失
+    count, seconds = _crawl(server, concurrency=4, request_delay=1 / 40)
+    accepted = count - server.rejected
+    assert server.rejected > 0
+    assert accepted == 8 * 3 + 8
+    # 退避後仍維持接近伺服器限制的吞吐量
+    assert accepted / seconds > 15 / 3
+
+
+def test_failed_search_page_raises(monkeypatch, spider_urls):
+    # 第 2 頁重試後仍回應 503：search 與 iter_search 都引發例外，不會少了一頁卻當作搜尋完成
+    get = http_client.get
+
+    def failing_get(url, params=None, **kwargs):
+        if url == newhouse591_spider.SEARCH_URL and params.startswith('page=2&'):
+            response = requests.Response()
+            response.status_code = 503
+            response.url = url
+            return response
+        return get(url, params=params, **kwargs)
+
+    monkeypatch.setattr(http_client, 'get', failing_get)
+
+    async def run(collect):
+        spider = newhouse591_spider.AsyncNewhouse591Spider(request_delay=1 / 100)
+        try:
+            return await collect(spider)
+        finally:
+            spider.close()
+
+    async def iterate(spider):
+        return [house async for house in spider.iter_search({'keyword': 'K', 'regionid': '1'})]
+
+    with pytest.raises(requests.HTTPError):
+        asyncio.run(run(lambda spider: spider.search({'keyword': 'K', 'regionid': '1'}, want_page=3)))
+    with pytest.raises(requests.HTTPError):
+        asyncio.run(run(iterate))
+
+
+@pytest.fixture
+def detail_server(monkeypatch, stub_server):
+    """ 啟動 stub 並將建案詳情相關網址指向它，fail 同 StubServer """
+    def start(fail=None):
+        server = stub_server(total_page=4, per_page=20, fail=fail)
+        monkeypatch.setattr(newhouse591_spider, 'DETAIL_URL', f'{server.base_url}/v1/housing/detail-info')
+        monkeypatch.setattr(newhouse591_spider, 'SURROUNDING_URL', f'{server.base_url}/v1/detail/surrounding')
+        monkeypatch.setattr(newhouse591_spider, 'COMMUNITY_PAGE_URL', f'{server.base_url}/{{house_id}}')
+        monkeypatch.setattr(newhouse591_spider, 'PRICE_LIST_URL', f'{server.base_url}/v1/price/list')
+        return server
+    return start
+
+
+def _full_detail(house_id):
+    async def run():
+        spider = newhouse591_spider.AsyncNewhouse591Spider(request_delay=1 / 100)
+        try:
+            return await spider.get_newhouse_full_detail(house_id)
+        finally:
+            spider.close()
+    return asyncio.run(run())
+
+
+def test_full_detail_collects_every_price_page(detail_server):
+    detail_server()
+    house_detail, main_df = _full_detail(42)
+    assert house_detail['detail']['hid'] == 42
+    assert house_detail['surrounding'] == {'hid': 42}
+    # 4 頁、每頁 20 筆，依頁碼順序
+    assert [item['id'] for item in house_detail['price']] == [f'1042-{page}-{i}' for page in range(1, 5)
+                                                              for i in range(20)]
+    assert len(main_df) == 1
+
+
+def test_full_detail_raises_on_failed_price_page(detail_server):
+    detail_server(fail=lambda path, query: 404 if path.endswith('/price/list') and query['page'] == '3' else None)
+    with pytest.raises(requests.HTTPError):
+        _full_detail(42)
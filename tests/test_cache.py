@@ -0,0 +1,130 @@
+import os
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import http_client
+from cache import ResponseCache, cache_key
+
+
+def _response(body, **headers):
+    response = requests.Response()
+    response.status_code = 200
+    response._content = body
+    response.headers.update(headers)
+    return response
+
+
+def test_cache_key_ignores_query_order():
+    # 同步爬蟲以網址字串、async 爬蟲以 params dict 送出同一個 detail-info 請求
+    url = 'https://bff.591.com.tw/v1/housing/detail-info'
+    assert cache_key(f'{url}?id=123&is_auth=0') == cache_key(url, {'is_auth': 0, 'id': 123})
+    assert cache_key(url, 'page=2&keyword=大安') == cache_key(f'{url}?keyword=大安', {'page': 2})
+    assert cache_key(url, {'id': 1}) != cache_key(url, {'id': 2})
+
+
+def test_entry_expires_after_ttl(tmp_path):
+    cache = ResponseCache(str(tmp_path), default_ttl=0.2, ttls={'long': 3600})
+    cache.store('https://example.com/short', None, _response(b'short'))
+    cache.store('https://example.com/long', None, _response(b'long'))
+    assert cache.lookup('https://example.com/short')['fresh']
+    time.sleep(0.3)
+    entry = cache.lookup('https://example.com/short')
+    # 過期後仍保留內容與 header，供條件式請求使用
+    assert entry is not None and not entry['fresh'] and entry['body'] == b'short'
+    assert cache.lookup('https://example.com/long')['fresh']
+
+
+def test_evicts_least_recently_used(tmp_path):
+    # 隨機內容無法壓縮，每筆約 1000 bytes，最多容納 2 筆
+    cache = ResponseCache(str(tmp_path), max_bytes=2500)
+    for name in ('a', 'b'):
+        cache.store(f'https://example.com/{name}', None, _response(os.urandom(1000)))
+        time.sleep(0.01)
+    cache.lookup('https://example.com/a')  # a 變成最近使用
+    time.sleep(0.01)
+    cache.store('https://example.com/c', None, _response(os.urandom(1000)))
+    assert cache.lookup('https://example.com/b') is None
+    assert cache.lookup('https://example.com/a') is not None
+    assert cache.lookup('https://example.com/c') is not None
+    assert not os.path.exists(cache._path(cache_key('https://example.com/b')))
+
+
+@pytest.fixture
+def etag_server():
+    """ 回應帶 ETag 的本機 server，If-None-Match 相同時回應 304 """
+    state = {'etag': '"v1"', 'body': b'{"version": 1}', 'requests': []}
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            state['requests'].append(self.headers.get('If-None-Match'))
+            if self.headers.get('If-None-Match') == state['etag']:
+                self.send_response(304)
+                self.send_header('ETag', state['etag'])
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('ETag', state['etag'])
+            self.send_header('Content-Length', str(len(state['body'])))
+            self.end_headers()
+            self.wfile.write(state['body'])
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    state['url'] = f'http://127.0.0.1:{server.server_port}/data'
+    yield state
+    server.shutdown()
+    server.server_close()
+
+
+def test_revalidates_with_etag(tmp_path, etag_server):
+    cache = ResponseCache(str(tmp_path), default_ttl=0.2)
+    http_client.set_cache(cache)
+    url = etag_server['url']
+
+    assert http_client.get(url).json() == {'version': 1}
+    assert http_client.get(url).from_cache  # 未過期：不連網
+    assert etag_server['requests'] == [None]
+
+    # 過期後送出 If-None-Match，伺服器回應 304 即沿用快取內容並延長期限
+    time.sleep(0.3)
+    response = http_client.get(url)
+    assert response.from_cache and response.json() == {'version': 1}
+    assert etag_server['requests'] == [None, '"v1"']
+    assert cache.lookup(url)['fresh']
+
+    # 內容變更時伺服器回應 200，新內容存入快取
+    etag_server['etag'], etag_server['body'] = '"v2"', b'{"version": 2}'
+    time.sleep(0.3)
+    response = http_client.get(url)
+    assert not getattr(response, 'from_cache', False) and response.json() == {'version': 2}
+    assert http_client.get(url).json() == {'version': 2}
+    assert etag_server['requests'] == [None, '"v1"', '"v1"']
+
+
+def test_sync_and_async_spiders_share_detail_cache(tmp_path, monkeypatch, stub_server):
+    import asyncio
+    import newhouse591_spider
+    from ratelimit import AdaptiveRateLimiter
+    server = stub_server()
+    monkeypatch.setattr(newhouse591_spider, 'DETAIL_URL', f'{server.base_url}/v1/housing/detail-info')
+    http_client.set_cache(ResponseCache(str(tmp_path)))
+
+    sync_detail, _ = newhouse591_spider.Newhouse591Spider(AdaptiveRateLimiter(rate=1000)).get_newhouse_detail(42)
+
+    async def run():
+        spider = newhouse591_spider.AsyncNewhouse591Spider(request_delay=1 / 100)
+        try:
+            return await spider.get_newhouse_detail(42)
+        finally:
+            spider.close()
+    async_detail, _ = asyncio.run(run())
+    assert async_detail == sync_detail and sync_detail['detail']['hid'] == 42
+    assert len(server.requests) == 1
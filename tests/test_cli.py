@@ -0,0 +1,97 @@
+import os
+import json
+
+import pytest
+
+import cli
+from benchmark import CITIES, build_fixtures, fixture_urls
+
+SIZE = 200
+
+
+@pytest.fixture
+def pipeline(monkeypatch, tmp_path, stub_server):
+    """ 以 stub 上的 fixture 取代 config 中的快照網址，回傳 (options, {kind: {縣市: 網址}}) """
+    fixture_dir = str(tmp_path / 'fixtures')
+    build_fixtures([SIZE], fixture_dir)
+    server = stub_server(fixture_dir=fixture_dir)
+    urls = {'urls': fixture_urls(server.base_url, 'presale', SIZE),
+            'plvrurls': fixture_urls(server.base_url, 'plvr', SIZE)}
+    monkeypatch.setattr(cli, 'resolve_snapshot', lambda kind, name=None: (f'{kind}_1140101', '1140101', urls[kind]))
+    options = {
+        'pipeline_dir': str(tmp_path / 'pipeline'),
+        'presale_snapshot': 'urls_1140101',
+        'plvr_snapshot': 'plvrurls_1140101',
+        'workers': 4,
+        'stream': False,
+        'enrich_limit': 0,
+        'request_delay': 0,
+    }
+    return options, urls
+
+
+def test_pipeline_runs_and_reuses_outputs(pipeline, capsys):
+    options, _ = pipeline
+    assert cli.run_pipeline(['merge'], options) == []
+    store = cli.StageStore(options['pipeline_dir'])
+    merged = store.load('merge')
+    assert len(merged) == store.manifest('merge')['rows'] > 0
+    # 讀回的欄位與 dtype 同寫入時
+    assert {str(column): str(dtype) for column, dtype in merged.dtypes.items()} == store.manifest('merge')['dtypes']
+    assert set(merged['縣市'].astype(str)) <= set(CITIES)
+
+    capsys.readouterr()
+    assert cli.run_pipeline(['merge'], options) == []
+    assert capsys.readouterr().out.count('沿用上次輸出') == len(cli.upstream(['merge']))
+
+
+def test_fetch_fails_when_a_city_fails(pipeline):
+    options, urls = pipeline
+    city = CITIES[3]
+    urls['plvrurls'][city] = urls['plvrurls'][city].replace(f'/{SIZE}/', '/missing/')
+    failed = cli.run_pipeline(['transform_plvr'], options)
+    assert failed == ['fetch_plvr']
+    # 缺少部分縣市的輸出不存成快取
+    assert not os.path.exists(os.path.join(options['pipeline_dir'], 'fetch_plvr.json'))
+    assert cli.StageStore(options['pipeline_dir']).manifest('transform_plvr') is None
+
+
+def test_missing_upstream_raises_clear_error(tmp_path):
+    store = cli.StageStore(str(tmp_path))
+    with pytest.raises(cli.StageNotReady, match='fetch_plvr'):
+        store.fingerprint(cli.STAGES['transform_plvr'], {})
+    with pytest.raises(cli.StageNotReady, match='cli.py run merge'):
+        store.load('merge', 'enrich')
+
+
+def test_empty_output_round_trips(tmp_path):
+    import pandas as pd
+    store = cli.StageStore(str(tmp_path))
+    store.save('enrich', pd.DataFrame({'社區名稱': pd.Series(dtype=object), '戶數': pd.Series(dtype='Int64')}),
+               'fingerprint', 0.0)
+    with open(tmp_path / 'enrich.json', encoding='utf-8') as f:
+        assert json.load(f)['rows'] == 0
+    df = store.load('enrich')
+    assert df.empty and list(df.columns) == ['社區名稱', '戶數'] and str(df['戶數'].dtype) == 'Int64'
+
+
+def test_fingerprint_tracks_config_and_stream(monkeypatch, tmp_path):
+    import shutil
+    import pandas as pd
+    source_dir = tmp_path / 'src'
+    source_dir.mkdir()
+    for source in {source for stage in cli.STAGES.values() for source in stage.sources}:
+        shutil.copy(os.path.join(cli.BASE_DIR, source), source_dir / source)
+    monkeypatch.setattr(cli, 'BASE_DIR', str(source_dir))
+    store = cli.StageStore(str(tmp_path / 'pipeline'))
+    store.save('fetch_plvr', pd.DataFrame({'縣市': ['臺北市']}), 'fingerprint', 0.0)
+    options = {'plvr_snapshot': 'plvrurls_1140101', 'stream': False}
+
+    fetch = store.fingerprint(cli.STAGES['fetch_plvr'], options)
+    assert store.fingerprint(cli.STAGES['fetch_plvr'], dict(options, stream=True)) != fetch
+
+    # 只改了 config 的欄位對照，下游的 transform 也要重跑
+    transform = store.fingerprint(cli.STAGES['transform_plvr'], options)
+    with open(source_dir / 'config.py', 'a', encoding='utf-8') as f:
+        f.write("\nplvr_column_names = {}\n")
+    assert store.fingerprint(cli.STAGES['transform_plvr'], options) != transform
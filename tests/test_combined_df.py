@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+import http_client
+from utils import CityFetchError, combined_df
+
+
+@pytest.fixture
+def city_urls(tmp_path, stub_server):
+    """ 臺北市 3 筆、新北市 0 筆、桃園市不存在 (404) """
+    path = tmp_path / 'presale' / 'test'
+    path.mkdir(parents=True)
+    (path / '臺北市.json').write_text(json.dumps([{'a': i} for i in range(3)]), encoding='utf-8')
+    (path / '新北市.json').write_text('[]', encoding='utf-8')
+    server = stub_server(fixture_dir=str(tmp_path))
+    return {city: f'{server.base_url}/saledata/presale/test/{city}.json' for city in ('臺北市', '新北市', '桃園市')}
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_failed_city_is_skipped_by_default(city_urls, stream):
+    df = combined_df(city_urls, '1140101', stream=stream)
+    assert df['city_name'].tolist() == ['臺北市'] * 3
+    assert df['a'].tolist() == [0, 1, 2]
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_strict_raises_only_for_failed_requests(city_urls, stream):
+    with pytest.raises(CityFetchError) as error:
+        combined_df(city_urls, '1140101', stream=stream, strict=True)
+    # 沒有資料的新北市不算失敗
+    assert list(error.value.failed) == ['桃園市']
+    assert len(error.value.partial) == 3
+
+    del city_urls['桃園市']
+    assert len(combined_df(city_urls, '1140101', stream=stream, strict=True)) == 3
+
+
+def test_session_pool_grows_to_largest_request(monkeypatch):
+    monkeypatch.setattr(http_client, '_session', None)
+    monkeypatch.setattr(http_client, '_session_pool_maxsize', 0)
+    session = http_client.get_session(pool_maxsize=4)
+    assert http_client.get_session(pool_maxsize=16) is session
+    assert session.get_adapter('https://example.com')._pool_maxsize == 16
+    # 較小的要求不會縮小連線池
+    http_client.get_session(pool_maxsize=2)
+    assert session.get_adapter('https://example.com')._pool_maxsize == 16
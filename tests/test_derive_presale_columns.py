@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils import (derive_presale_columns, parse_admin_region, parse_sale_period, find_first_sale_time,
+                   sales_start_time)
+
+DERIVED_COLUMNS = ["行政區", "自售期間", "代銷期間", "自售起始時間", "代銷起始時間", "銷售起始時間"]
+
+# (坐落街道, 銷售期間)
+CASES = [
+    ("中正區重慶南路一段122號", "自售: 1120101~1121231;代銷: 1120315~"),      # 兩者皆有，取較小者
+    ("東區勝利路10號", "代銷: 1130102~1131231"),                             # 只有代銷
+    ("板橋區文化路一段1號", "自售: 1110505~"),                               # 只有自售
+    ("竹北市光明六路100號", "自售: 1130601~;代銷: 1120201~"),                # 代銷較早
+    ("大安區信義路四段1號", "備查中"),                                       # 皆無日期，含「備查」
+    ("西屯區文心路1號", ""),                                                 # 空字串
+    ("北屯區崇德路1號", np.nan),                                             # 缺值
+    ("前鎮區", "自售:  ;代銷: 無"),                                          # 有標籤但沒有 7 位數字
+    ("區", "自售: 11201~"),                                                  # 地址過短、日期不足 7 位
+    ("", "代銷: 1120101~;自售: 1110101~"),                                   # 空地址、順序相反
+    (np.nan, "備查完成;代銷: 1140101~"),                                     # 地址缺值
+]
+
+
+def _presale_frame(cases):
+    streets, periods = zip(*cases)
+    return pd.DataFrame({
+        "坐落街道": pd.Series(streets, dtype=object),
+        "銷售期間": pd.Series(periods, dtype=object),
+        "備查完成日期": [f"11{i:05d}" for i in range(len(cases))],
+        "建照核發日": [f"10{i:05d}" for i in range(len(cases))],
+    })
+
+
+def _reference(df):
+    """ presale_main 原本的逐列做法 (parse_sale_period 不接受缺值，缺值視為兩者皆無) """
+    proc_df = df.copy()
+    proc_df["行政區"] = proc_df["坐落街道"].apply(parse_admin_region)
+    periods = proc_df["銷售期間"].apply(lambda s: parse_sale_period(s) if isinstance(s, str) else (None, None))
+    proc_df["自售期間"], proc_df["代銷期間"] = zip(*periods)
+    proc_df["自售起始時間"] = proc_df["自售期間"].apply(find_first_sale_time)
+    proc_df["代銷起始時間"] = proc_df["代銷期間"].apply(find_first_sale_time)
+    proc_df["銷售起始時間"] = proc_df.apply(sales_start_time, axis=1)
+    return proc_df
+
+
+def _assert_same(actual, expected):
+    assert list(actual.columns) == list(expected.columns)
+    for column in DERIVED_COLUMNS:
+        # 值、缺值的表示方式與 dtype 皆需相同
+        pd.testing.assert_series_equal(actual[column], expected[column], check_exact=True)
+
+
+def test_matches_row_wise_functions():
+    df = _presale_frame(CASES)
+    _assert_same(derive_presale_columns(df), _reference(df))
+
+
+@pytest.mark.parametrize("case", CASES)
+def test_single_row(case):
+    df = _presale_frame([case])
+    _assert_same(derive_presale_columns(df), _reference(df))
+
+
+def test_empty_frame():
+    df = _presale_frame(CASES).iloc[:0]
+    result = derive_presale_columns(df)
+    assert len(result) == 0
+    assert set(DERIVED_COLUMNS) <= set(result.columns)
+
+
+def test_does_not_modify_input():
+    df = _presale_frame(CASES)
+    before = df.copy()
+    derive_presale_columns(df)
+    pd.testing.assert_frame_equal(df, before)
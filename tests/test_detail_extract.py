@@ -0,0 +1,47 @@
+import json
+import os
+
+import pandas as pd
+
+import detail_extract
+from detail_extract import DEFAULT_SCHEMA, MAIN_COLUMNS, MAIN_SCHEMA, DetailColumnBuilder
+
+
+def _sample():
+    with open(os.path.join(os.path.dirname(detail_extract.__file__), '_newhouse591_detail.json'), encoding='utf-8') as f:
+        return json.load(f)['data']
+
+
+def test_duplicate_title_keeps_first():
+    data = _sample()
+    data['building_design'] = [
+        {'title': '營造公司', 'content': '甲營造'},
+        {'title': '投資建設', 'content': '第一建設'},
+        {'title': '投資建設', 'content': '第二建設'},
+        'not a dict',
+    ]
+    record = DEFAULT_SCHEMA.record(data)
+    assert record['起造人'] == '第一建設'
+    assert record['營造公司'] == '甲營造'
+    assert record['建築設計'] is None
+
+
+def test_missing_sections_use_defaults():
+    data = {'hid': 1, 'region': '臺北市', 'building_design': None, 'label': []}
+    record = DEFAULT_SCHEMA.record(data)
+    assert record['起造人'] == ''
+    assert record['行政區'] == record['建案名稱'] == record['建照執照'] == '未知'
+    assert record['緯度'] is None and record['捷運系統'] is None and record['特色'] is None
+
+
+def test_builder_matches_single_row_frames():
+    data = _sample()
+    builder = DetailColumnBuilder(MAIN_SCHEMA)
+    builder.append(data, 搜尋關鍵字='A')
+    builder.append({'region': '新北市'})
+    df = builder.to_frame()
+    assert list(df.columns) == MAIN_COLUMNS + ['搜尋關鍵字']
+    assert df.loc[0, '搜尋關鍵字'] == 'A' and pd.isna(df.loc[1, '搜尋關鍵字'])
+    expected = pd.DataFrame([MAIN_SCHEMA.record(data)], columns=MAIN_COLUMNS)
+    pd.testing.assert_frame_equal(df.loc[[0], MAIN_COLUMNS], expected)
+    assert df.loc[1, '起造人'] == '' and df.loc[1, '縣市'] == '新北市'
@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+from utils import fetch_data, fetch_data_stream, iter_json_array
+
+ITEMS = [123, 456, 7.5, -1e3, True, None, '臺北市', {'a': [1, 2], 'b': '大安區'}, [3, 4]]
+
+
+def _split(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def test_number_split_at_chunk_boundary():
+    assert list(iter_json_array([b'[123, 45', b'6, 7]'])) == [123, 456, 7]
+    assert list(iter_json_array([b'[12', b'3]'])) == [123]
+    assert list(iter_json_array([b'[7.', b'5, -1', b'e3]'])) == [7.5, -1e3]
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 5, 8, 1000])
+def test_any_chunk_size(size):
+    # 中文字的 utf-8 位元組也可能被切斷
+    data = json.dumps(ITEMS, ensure_ascii=False).encode('utf-8')
+    assert list(iter_json_array(_split(data, size))) == ITEMS
+
+
+def test_incomplete_array_raises():
+    with pytest.raises(ValueError):
+        list(iter_json_array([b'[1, 2']))
+
+
+def test_stream_columns_match_fetch_data(tmp_path, stub_server):
+    # 第 3 個欄位 e 在資料中完全沒有，兩種方式都不應建立全為空值的欄位
+    rows = [{'a': i, 'b': f'社區{i}', 'x': 'extra'} for i in range(7)]
+    rows[3].pop('b')
+    path = tmp_path / 'plvr' / 'test'
+    path.mkdir(parents=True)
+    (path / '臺北市.json').write_text(json.dumps(rows, ensure_ascii=False), encoding='utf-8')
+    server = stub_server(fixture_dir=str(tmp_path))
+    url = f'{server.base_url}/saledata/plvr/test/臺北市.json'
+    columns = ['b', 'e', 'a']
+
+    df = fetch_data(url)
+    df = df[[column for column in columns if column in df.columns]]
+    streamed = fetch_data_stream(url, columns=columns, batch_size=3)
+    assert list(streamed.columns) == list(df.columns) == ['b', 'a']
+    assert streamed.equals(df)
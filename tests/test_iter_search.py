@@ -0,0 +1,54 @@
+import time
+
+import pytest
+
+import newhouse591_spider
+from newhouse591_spider import SeenHids
+from ratelimit import AdaptiveRateLimiter
+
+
+def _seed(keyword):
+    """ stub 的 list-search 以關鍵字字元碼總和 * 1000 為 hid 起點 """
+    return sum(map(ord, keyword)) * 1000
+
+
+@pytest.fixture
+def spider(monkeypatch, stub_server):
+    server = stub_server(latency=0.05, total_page=10, per_page=20)
+    monkeypatch.setattr(newhouse591_spider, 'SEARCH_URL', f'{server.base_url}/home/housing/list-search')
+    spider = newhouse591_spider.Newhouse591Spider(AdaptiveRateLimiter(rate=1000, max_rate=1000))
+    return spider, server
+
+
+def test_seen_hids():
+    seen = SeenHids([5, '7'])
+    assert not seen.add('5') and not seen.add(7)
+    assert seen.add(1 << 30) and not seen.add(str(1 << 30))  # 超過 bitmap 上限的 hid
+    assert seen.add('abc') and not seen.add('abc')
+    assert 5 in seen and '7' in seen and 6 not in seen and 'abd' not in seen
+    assert len(seen) == 4
+
+
+def test_sweep_drops_duplicate_hids_across_queries(spider):
+    spider, server = spider
+    # AB 與 BA 的 hid 完全相同，AC 不同
+    assert _seed('AB') == _seed('BA') != _seed('AC')
+    houses = list(spider.iter_sweep([{'keyword': keyword} for keyword in ('AB', 'BA', 'AC')], max_pages=2))
+    hids = [house['hid'] for house in houses]
+    assert len(hids) == len(set(hids)) == 2 * 40
+    assert {house['build_name'] for house in houses} == {'AB', 'AC'}
+
+
+def test_stop_ends_paging_early(spider):
+    spider, server = spider
+    target = _seed('K') + 45  # 第 3 頁的第 6 筆
+    houses = list(spider.iter_search({'keyword': 'K'}, stop=lambda house: house['hid'] == target, workers=2))
+    returned = time.monotonic()
+    assert houses[-1]['hid'] == target and len(houses) == 46
+    # 讀到第 3 頁時最多再送出 workers 頁，10 頁中其餘的頁面沒有送出
+    count = len(server.requests)
+    assert count <= 3 + 2
+    # 返回時進行中的請求都已結束 (每個請求延遲 0.05 秒)，之後不會再有請求
+    assert returned >= max(t for t, path in server.requests) + 0.05
+    time.sleep(0.2)
+    assert len(server.requests) == count
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+
+from matcher import ProjectMatcher
+
+PROJECTS = pd.DataFrame({
+    '縣市': ['臺北市', '臺北市', '新北市'],
+    '行政區': ['大安區', '信義區', '板橋區'],
+    '社區名稱': ['璞園信義', '遠雄之星', '板橋新境'],
+    '緯度': [25.0330, 25.0400, 25.0330],
+    '經度': [121.5650, 121.5700, 121.5652],
+    '戶數': np.array([120, 300, 88], dtype=np.int64),
+    '編號': ['P1', 'P2', 'P3'],
+})
+
+
+def _plvr(rows):
+    return pd.DataFrame(rows, columns=['縣市', '行政區', '社區名稱', '緯度', '經度'])
+
+
+def test_exact_and_fuzzy():
+    matcher = ProjectMatcher(PROJECTS)
+    assert matcher.match_one('台北市', '大安區', '璞園 信義')[:2] == (0, 'exact')
+    assert matcher.match_one('臺北市', '信義區', '遠雄之星二期')[:2] == (1, 'fuzzy')
+
+
+def test_nearest_applies_min_score():
+    matcher = ProjectMatcher(PROJECTS)
+    # 幾乎同一位置、名稱不像：分數約 0.5
+    index, method, score, distance = matcher.match_one('臺北市', '大安區', '無名社區', 25.0330, 121.5650)
+    assert (index, method) == (0, 'nearest')
+    assert score >= 0.5
+    # 半徑邊緣且名稱不像：分數過低，不比對
+    assert matcher.match_one('臺北市', '大安區', '無名社區', 25.0355, 121.5650)[0] == -1
+    assert matcher.match_one('臺北市', '大安區', '無名社區', 25.0330, 121.5650, nearest_min_score=0.9)[0] == -1
+
+
+def test_nearest_only_searches_same_city():
+    matcher = ProjectMatcher(PROJECTS)
+    # 新北市的建案 P3 距離更近 (約 20 公尺)，但只能比對到臺北市的 P1
+    index, method, score, distance = matcher.match_one('臺北市', '大安區', '無名社區', 25.0330, 121.5652,
+                                                       nearest_min_score=0.3)
+    assert (index, method) == (0, 'nearest')
+    assert 15 < distance < 25
+    # 沒有任何建案的縣市
+    assert matcher.match_one('高雄市', '前鎮區', '無名社區', 25.0330, 121.5652)[0] == -1
+
+
+def test_merge_keeps_integer_columns():
+    merged = ProjectMatcher(PROJECTS).merge(
+        _plvr([('臺北市', '大安區', '璞園信義', np.nan, np.nan), ('高雄市', '前鎮區', '不存在', np.nan, np.nan)]),
+        ['戶數', '編號'])
+    assert str(merged['戶數'].dtype) == 'Int64'
+    assert merged['戶數'].iloc[0] == 120
+    assert merged['戶數'].isna().iloc[1]
+    assert merged['編號'].iloc[0] == 'P1'
+    assert pd.isna(merged['編號'].iloc[1])
+
+
+def test_merge_with_no_projects():
+    merged = ProjectMatcher(PROJECTS.iloc[:0]).merge(
+        _plvr([('臺北市', '大安區', '璞園信義', 25.0330, 121.5650)]), ['戶數', '編號'])
+    assert len(merged) == 1
+    assert merged['match_index'].iloc[0] == -1
+    assert merged[['戶數', '編號']].isna().all(axis=None)
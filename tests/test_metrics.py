@@ -0,0 +1,65 @@
+import pytest
+
+import http_client
+import metrics
+from cache import ResponseCache
+from metrics import Metrics
+
+
+def _samples(text):
+    """ Prometheus text 中的 {metric{labels}: value} (略過 # TYPE 行) """
+    return {line.rsplit(' ', 1)[0]: float(line.rsplit(' ', 1)[1])
+            for line in text.splitlines() if line and not line.startswith('#')}
+
+
+def test_prometheus_text():
+    m = Metrics()
+    m.record_request('https://bff.591.com.tw/v1/housing/detail-info?id=1', 200, 0.07, nbytes=1000, wait=0.5)
+    m.record_request('https://bff.591.com.tw/v1/housing/detail-info?id=2', 200, 0.3, nbytes=500)
+    m.record_request('https://bff.591.com.tw/v1/housing/detail-info?id=3', 429, 0.02)
+    m.inc('cache_total', endpoint='example.com/a', result='hit')
+    m.set('queue_depth', 3, queue='detail')
+    text = m.to_prometheus()
+    samples = _samples(text)
+
+    detail = 'endpoint="bff.591.com.tw/v1/housing/detail-info"'
+    assert '# TYPE presale_scraper_http_requests_total counter' in text
+    assert '# TYPE presale_scraper_queue_depth gauge' in text
+    assert '# TYPE presale_scraper_http_request_duration_seconds histogram' in text
+    assert samples[f'presale_scraper_http_requests_total{{{detail},status="200"}}'] == 2
+    assert samples[f'presale_scraper_http_requests_total{{{detail},status="429"}}'] == 1
+    assert samples[f'presale_scraper_http_response_bytes_total{{{detail}}}'] == 1500
+    assert samples[f'presale_scraper_throttle_wait_seconds_total{{{detail}}}'] == 0.5
+    assert samples['presale_scraper_queue_depth{queue="detail"}'] == 3
+    # 累積 bucket：0.02 ≤ 0.05，0.07 ≤ 0.1，0.3 ≤ 0.5
+    assert samples[f'presale_scraper_http_request_duration_seconds_bucket{{{detail},le="0.05"}}'] == 1
+    assert samples[f'presale_scraper_http_request_duration_seconds_bucket{{{detail},le="0.1"}}'] == 2
+    assert samples[f'presale_scraper_http_request_duration_seconds_bucket{{{detail},le="0.25"}}'] == 2
+    assert samples[f'presale_scraper_http_request_duration_seconds_bucket{{{detail},le="+Inf"}}'] == 3
+    assert samples[f'presale_scraper_http_request_duration_seconds_count{{{detail}}}'] == 3
+    assert samples[f'presale_scraper_http_request_duration_seconds_sum{{{detail}}}'] == pytest.approx(0.39)
+
+
+def test_label_values_are_escaped():
+    m = Metrics()
+    m.inc('errors_total', reason='say "hi"\\')
+    assert 'presale_scraper_errors_total{reason="say \\"hi\\"\\\\"} 1' in m.to_prometheus()
+
+
+def test_requests_and_cache_hits_through_http_client(tmp_path, stub_server):
+    server = stub_server()
+    http_client.set_cache(ResponseCache(str(tmp_path)))
+    metrics.reset()
+    try:
+        for house_id in (1, 2, 1):
+            http_client.get(f'{server.base_url}/v1/housing/detail-info', params={'id': house_id})
+        samples = _samples(metrics.METRICS.to_prometheus())
+    finally:
+        metrics.reset()
+
+    endpoint = f'endpoint="127.0.0.1:{server.base_url.rsplit(":", 1)[1]}/v1/housing/detail-info"'
+    assert samples[f'presale_scraper_http_requests_total{{{endpoint},status="200"}}'] == 2
+    assert samples[f'presale_scraper_cache_total{{{endpoint},result="miss"}}'] == 2
+    assert samples[f'presale_scraper_cache_total{{{endpoint},result="hit"}}'] == 1
+    assert samples[f'presale_scraper_http_request_duration_seconds_count{{{endpoint}}}'] == 2
+    assert len(server.requests) == 2
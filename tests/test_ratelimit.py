@@ -0,0 +1,43 @@
+import threading
+
+from ratelimit import AdaptiveRateLimiter, TokenBucket
+
+URL = 'https://bff.591.com.tw/v1/housing/detail-info'
+
+
+def test_speedup_never_exceeds_configured_rate():
+    limiter = AdaptiveRateLimiter(rate=0.2)
+    for _ in range(50):
+        limiter.on_success(URL, 0.1)
+    assert limiter.current_rate(URL) == 0.2
+
+
+def test_recovers_to_configured_rate_after_failure():
+    limiter = AdaptiveRateLimiter(rate=0.2, backoff_base=0.0)
+    limiter.on_failure(URL, retry_after=0)
+    assert limiter.current_rate(URL) < 0.2
+    for _ in range(50):
+        limiter.on_success(URL, 0.1)
+    assert limiter.current_rate(URL) == 0.2
+
+
+def test_explicit_max_rate_and_host_rates():
+    limiter = AdaptiveRateLimiter(rate=0.2, max_rate=1.0, host_rates={'newhouse.591.com.tw': (0.1, 1)})
+    for _ in range(50):
+        limiter.on_success(URL, 0.1)
+    assert limiter.current_rate(URL) == 1.0
+    capped = AdaptiveRateLimiter(rate=0.2, host_rates={'newhouse.591.com.tw': (0.1, 1)})
+    for _ in range(50):
+        capped.on_success('https://newhouse.591.com.tw/home/housing/list-search', 0.1)
+    assert capped.current_rate('https://newhouse.591.com.tw/home/housing/list-search') == 0.1
+
+
+def test_concurrent_scale_rate_is_atomic():
+    bucket = TokenBucket(rate=1.0)
+    threads = [threading.Thread(target=lambda: [bucket.scale_rate(1.001) for _ in range(500)]) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # 每次乘法都以最新的速率計算，不會因為讀寫交錯而遺失更新
+    assert abs(bucket.rate - 1.001 ** 4000) < 1e-6 * bucket.rate
@@ -0,0 +1,44 @@
+import threading
+
+import pytest
+
+import newhouse591_spider
+from ratelimit import AdaptiveRateLimiter
+
+
+@pytest.fixture
+def spiders(monkeypatch, stub_server):
+    server = stub_server()
+    monkeypatch.setattr(newhouse591_spider, 'SEARCH_URL', f'{server.base_url}/home/housing/list-search')
+    monkeypatch.setattr(newhouse591_spider, 'DETAIL_URL', f'{server.base_url}/v1/housing/detail-info')
+    throttle = AdaptiveRateLimiter(rate=1000, max_rate=1000)
+    return {'search_spider': newhouse591_spider.Newhouse591Spider(throttle),
+            'detail_spider': newhouse591_spider.Newhouse591Spider(throttle)}
+
+
+def _search_threads():
+    return [thread for thread in threading.enumerate() if 'search_stage' in thread.name]
+
+
+def test_resolve_communities_dedupes_keywords(spiders):
+    records = [{'縣市': '1', '社區名稱': name} for name in ['K1', 'K2', ' K1 ', 'K3']]
+    rows = list(newhouse591_spider.resolve_communities(records, **spiders))
+    assert [row['搜尋關鍵字'] for row in rows] == ['K1', 'K2', 'K3']
+    assert not _search_threads()
+
+
+def test_close_stops_search_thread(spiders):
+    # queue 只能放 1 筆，呼叫端停止後搜尋執行緒仍有大量社區要放入
+    records = [{'縣市': '1', '社區名稱': f'K{i}'} for i in range(50)]
+    rows = newhouse591_spider.resolve_communities(records, queue_size=1, **spiders)
+    next(rows)
+    rows.close()
+    assert not _search_threads()
+
+
+def test_consumer_exception_stops_search_thread(spiders):
+    records = [{'縣市': '1', '社區名稱': f'K{i}'} for i in range(50)]
+    with pytest.raises(RuntimeError):
+        for row in newhouse591_spider.resolve_communities(records, queue_size=1, **spiders):
+            raise RuntimeError('stop')
+    assert not _search_threads()
@@ -0,0 +1,59 @@
+import pandas as pd
+import pytest
+
+from snapshot import ingest, reconstruct
+
+
+def _frame(rows):
+    return pd.DataFrame(rows, columns=['編號', '縣市', '建案名稱'])
+
+
+FULL = _frame([
+    ('A1', '臺北市', '甲'),
+    ('A2', '臺北市', '乙'),
+    ('B1', '新北市', '丙'),
+])
+
+
+def test_partial_pull_only_deletes_within_its_cities(tmp_path):
+    ingest(FULL, 'presale_delta', snapshot='20250101', key_cols=['編號'], base_dir=tmp_path)
+    # 只抓臺北市，A2 消失：新北市不受影響
+    changes = ingest(_frame([('A1', '臺北市', '甲')]), 'presale_delta', snapshot='20250102',
+                     key_cols=['編號'], base_dir=tmp_path)
+    assert len(changes['delete']) == 1
+    assert set(changes['delete']['縣市']) == {'臺北市'}
+    assert sorted(reconstruct('presale_delta', base_dir=tmp_path)['編號']) == ['A1', 'B1']
+
+
+def test_explicit_cities_delete_missing_rows(tmp_path):
+    ingest(FULL, 'presale_delta', snapshot='20250101', key_cols=['編號'], base_dir=tmp_path)
+    changes = ingest(_frame([('A1', '臺北市', '甲'), ('B1', '新北市', '丙')]), 'presale_delta',
+                     snapshot='20250102', key_cols=['編號'], cities=['臺北市', '新北市'], base_dir=tmp_path)
+    assert len(changes['delete']) == 1
+    assert sorted(reconstruct('presale_delta', base_dir=tmp_path)['編號']) == ['A1', 'B1']
+
+
+def test_refuses_city_without_rows(tmp_path):
+    ingest(FULL, 'presale_delta', snapshot='20250101', key_cols=['編號'], base_dir=tmp_path)
+    with pytest.raises(ValueError, match='新北市'):
+        ingest(_frame([('A1', '臺北市', '甲'), ('A2', '臺北市', '乙')]), 'presale_delta', snapshot='20250102',
+               key_cols=['編號'], cities=['臺北市', '新北市'], base_dir=tmp_path)
+    # 沒有寫入任何差異
+    assert sorted(reconstruct('presale_delta', base_dir=tmp_path)['編號']) == ['A1', 'A2', 'B1']
+
+
+def test_refuses_empty_pull(tmp_path):
+    ingest(FULL, 'presale_delta', snapshot='20250101', key_cols=['編號'], base_dir=tmp_path)
+    with pytest.raises(ValueError):
+        ingest(FULL.iloc[:0], 'presale_delta', snapshot='20250102', key_cols=['編號'], base_dir=tmp_path)
+    assert len(reconstruct('presale_delta', base_dir=tmp_path)) == 3
+
+
+def test_reingest_same_snapshot_replaces_previous_changes(tmp_path):
+    ingest(FULL, 'presale_delta', snapshot='20250101', key_cols=['編號'], base_dir=tmp_path)
+    ingest(_frame([('A1', '臺北市', '甲'), ('B1', '新北市', '丙')]), 'presale_delta', snapshot='20250102',
+           key_cols=['編號'], cities=['臺北市', '新北市'], base_dir=tmp_path)
+    # 同一天重抓後 A2 又出現：沒有任何差異，先前記錄的刪除也要清除
+    changes = ingest(FULL, 'presale_delta', snapshot='20250102', key_cols=['編號'], base_dir=tmp_path)
+    assert not any(len(rows) for rows in changes.values())
+    assert sorted(reconstruct('presale_delta', base_dir=tmp_path)['編號']) == ['A1', 'A2', 'B1']
@@ -0,0 +1,27 @@
+import pandas as pd
+
+from storage import list_snapshots, read_dataset, write_dataset
+
+
+def _frame(rows):
+    return pd.DataFrame(rows, columns=['縣市', '建案名稱', '戶數'])
+
+
+def test_rewrite_replaces_whole_snapshot(tmp_path):
+    write_dataset(_frame([('臺北市', '甲', 10), ('新北市', '乙', 20)]), 'presale_output', snapshot='20250101',
+                  base_dir=tmp_path)
+    # 重寫同一個快照但只剩臺北市：新北市的舊分區不會留下
+    write_dataset(_frame([('臺北市', '丙', 30)]), 'presale_output', snapshot='20250101', base_dir=tmp_path)
+    df = read_dataset('presale_output', base_dir=tmp_path)
+    assert df['建案名稱'].astype(str).tolist() == ['丙']
+    assert df['縣市'].astype(str).tolist() == ['臺北市']
+
+
+def test_rewrite_keeps_other_snapshots(tmp_path):
+    write_dataset(_frame([('臺北市', '甲', 10)]), 'presale_output', snapshot='20250101', base_dir=tmp_path)
+    write_dataset(_frame([('新北市', '乙', 20)]), 'presale_output', snapshot='20250102', base_dir=tmp_path)
+    write_dataset(_frame([('新北市', '丙', 30)]), 'presale_output', snapshot='20250102', base_dir=tmp_path)
+    assert list_snapshots('presale_output', base_dir=tmp_path) == ['20250101', '20250102']
+    df = read_dataset('presale_output', snapshot=None, base_dir=tmp_path).sort_values('snapshot')
+    assert df['建案名稱'].astype(str).tolist() == ['甲', '丙']
+    assert df['戶數'].tolist() == [10, 30]
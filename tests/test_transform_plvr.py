@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+
+from aggregate import rollup
+from utils import transform_plvr
+
+
+def _raw_frame(total_prices, unit_prices):
+    count = len(total_prices)
+    return pd.DataFrame({
+        "a": ["中正區重慶南路一段122號"] * count,
+        "b": ["住宅大樓"] * count,
+        "bn": ["測試社區"] * count,
+        "cinfo": [""] * count,
+        "e": ["113/05/01"] * count,
+        "s": ["30.5"] * count,
+        "tp": total_prices,
+        "p": unit_prices,
+        "lat": ["25.04"] * count,
+        "lon": ["121.51"] * count,
+        "city_name": ["臺北市"] * count,
+    })
+
+
+def test_unparseable_prices_are_missing():
+    df = transform_plvr(_raw_frame(["12,340,000", "--", None], ["1,050,000", "", "abc"]))
+    assert str(df["交易總價"].dtype) == "Int32"
+    assert df["交易總價"].iloc[0] == 1234
+    assert df["交易總價"].iloc[1:].isna().all()
+    assert df["建物單價"].dtype == np.float32
+    assert df["建物單價"].iloc[0] == np.float32(105.0)
+    assert df["建物單價"].iloc[1:].isna().all()
+
+
+def test_missing_prices_do_not_lower_medians():
+    df = transform_plvr(_raw_frame(["10,000,000", "20,000,000", "--"], ["1,000,000", "1,200,000", "--"]))
+    stats = rollup(df, ["縣市"])
+    assert stats["筆數"].iloc[0] == 3
+    assert stats["交易總價中位數"].iloc[0] == 1500
+    assert np.isclose(stats["建物單價中位數"].iloc[0], 110)
@@ -0,0 +1,78 @@
+import time
+
+import pytest
+
+from journal import CrawlJournal
+from workqueue import DETAIL, WorkQueue, _LeaseKeeper, _run_task
+
+
+class FakeSpider():
+    """ 取得詳情前呼叫 on_detail (模擬處理期間發生的事)，回傳固定的詳情 """
+    def __init__(self, on_detail):
+        self.on_detail = on_detail
+
+    def get_newhouse_detail(self, hid):
+        self.on_detail()
+        return {'detail': {'hid': hid}}, None
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.sqlite'), lease_seconds=0.2, max_retries=3)
+    yield queue
+    queue.close()
+
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = CrawlJournal(str(tmp_path / 'journal.sqlite'))
+    yield journal
+    journal.close()
+
+
+def _status(queue, key):
+    return queue._db.execute('SELECT status, attempts FROM tasks WHERE key = ?', (key,)).fetchone()
+
+
+def test_expired_lease_counts_as_attempt(queue):
+    queue.put(DETAIL, '1', {'hid': '1'})
+    for attempt in range(3):
+        task = queue.lease(f'worker-{attempt}')
+        assert task is not None and task['attempts'] == attempt
+        time.sleep(0.25)  # worker 當掉，lease 逾期
+    # 每次都讓 worker 當掉的任務超過重試次數後成為 dead，不再被領取
+    assert queue.lease('worker-3') is None
+    assert _status(queue, '1') == ('dead', 3)
+    assert queue.unfinished() == 0
+
+
+def test_stale_worker_does_not_write_results(queue, journal):
+    queue.put(DETAIL, '1', {'hid': '1'})
+    task = queue.lease('slow')
+
+    def taken_over():
+        time.sleep(0.25)
+        assert queue.lease('fast') is not None
+
+    _run_task(task, queue, journal, FakeSpider(on_detail=taken_over), 'slow')
+    assert journal.detail('1') is None
+    assert _status(queue, '1') == ('leased', 1)
+
+
+def test_lease_keeper_extends_long_tasks(queue, journal):
+    queue.put(DETAIL, '1', {'hid': '1'})
+    task = queue.lease('slow')
+    stolen = []
+
+    def other_workers():
+        # 處理時間 (0.5 秒) 超過 lease_seconds (0.2 秒)，期間其他 worker 領不到這個任務
+        started = time.monotonic()
+        while time.monotonic() - started < 0.5:
+            stolen.append(queue.lease('other'))
+            time.sleep(0.05)
+
+    with _LeaseKeeper(queue, task, 'slow'):
+        _run_task(task, queue, journal, FakeSpider(on_detail=other_workers), 'slow')
+    assert not any(stolen)
+    assert journal.detail('1') == {'hid': '1'}
+    assert _status(queue, '1') == ('done', 1)